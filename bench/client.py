@@ -0,0 +1,114 @@
+import asyncio
+import json
+import time
+import urllib.parse
+import urllib.request
+from collections import defaultdict, deque
+
+from websockets.asyncio.client import connect
+
+
+def http(base: str, method: str, path: str, params: dict | None = None, token: str | None = None, body=None):
+    url = base.rstrip('/') + path
+    if params:
+        url += '?' + urllib.parse.urlencode(params)
+    headers = {'Content-Type': 'application/json'}
+    if token:
+        headers['Authorization'] = token
+    data = json.dumps(body).encode() if body is not None else None
+    request = urllib.request.Request(url, data=data, method=method, headers=headers)
+    with urllib.request.urlopen(request) as response:
+        raw = response.read()
+    return json.loads(raw) if raw else None
+
+
+async def register(base: str, login: str, password: str = 'password1518') -> tuple[str, int]:
+    res = await asyncio.to_thread(http, base, 'POST', '/auth/register', {
+        'login': login, 'password': password, 'name': 'Bench', 'surname': login[:30]})
+    return res['token'], res['id']
+
+
+def percentile(values: list[float], p: float) -> float:
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(int(len(values) * p), len(values) - 1)]
+
+
+class Player:
+    def __init__(self, ws_url: str, token: str, user_id: int, ignore: tuple = ()) -> None:
+        self.ws_url = ws_url
+        self.token = token
+        self.user_id = user_id
+        # events that are only counted, e.g. lobby broadcasts nobody waits for
+        self.ignore = set(ignore)
+        self.ws = None
+        self.reader_task = None
+        self.inbox: dict[str, deque] = defaultdict(deque)
+        self.waiters: dict[str, list[asyncio.Future]] = defaultdict(list)
+        self.last_seq = 0
+        self.received = 0
+
+    async def connect(self) -> None:
+        self.ws = await connect(self.ws_url, max_size=None)
+        self.reader_task = asyncio.create_task(self.reader())
+
+    async def close(self) -> None:
+        if self.reader_task:
+            self.reader_task.cancel()
+        if self.ws:
+            await self.ws.close()
+
+    async def reader(self) -> None:
+        async for message in self.ws:
+            data = json.loads(message)
+            self.received += 1
+            self.last_seq = max(self.last_seq, data.get('seq', 0))
+            event = data.get('event')
+            if event in self.ignore:
+                continue
+            waiters = self.waiters[event]
+            while waiters and waiters[0].done():
+                waiters.pop(0)
+            if waiters:
+                waiters.pop(0).set_result(data)
+            else:
+                self.inbox[event].append(data)
+
+    async def send(self, event: str, **data) -> None:
+        await self.ws.send(json.dumps({'event': event, 'token': self.token} | data))
+
+    async def wait(self, *events: str, timeout: float = 60) -> dict:
+        for event in events:
+            if self.inbox[event]:
+                return self.inbox[event].popleft()
+        future = asyncio.get_running_loop().create_future()
+        for event in events:
+            self.waiters[event].append(future)
+        try:
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            for event in events:
+                if future in self.waiters[event]:
+                    self.waiters[event].remove(future)
+
+    async def request(self, event: str, reply: str | tuple, timeout: float = 60, **data) -> tuple[dict, float]:
+        replies = (reply,) if isinstance(reply, str) else reply
+        start = time.perf_counter()
+        await self.send(event, **data)
+        res = await self.wait(*replies, 'error', timeout=timeout)
+        return res, time.perf_counter() - start
+
+
+def scrape_metrics(base: str, token: str | None = None) -> dict[str, float]:
+    # /metrics samples as {'name{labels}': value}
+    request = urllib.request.Request(base.rstrip('/') + '/metrics',
+                                     headers={'Authorization': f'Bearer {token}'} if token else {})
+    with urllib.request.urlopen(request) as response:
+        text = response.read().decode()
+    samples = {}
+    for line in text.splitlines():
+        if line and not line.startswith('#'):
+            name, value = line.rsplit(' ', 1)
+            samples[name] = float(value)
+    return samples
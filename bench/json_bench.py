@@ -0,0 +1,82 @@
+import argparse
+import json
+import random
+import time
+
+from fastapi.encoders import jsonable_encoder
+
+import utils
+
+# Compares the old json_response path (jsonable_encoder + stdlib json) with utils.dumps
+# on payloads shaped like /tasks/get and /status/top_players.
+# python -m bench.json_bench --tasks 5000 --users 100000
+
+
+def tasks_payload(rnd: random.Random, count: int) -> dict:
+    words = ['функция', 'предел', 'интеграл', 'производная', 'ряд', 'x^2', '\\frac{1}{n}', 'сходится', 'найдите']
+    return {'tasks': [{
+        'id': i,
+        'level': rnd.randint(0, 10),
+        'category': rnd.randint(1, 5),
+        'subcategory': rnd.sample(range(1, 40), 3),
+        'condition': ' '.join(rnd.choices(words, k=80)),
+        'solution': ' '.join(rnd.choices(words, k=200)),
+        'answer': str(rnd.randint(0, 1000)),
+        'source': 'problems.ru',
+        'answer_type': 'string',
+    } for i in range(count)]}
+
+
+def top_players_payload(rnd: random.Random, count: int) -> list:
+    return [{
+        'id': i,
+        'name': f'Игрок {i} Ф.',
+        'points': rnd.randint(500, 2500),
+        'place': i + 1,
+    } for i in range(count)]
+
+
+def old_path(data) -> bytes:
+    # what JSONResponse(jsonable_encoder(data)) did before
+    return json.dumps(jsonable_encoder(data), ensure_ascii=False, allow_nan=False, indent=None,
+                      separators=(',', ':')).encode()
+
+
+def measure(fn, data, repeat: int) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        t = time.perf_counter()
+        fn(data)
+        best = min(best, time.perf_counter() - t)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--tasks', type=int, default=5000)
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=1518)
+    args = parser.parse_args()
+
+    rnd = random.Random(args.seed)
+    payloads = {
+        '/tasks/get': tasks_payload(rnd, args.tasks),
+        '/status/top_players': top_players_payload(rnd, args.users),
+    }
+    result = {'encoder': 'orjson' if utils.orjson is not None else 'json'}
+    for name, data in payloads.items():
+        assert json.loads(old_path(data)) == json.loads(utils.dumps(data))
+        old = measure(old_path, data, args.repeat)
+        new = measure(utils.dumps, data, args.repeat)
+        result[name] = {
+            'bytes': len(utils.dumps(data)),
+            'old_ms': round(old * 1000, 2),
+            'new_ms': round(new * 1000, 2),
+            'speedup': round(old / new, 1),
+        }
+    print(json.dumps(result, indent=4, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
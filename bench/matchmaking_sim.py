@@ -0,0 +1,59 @@
+import argparse
+import json
+import random
+import time
+
+from matchmaking import Matchmaker
+
+# python -m bench.matchmaking_sim --players 10000
+# all players queued at once with no initial window:
+# python -m bench.matchmaking_sim --arrivals 10000 --base-window 0 --widen-rate 1
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--players', type=int, default=10000)
+    parser.add_argument('--arrivals', type=int, default=200, help='players joining per simulated second')
+    parser.add_argument('--categories', type=int, default=5)
+    parser.add_argument('--base-window', type=int, default=100)
+    parser.add_argument('--widen-rate', type=float, default=25)
+    parser.add_argument('--seed', type=int, default=1518)
+    args = parser.parse_args()
+
+    rnd = random.Random(args.seed)
+    level_ranges = [(0, 10), (0, 3), (4, 7), (8, 10)]
+    players = [(i, int(rnd.gauss(1000, 200)), rnd.randrange(args.categories), rnd.choice(level_ranges))
+               for i in range(args.players)]
+
+    mm = Matchmaker(args.base_window, args.widen_rate)
+    mm.started = 0
+    now = 0.0
+    enqueue_time = 0.0
+    sweep_time = 0.0
+    i = 0
+    while i < len(players) or (mm.by_user and now < 600):
+        t = time.perf_counter()
+        for user_id, rating, category, (level_start, level_end) in players[i:i + args.arrivals]:
+            params = {'category': category, 'level_start': level_start, 'level_end': level_end, 'count': 5, 'time_limit': 10}
+            mm.enqueue(user_id, rating, params, now=now + rnd.random())
+        enqueue_time += time.perf_counter() - t
+        i += args.arrivals
+        now += 1
+
+        t = time.perf_counter()
+        mm.sweep(now)
+        sweep_time += time.perf_counter() - t
+
+    stats = mm.stats(now)
+    print(json.dumps({
+        'players': args.players,
+        'simulated_seconds': now,
+        'enqueue_per_second': args.players / enqueue_time if enqueue_time else None,
+        'enqueue_seconds': round(enqueue_time, 4),
+        'sweep_seconds': round(sweep_time, 4),
+        'pairs_per_second': stats['matched'] / (enqueue_time + sweep_time),
+    } | stats, indent=4))
+
+
+if __name__ == '__main__':
+    main()
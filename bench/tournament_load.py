@@ -0,0 +1,106 @@
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+
+from bench.client import Player, http, percentile, register
+
+# Runs one swiss tournament with --players participants (500 simultaneous rooms by default)
+# against a running server. The server should use a local answer checker, not the real GigaChat.
+# python -m bench.tournament_load --url http://localhost:8000 --admin-token <token>
+
+
+async def play(player: Player, args, latencies: list[float], stats: dict) -> None:
+    for _ in range(args.rounds):
+        await player.wait('tournament_round', timeout=args.round_timeout)
+        while True:
+            event = await player.wait('new_task', 'scores', timeout=args.round_timeout)
+            if event['event'] == 'scores':
+                stats['games'] += 1
+                break
+            await asyncio.sleep(random.uniform(args.think_min, args.think_max))
+            res, latency = await player.request('send_answer', 'check_result', answer='42', time=5)
+            if res['event'] == 'error':
+                stats['errors'] += 1
+            else:
+                latencies.append(latency)
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--url', default='http://localhost:8000')
+    parser.add_argument('--admin-token', required=True)
+    parser.add_argument('--players', type=int, default=1000)
+    parser.add_argument('--rounds', type=int, default=1)
+    parser.add_argument('--count', type=int, default=3)
+    parser.add_argument('--time-limit', type=int, default=5)
+    parser.add_argument('--think-min', type=float, default=0.5)
+    parser.add_argument('--think-max', type=float, default=3)
+    parser.add_argument('--round-timeout', type=float, default=600)
+    parser.add_argument('--concurrency', type=int, default=50)
+    args = parser.parse_args()
+    if args.players % 2:
+        parser.error('--players must be even, otherwise someone gets a bye and never receives a room')
+
+    ws_url = args.url.replace('http', 'ws', 1).rstrip('/') + '/ws'
+    prefix = uuid.uuid4().hex[:8]
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def make_player(i: int) -> Player:
+        async with semaphore:
+            token, user_id = await register(args.url, f'{prefix}{i}')
+            player = Player(ws_url, token, user_id)
+            await player.connect()
+            await player.request('ping', 'pong')
+            return player
+
+    t = time.perf_counter()
+    players = await asyncio.gather(*(make_player(i) for i in range(args.players)))
+    setup_time = time.perf_counter() - t
+
+    tournament = await asyncio.to_thread(http, args.url, 'POST', '/tournament/create', token=args.admin_token, body={
+        'name': f'load {prefix}',
+        'players': [x.user_id for x in players],
+        'rounds': args.rounds,
+        'count': args.count,
+        'time_limit': args.time_limit,
+        'round_pause': 1,
+    })
+
+    latencies = []
+    stats = {'games': 0, 'errors': 0}
+    games = asyncio.gather(*(play(x, args, latencies, stats) for x in players))
+
+    t = time.perf_counter()
+    await asyncio.to_thread(http, args.url, 'POST', f'/tournament/{tournament["id"]}/start', token=args.admin_token)
+    start_round_time = time.perf_counter() - t
+    await games
+    total_time = time.perf_counter() - t
+
+    standings = await asyncio.to_thread(http, args.url, 'GET', f'/tournament/{tournament["id"]}/standings',
+                                        token=args.admin_token)
+    for x in players:
+        await x.close()
+
+    print(json.dumps({
+        'players': args.players,
+        'rooms_per_round': args.players // 2,
+        'rounds': args.rounds,
+        'setup_seconds': round(setup_time, 3),
+        'start_round_seconds': round(start_round_time, 3),
+        'total_seconds': round(total_time, 3),
+        'games_finished': stats['games'] // 2,
+        'answer_errors': stats['errors'],
+        'answers': len(latencies),
+        'answers_per_second': len(latencies) / total_time,
+        'answer_latency_p50': percentile(latencies, 0.5),
+        'answer_latency_p99': percentile(latencies, 0.99),
+        'status': standings['status'],
+        'leader': standings['standings'][0],
+    }, indent=4, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,205 @@
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+from collections import defaultdict
+
+from bench.client import Player, percentile, register, scrape_metrics
+
+# Battle load generator: registers --rooms * --players-per-room users, opens a socket per user and runs
+# --cycles create_room / join_room / start_game / send_answer games in every room with think time.
+# The server must run with ANSWER_CHECKER=fake (FAKE_CHECKER_* model GigaChat, see checkers.py) and one worker,
+# so /metrics and the memory numbers come from the worker that holds the rooms; /metrics needs METRICS_TOKEN
+# on the server and the same value in --metrics-token.
+# Measure every change to the battle path against it:
+# python -m bench.ws_load --url http://localhost:8000 --metrics-token <token> --rooms 200 --cycles 3 --out ws_load.json
+
+# broadcasts nobody waits for, counted but not queued
+IGNORED_EVENTS = ('room_created', 'room_deleted', 'player_left', 'player_joined', 'other_solved', 'game_started')
+
+
+class Load:
+    def __init__(self, args) -> None:
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.latencies: dict[str, list[float]] = defaultdict(list)
+        self.errors: dict[str, int] = defaultdict(int)
+        self.games = 0
+
+    async def request(self, player: Player, event: str, reply: str | tuple, **data) -> dict | None:
+        res, latency = await player.request(event, reply, timeout=self.args.timeout, **data)
+        if res['event'] == 'error':
+            self.errors[event] += 1
+            return None
+        self.latencies[event].append(latency)
+        return res
+
+    async def think(self) -> None:
+        await asyncio.sleep(self.rng.uniform(self.args.think_min, self.args.think_max))
+
+    async def play(self, player: Player, event: dict) -> None:
+        answered = 0
+        while event['event'] != 'scores':
+            if self.args.state_every and answered % self.args.state_every == 0:
+                # a current seq gets game_delta, a stale one the full game_state; both count as get_game_state
+                await self.request(player, 'get_game_state', ('game_state', 'game_delta'), seq=player.last_seq)
+            await self.think()
+            answered += 1
+            await self.request(player, 'send_answer', 'check_result',
+                               answer=str(self.rng.randint(0, 10 ** 6)), time=answered)
+            event = await player.wait('new_task', 'scores', timeout=self.args.timeout)
+
+    async def game(self, group: list[Player], cycle: int) -> bool:
+        args = self.args
+        host, others = group[0], group[1:]
+        params = {'name': f'load {host.user_id} #{cycle}', 'count': args.count, 'time_limit': args.time_limit,
+                  'max_players': len(group)}
+        if args.category is not None:
+            params['category'] = args.category
+        created = await self.request(host, 'create_room', 'your_room_created', **params)
+        if created is None:
+            return False
+        for x in others:
+            await self.think()
+            if await self.request(x, 'join_room', 'join_successful', room_id=created['room_id']) is None:
+                await host.request('leave_room', 'leave_successful')
+                return False
+
+        first = await self.request(host, 'start_game', 'new_task')
+        if first is None:
+            await host.request('leave_room', 'leave_successful')
+            return False
+        tasks = [await x.wait('new_task', timeout=args.timeout) for x in others]
+        await asyncio.gather(*(self.play(x, event) for x, event in zip(group, [first] + tasks)))
+        self.games += 1
+        return True
+
+    async def room(self, group: list[Player]) -> None:
+        for cycle in range(self.args.cycles):
+            if not await self.game(group, cycle):
+                return
+
+
+async def monitor(args, samples: list[dict], stop: asyncio.Event) -> None:
+    while not stop.is_set():
+        try:
+            metrics = await asyncio.to_thread(scrape_metrics, args.url, args.metrics_token)
+            samples.append({'rss': metrics.get('process_resident_memory_bytes', 0),
+                            'started': metrics.get('battle_rooms{status="started"}', 0)})
+        except OSError as e:
+            print(f'/metrics недоступен: {e}')
+            return
+        try:
+            await asyncio.wait_for(stop.wait(), args.metrics_interval)
+        except asyncio.TimeoutError:
+            pass
+
+
+def server_sql(before: dict, after: dict) -> dict:
+    # SQL statements per websocket event on the server during the run
+    res = {}
+    for name, value in after.items():
+        if name.startswith('ws_event_sql_queries_sum{'):
+            count_name = name.replace('_sum{', '_count{', 1)
+            count = after.get(count_name, 0) - before.get(count_name, 0)
+            if count:
+                event = name.split('"')[1]
+                res[event] = round((value - before.get(name, 0)) / count, 2)
+    return res
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--url', default='http://localhost:8000')
+    parser.add_argument('--rooms', type=int, default=50)
+    parser.add_argument('--players-per-room', type=int, default=2)
+    parser.add_argument('--cycles', type=int, default=1, help='games played one after another in every room')
+    parser.add_argument('--count', type=int, default=5, help='tasks per game')
+    parser.add_argument('--time-limit', type=int, default=10, help='minutes')
+    parser.add_argument('--category', type=int, default=None)
+    parser.add_argument('--think-min', type=float, default=0.5)
+    parser.add_argument('--think-max', type=float, default=3)
+    parser.add_argument('--state-every', type=int, default=0, help='get_game_state before every n-th answer')
+    parser.add_argument('--timeout', type=float, default=120)
+    parser.add_argument('--concurrency', type=int, default=50, help='parallel registrations')
+    parser.add_argument('--metrics-token', default=None)
+    parser.add_argument('--metrics-interval', type=float, default=1)
+    parser.add_argument('--seed', type=int, default=1518)
+    parser.add_argument('--out', default=None)
+    args = parser.parse_args()
+    if args.players_per_room < 2:
+        parser.error('--players-per-room must be at least 2')
+
+    ws_url = args.url.replace('http', 'ws', 1).rstrip('/') + '/ws'
+    prefix = uuid.uuid4().hex[:8]
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def make_player(i: int) -> Player:
+        async with semaphore:
+            token, user_id = await register(args.url, f'{prefix}{i}')
+            player = Player(ws_url, token, user_id, IGNORED_EVENTS)
+            await player.connect()
+            await player.request('ping', 'pong')
+            return player
+
+    t = time.perf_counter()
+    players = await asyncio.gather(*(make_player(i) for i in range(args.rooms * args.players_per_room)))
+    setup_time = time.perf_counter() - t
+    groups = [players[i:i + args.players_per_room] for i in range(0, len(players), args.players_per_room)]
+
+    before = await asyncio.to_thread(scrape_metrics, args.url, args.metrics_token)
+    samples = []
+    stop = asyncio.Event()
+    monitor_task = asyncio.create_task(monitor(args, samples, stop))
+
+    load = Load(args)
+    t = time.perf_counter()
+    await asyncio.gather(*(load.room(x) for x in groups))
+    total_time = time.perf_counter() - t
+    stop.set()
+    await monitor_task
+
+    after = await asyncio.to_thread(scrape_metrics, args.url, args.metrics_token)
+    received = sum(x.received for x in players)
+    for x in players:
+        await x.close()
+
+    baseline = before.get('process_resident_memory_bytes', 0)
+    peak = max(samples, key=lambda x: x['rss'], default={'rss': baseline, 'started': 0})
+    peak_rooms = max((x['started'] for x in samples), default=0)
+    requests = sum(len(x) for x in load.latencies.values()) + sum(load.errors.values())
+    result = {
+        'rooms': args.rooms,
+        'players_per_room': args.players_per_room,
+        'cycles': args.cycles,
+        'tasks_per_game': args.count,
+        'setup_seconds': round(setup_time, 3),
+        'total_seconds': round(total_time, 3),
+        'games_finished': load.games,
+        'requests': requests,
+        'requests_per_second': round(requests / total_time, 2),
+        'answers_per_second': round(len(load.latencies['send_answer']) / total_time, 2),
+        'messages_received': received,
+        'errors': dict(load.errors),
+        'latency': {event: {
+            'count': len(values),
+            'p50': round(percentile(values, 0.5), 4),
+            'p99': round(percentile(values, 0.99), 4),
+            'max': round(max(values), 4),
+        } for event, values in sorted(load.latencies.items())},
+        'server_sql_per_event': server_sql(before, after),
+        'server_rss_baseline_mb': round(baseline / 2 ** 20, 1),
+        'server_rss_peak_mb': round(peak['rss'] / 2 ** 20, 1),
+        'peak_started_rooms': peak_rooms,
+        'server_kb_per_room': round((peak['rss'] - baseline) / 1024 / peak_rooms, 1) if peak_rooms else None,
+    }
+    print(json.dumps(result, indent=4, ensure_ascii=False))
+    if args.out:
+        with open(args.out, 'w', encoding='utf8') as f:
+            json.dump(result, f, indent=4, ensure_ascii=False)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,73 @@
+from __future__ import annotations
+
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from fastapi import Request
+from fastapi.responses import Response
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+import os
+import time
+
+import database
+
+# how long a worker trusts its cached catalog version before asking the database again
+VERSION_TTL = float(os.getenv('CATALOG_VERSION_TTL', 5))
+
+# until the first import there is no version row; the fallback must be the same in every worker
+EPOCH = datetime(2000, 1, 1, tzinfo=timezone.utc)
+
+cache = {'version': 0, 'updated': EPOCH, 'expires': 0.0}
+
+
+async def get_version() -> tuple[int, datetime]:
+    if time.monotonic() < cache['expires']:
+        return cache['version'], cache['updated']
+    async with database.sessions() as session:
+        row = (await session.execute(
+            select(database.CatalogVersion.version, database.CatalogVersion.updated).where(database.CatalogVersion.id == 1))).first()
+    if row is not None:
+        cache['version'] = row.version
+        cache['updated'] = row.updated.replace(tzinfo=timezone.utc, microsecond=0)
+    cache['expires'] = time.monotonic() + VERSION_TTL
+    return cache['version'], cache['updated']
+
+
+async def bump(session) -> None:
+    # called inside the importing transaction, the new version becomes visible with the imported tasks
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    await session.execute(pg_insert(database.CatalogVersion).values(id=1, version=1, updated=now).on_conflict_do_update(
+        index_elements=[database.CatalogVersion.id],
+        set_={'version': database.CatalogVersion.version + 1, 'updated': now}))
+    cache['expires'] = 0.0
+
+
+async def validators() -> dict:
+    version, updated = await get_version()
+    return {
+        'ETag': f'W/"catalog-{version}"',
+        'Last-Modified': format_datetime(updated, usegmt=True),
+        'Cache-Control': 'no-cache',
+    }
+
+
+def is_fresh(request: Request, headers: dict) -> bool:
+    if_none_match = request.headers.get('if-none-match')
+    if if_none_match is not None:
+        tags = [x.strip() for x in if_none_match.split(',')]
+        return '*' in tags or headers['ETag'] in tags or headers['ETag'][2:] in tags
+    if_modified_since = request.headers.get('if-modified-since')
+    if if_modified_since is not None:
+        try:
+            return parsedate_to_datetime(if_modified_since) >= parsedate_to_datetime(headers['Last-Modified'])
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+async def not_modified(request: Request) -> tuple[dict, Response | None]:
+    # returns the validator headers and a ready 304 response when the client copy is current
+    headers = await validators()
+    if is_fresh(request, headers):
+        return headers, Response(status_code=304, headers=headers)
+    return headers, None
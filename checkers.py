@@ -0,0 +1,166 @@
+from __future__ import annotations
+
+from abc import ABC, abstractmethod
+import asyncio
+import hashlib
+import json
+import os
+import random
+
+try:
+    from gigachat import GigaChat
+except ImportError:
+    GigaChat = None
+
+# Answer checking backends. GigaChatChecker asks the model; FakeChecker answers locally with deterministic
+# verdicts and injected latency, errors and timeouts, so load tests (bench/ws_load.py) and CI can model
+# the upstream without network. ANSWER_CHECKER picks the backend, utils.gigachat_check_* delegate to it.
+# Both return the model's text: "Да" for a correct answer, otherwise "Нет" or an explanation (training).
+
+
+class CheckerError(Exception):
+    pass
+
+
+class AnswerChecker(ABC):
+    name = ''
+
+    @abstractmethod
+    async def check_answer(self, user_answer: str, task_condition: str, task_answer: str) -> str:
+        ...
+
+    @abstractmethod
+    async def check_training_answer(self, user_answer: str, user_solution: str, task_condition: str,
+                                    task_answer: str, task_solution: str) -> str:
+        ...
+
+
+class GigaChatChecker(AnswerChecker):
+    name = 'gigachat'
+
+    def __init__(self) -> None:
+        if GigaChat is None:
+            raise RuntimeError('ANSWER_CHECKER=gigachat требует пакет gigachat')
+
+    @staticmethod
+    def client(**kwargs):
+        return GigaChat(credentials=os.getenv('GIGACHAT_AUTHORIZATION_KEY'), verify_ssl_certs=False,
+                        scope=os.getenv('GIGACHAT_API_PERS'), **kwargs)
+
+    def check_answer_sync(self, user_answer, task_condition, task_answer):
+        with self.client(timeout=7) as giga:
+            answer = giga.chat(json.dumps({'условие задачи': task_condition,
+                                           'правильный ответ на задачу': task_answer,
+                                           'ответ пользователя': user_answer,
+                                           'формат ответа': 'Да или нет. Только одно слово без размышлений!!',
+                                           'что нужно сделать':
+                                               'проверить совпадает ли ответ пользователя с ответом автора на условие задачи, если ответ пользователя'
+                                               'является синонимом к правильному ответ или ответ юзера верный но без уточнений, если это уточнение не влияет на правильность ответа, нужно засчитывать за правильный без объяснения.'
+                                               'если в задаче несколько пунктов, совпадать должны все!'},
+                                          ensure_ascii=False))
+            return answer.choices[0].message.content
+
+    def check_training_answer_sync(self, user_answer, user_solution, task_condition, task_answer, task_solution):
+        with self.client() as giga:
+            answer = giga.chat(json.dumps({'условие задачи': task_condition,
+                                           'правильный ответ на задачу': task_answer,
+                                           'правильное решение задачи': task_solution,
+                                           'ответ пользователя': user_answer,
+                                           'решение пользователя': user_solution,
+                                           'что нужно сделать':
+                                               'проверить совпадает ли ответ пользователя с правильным ответом на задачу, если он совпадает,'
+                                               ' то вывести Да только одним словом ,'
+                                               ' если не совпадает, проверить решение пользователя, если оно предоставлено, и объяснить где пользователь совершил ошибку, сравнивая с правильным решением задачи, правильное решение и правильный ответ и условие задачи нельзя подвергать сомнению! Если ответ пользователя неверный, то решение пользователя никак НЕ может быть верным и ты не должен с ним соглашаться, необходимо четко указать на ошибку в решении пользователя. в своём объяснении не используй markdown формат ответа, отвечай в виде html!!! правильный ответ нельзя напрямую говорить пользователю ни в коем случае!!! только указывать на его ошибку'}, ensure_ascii=False))
+            return answer.choices[0].message.content
+
+    async def check_answer(self, user_answer, task_condition, task_answer):
+        # the client is synchronous, it runs in the thread pool
+        return await asyncio.to_thread(self.check_answer_sync, user_answer, task_condition, task_answer)
+
+    async def check_training_answer(self, user_answer, user_solution, task_condition, task_answer, task_solution):
+        return await asyncio.to_thread(self.check_training_answer_sync,
+                                       user_answer, user_solution, task_condition, task_answer, task_solution)
+
+
+def parse_latency(spec: str):
+    # "0.3" or "fixed:0.3", "uniform:0.1,0.8", "normal:0.5,0.2", "lognormal:<median>,<sigma>", "exp:<mean>"
+    kind, _, values = spec.partition(':') if ':' in spec else ('fixed', '', spec)
+    params = [float(x) for x in values.split(',')] if values else []
+    samplers = {
+        'fixed': lambda rng, x: x,
+        'uniform': lambda rng, a, b: rng.uniform(a, b),
+        'normal': lambda rng, mean, std: max(rng.gauss(mean, std), 0),
+        'lognormal': lambda rng, median, sigma: median * rng.lognormvariate(0, sigma),
+        'exp': lambda rng, mean: rng.expovariate(1 / mean) if mean > 0 else 0,
+    }
+    if kind not in samplers:
+        raise ValueError(f'неизвестное распределение задержки: {spec}')
+    sampler = samplers[kind]
+    sampler(random.Random(), *params)
+    return lambda rng: sampler(rng, *params)
+
+
+class FakeChecker(AnswerChecker):
+    name = 'fake'
+
+    def __init__(self, latency: str = '0.3', correct_rate: float = 0.5, verdicts: str = 'hash',
+                 error_rate: float = 0, timeout_rate: float = 0, timeout: float = 7, seed: int | None = None) -> None:
+        if verdicts not in ('hash', 'exact', 'always', 'never'):
+            raise ValueError(f'неизвестный режим вердиктов: {verdicts}')
+        self.latency = parse_latency(latency)
+        self.correct_rate = correct_rate
+        self.verdicts = verdicts
+        self.error_rate = error_rate
+        self.timeout_rate = timeout_rate
+        self.timeout = timeout
+        # latency, errors and timeouts are random but reproducible with a seed; verdicts never are random
+        self.rng = random.Random(seed)
+
+    def verdict(self, user_answer, task_answer) -> bool:
+        if self.verdicts in ('always', 'never'):
+            return self.verdicts == 'always'
+        if str(user_answer).strip().lower() == str(task_answer or '').strip().lower():
+            return True
+        if self.verdicts == 'exact':
+            return False
+        # the same answer to the same task always gets the same verdict
+        digest = hashlib.blake2b(f'{user_answer}\n{task_answer}'.encode(), digest_size=8).digest()
+        return int.from_bytes(digest, 'little') / 2 ** 64 < self.correct_rate
+
+    async def call(self) -> None:
+        roll = self.rng.random()
+        if roll < self.timeout_rate:
+            # the real client gives up after its timeout
+            await asyncio.sleep(self.timeout)
+            raise TimeoutError('GigaChat не ответил (fake)')
+        await asyncio.sleep(self.latency(self.rng))
+        if roll < self.timeout_rate + self.error_rate:
+            raise CheckerError('ошибка GigaChat (fake)')
+
+    async def check_answer(self, user_answer, task_condition, task_answer):
+        await self.call()
+        return 'Да' if self.verdict(user_answer, task_answer) else 'Нет'
+
+    async def check_training_answer(self, user_answer, user_solution, task_condition, task_answer, task_solution):
+        await self.call()
+        return 'Да' if self.verdict(user_answer, task_answer) else '<p>Ответ неверный.</p>'
+
+
+def create_checker(name: str) -> AnswerChecker:
+    if name == 'gigachat':
+        return GigaChatChecker()
+    if name == 'fake':
+        seed = os.getenv('FAKE_CHECKER_SEED')
+        return FakeChecker(
+            latency=os.getenv('FAKE_CHECKER_LATENCY', '0.3'),
+            correct_rate=float(os.getenv('FAKE_CHECKER_CORRECT_RATE', 0.5)),
+            verdicts=os.getenv('FAKE_CHECKER_VERDICTS', 'hash'),
+            error_rate=float(os.getenv('FAKE_CHECKER_ERROR_RATE', 0)),
+            timeout_rate=float(os.getenv('FAKE_CHECKER_TIMEOUT_RATE', 0)),
+            timeout=float(os.getenv('FAKE_CHECKER_TIMEOUT', 7)),
+            seed=int(seed) if seed else None,
+        )
+    raise ValueError(f'неизвестный ANSWER_CHECKER: {name}')
+
+
+checker = create_checker(os.getenv('ANSWER_CHECKER', 'gigachat'))
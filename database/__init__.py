@@ -1,10 +1,47 @@
-from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from dotenv import load_dotenv
+from typing import AsyncIterator
 import os
+import time
 
 from .database import *
 
 load_dotenv()
 
-engine = create_async_engine(f'postgresql+asyncpg://{os.getenv("DB_USER")}:{os.getenv("DB_PASSWORD")}@{os.getenv("DB_HOST")}/{os.getenv("DB_NAME")}', pool_pre_ping=True)
+# after load_dotenv, metrics reads its settings from the environment
+import metrics
+
+# pool sizing per worker; pre-ping costs a round trip on every checkout, recycling old connections
+# covers the usual case of connections dropped by the server or a proxy
+POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 10))
+MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', 20))
+POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', 1800))
+POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 30))
+POOL_PRE_PING = os.getenv('DB_POOL_PRE_PING', '0').lower() in ('1', 'true', 'yes')
+
+
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    # time spent waiting for a free connection, the first sign of an undersized pool
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            metrics.pool_timeouts.inc()
+            raise
+        finally:
+            metrics.pool_wait.observe(time.perf_counter() - start)
+
+
+engine = create_async_engine(f'postgresql+asyncpg://{os.getenv("DB_USER")}:{os.getenv("DB_PASSWORD")}@{os.getenv("DB_HOST")}/{os.getenv("DB_NAME")}',
+                             poolclass=TimedQueuePool, pool_size=POOL_SIZE, max_overflow=MAX_OVERFLOW,
+                             pool_recycle=POOL_RECYCLE, pool_timeout=POOL_TIMEOUT, pool_pre_ping=POOL_PRE_PING)
 sessions = async_sessionmaker(engine)
+
+
+async def get_session() -> AsyncIterator[AsyncSession]:
+    # one session and transaction for the whole request, see utils.Session
+    async with sessions.begin() as session:
+        yield session
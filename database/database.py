@@ -1,5 +1,5 @@
 from sqlalchemy.orm import Mapped, mapped_column, DeclarativeBase
-from sqlalchemy import ForeignKey, Integer, String, JSON, DateTime, Column, ARRAY, Boolean
+from sqlalchemy import ForeignKey, Integer, String, JSON, DateTime, Column, ARRAY, Boolean, Text, Index, func, text, LargeBinary
 from typing import Optional
 from datetime import datetime
 
@@ -18,11 +18,20 @@ class Users(MainBase):
     points: Mapped[int]
     name: Mapped[str]
     surname: Mapped[str]
-    status: Mapped[Optional[str]] = mapped_column(String, default=None)  # training / battle / None
+    status: Mapped[Optional[str]] = mapped_column(String, default=None, index=True)  # training / battle / None
     current_training: Mapped[Optional[dict]] = mapped_column(JSON, default=None)
     blocked: Mapped[bool] = mapped_column(Boolean, default=False)
 
 
+# admin listing: keyset sort keys, case-insensitive prefix search and filters
+Index('ix_users_points_id', Users.points, Users.id)
+Index('ix_users_name_id', Users.name, Users.id)
+Index('ix_users_role_id', Users.role, Users.id)
+Index('ix_users_blocked_id', Users.id, postgresql_where=text('blocked'))
+Index('ix_users_login_prefix', func.lower(Users.login).label('login_lower'), postgresql_ops={'login_lower': 'text_pattern_ops'})
+Index('ix_users_name_prefix', func.lower(Users.name).label('name_lower'), postgresql_ops={'name_lower': 'text_pattern_ops'})
+
+
 class Categories(MainBase):
     __tablename__ = 'categories'
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
@@ -49,13 +58,30 @@ class Tasks(MainBase):
     answer_type: Mapped[str]
 
 
+class TaskSignatures(MainBase):
+    # MinHash signature of the condition text, see dedup.py
+    __tablename__ = 'task_signatures'
+    task_id: Mapped[int] = mapped_column(Integer, ForeignKey(Tasks.id, ondelete='CASCADE'), primary_key=True)
+    signature: Mapped[bytes] = mapped_column(LargeBinary)
+    duplicate_of: Mapped[Optional[int]] = mapped_column(Integer, index=True)
+
+
 class BattleHistory(MainBase):
     __tablename__ = 'battle_history'
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
-    id1: Mapped[int] = mapped_column(Integer, ForeignKey(Users.id))
-    id2: Mapped[int] = mapped_column(Integer, ForeignKey(Users.id))
+    id1: Mapped[int] = mapped_column(Integer, ForeignKey(Users.id), index=True)
+    id2: Mapped[int] = mapped_column(Integer, ForeignKey(Users.id), index=True)
     data: Mapped[dict] = mapped_column(JSON)
-    date: Mapped[datetime]
+    date: Mapped[datetime] = mapped_column(index=True)
+
+
+class BattlePlayers(MainBase):
+    # every participant of a battle, id1/id2 only hold the first two seats
+    __tablename__ = 'battle_players'
+    __table_args__ = (Index('ix_battle_players_user_battle', 'user_id', 'battle_id'),)
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    battle_id: Mapped[int] = mapped_column(Integer, ForeignKey(BattleHistory.id), index=True)
+    user_id: Mapped[int] = mapped_column(Integer, ForeignKey(Users.id))
 
 
 class Analytics(MainBase):
@@ -64,3 +90,35 @@ class Analytics(MainBase):
     date: Mapped[datetime]
     data: Mapped[dict] = mapped_column(JSON)
     userid: Mapped[int] = mapped_column(Integer, ForeignKey(Users.id))
+
+
+class BattleSnapshots(MainBase):
+    __tablename__ = 'battle_snapshots'
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    seq: Mapped[int]
+    data: Mapped[str] = mapped_column(Text)  # serialized once with json.dumps
+    date: Mapped[datetime]
+
+
+class BattleJournal(MainBase):
+    __tablename__ = 'battle_journal'
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    seq: Mapped[int] = mapped_column(Integer, index=True)
+    room_id: Mapped[int]
+    kind: Mapped[str]  # start / answer / end
+    data: Mapped[dict] = mapped_column(JSON)
+
+
+class CatalogVersion(MainBase):
+    # single row, bumped by every task import, used for ETag / Last-Modified of catalog endpoints
+    __tablename__ = 'catalog_version'
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    version: Mapped[int]
+    updated: Mapped[datetime]
+
+
+def create_indexes(connection) -> None:
+    # create_all skips tables that already exist, indexes added to old tables are created here
+    for table in MainBase.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(connection, checkfirst=True)
@@ -0,0 +1,226 @@
+from __future__ import annotations
+
+from array import array
+from hashlib import blake2b
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+import argparse
+import asyncio
+import json
+import os
+import re
+import time
+
+import catalog
+import database
+
+# Near-duplicate detection over normalized condition text: word 3-gram shingles, a 128 value
+# one-permutation MinHash signature (one hash per shingle instead of 128) and an LSH index with
+# 16 bands of 8 rows, so a new task is compared only with tasks sharing a band, not with the whole table.
+
+NUM_PERM = 128
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+THRESHOLD = float(os.getenv('DEDUP_THRESHOLD', 0.8))
+EMPTY = (1 << 64) - 1
+MASK = (1 << 64) - 1
+
+TAG = re.compile(r'<[^>]*>|&\w+;')
+WORD = re.compile(r'\w+')
+
+
+def normalize(text: str) -> list[str]:
+    return WORD.findall(TAG.sub(' ', text or '').lower().replace('ё', 'е'))
+
+
+def shingle_hashes(text: str, size: int = 3) -> set[int]:
+    words = normalize(text)
+    if len(words) < size:
+        grams = [' '.join(words)] if words else []
+    else:
+        grams = [' '.join(words[i:i + size]) for i in range(len(words) - size + 1)]
+    return {int.from_bytes(blake2b(x.encode(), digest_size=8).digest(), 'little') for x in grams}
+
+
+def signature(text: str) -> list[int] | None:
+    hashes = shingle_hashes(text)
+    if not hashes:
+        return None
+    sig = [EMPTY] * NUM_PERM
+    for h in hashes:
+        b = h % NUM_PERM
+        v = h // NUM_PERM
+        if v < sig[b]:
+            sig[b] = v
+    # densification: an empty bin takes the value of the next filled bin to the right (circularly),
+    # shifted by the distance, so sparse texts still get comparable signatures
+    if len(hashes) < NUM_PERM and EMPTY in sig:
+        original = sig[:]
+        nearest = None
+        for i in range(2 * NUM_PERM - 1, -1, -1):
+            k = i % NUM_PERM
+            if original[k] != EMPTY:
+                nearest = k
+            elif i < NUM_PERM:
+                sig[k] = (original[nearest] + (nearest - k) % NUM_PERM * 0x9E3779B97F4A7C15) & MASK
+    return sig
+
+
+def similarity(a: list[int], b: list[int]) -> float:
+    return sum(x == y for x, y in zip(a, b)) / NUM_PERM
+
+
+def pack(sig: list[int]) -> bytes:
+    return array('Q', sig).tobytes()
+
+
+def unpack(data: bytes) -> array:
+    return array('Q', data)
+
+
+class LSHIndex:
+    def __init__(self, threshold: float = THRESHOLD) -> None:
+        self.threshold = threshold
+        # kept as arrays, 1 KB per task instead of a list of int objects
+        self.signatures: dict[int, array] = {}
+        self.buckets: dict[tuple[int, int], list[int]] = {}
+        self.version: int | None = None
+
+    @staticmethod
+    def keys(sig: list[int]):
+        for band in range(BANDS):
+            yield band, hash(tuple(sig[band * ROWS:(band + 1) * ROWS]))
+
+    def add(self, id: int, sig) -> None:
+        sig = array('Q', sig)
+        self.signatures[id] = sig
+        for key in self.keys(sig):
+            self.buckets.setdefault(key, []).append(id)
+
+    def remove(self, id: int) -> None:
+        sig = self.signatures.pop(id, None)
+        if sig is None:
+            return
+        for key in self.keys(sig):
+            bucket = self.buckets.get(key)
+            if bucket is not None and id in bucket:
+                bucket.remove(id)
+                if not bucket:
+                    del self.buckets[key]
+
+    def query(self, sig: list[int], exclude: int | None = None) -> tuple[int, float] | None:
+        # the most similar indexed task above the threshold, lowest id on ties
+        candidates = set()
+        for key in self.keys(sig):
+            candidates.update(self.buckets.get(key, ()))
+        candidates.discard(exclude)
+        best = None
+        for id in sorted(candidates):
+            score = similarity(sig, self.signatures[id])
+            if score >= self.threshold and (best is None or score > best[1]):
+                best = (id, score)
+        return best
+
+    def clear(self) -> None:
+        self.signatures.clear()
+        self.buckets.clear()
+        self.version = None
+
+
+index = LSHIndex()
+
+
+async def ensure_current(session) -> LSHIndex:
+    # reloaded from task_signatures when another worker (or a failed import) changed the catalog
+    version, _ = await catalog.get_version()
+    if index.version != version:
+        index.clear()
+        # flagged duplicates are left out, a new task should point at the original
+        rows = await session.stream(select(database.TaskSignatures.task_id, database.TaskSignatures.signature).where(
+            database.TaskSignatures.duplicate_of.is_(None)))
+        async for task_id, data in rows:
+            index.add(task_id, unpack(data))
+        index.version = version
+    return index
+
+
+def invalidate() -> None:
+    index.version = None
+
+
+async def committed(version_before: int | None) -> None:
+    # after our own import the index already holds the new tasks, only the version has to follow the bump
+    if version_before is None or index.version != version_before:
+        return
+    version, _ = await catalog.get_version()
+    if version == version_before + 1:
+        index.version = version
+
+
+async def iter_tasks(page_size: int = 2000):
+    last_id = 0
+    while True:
+        async with database.sessions() as session:
+            rows = (await session.execute(
+                select(database.Tasks.id, database.Tasks.condition)
+                .where(database.Tasks.id > last_id).order_by(database.Tasks.id).limit(page_size))).all()
+        if not rows:
+            return
+        last_id = rows[-1].id
+        yield rows
+
+
+async def scan(apply: bool, out: str | None, threshold: float = THRESHOLD) -> dict:
+    # offline pass over the whole table in id order: the lowest id of a group is the original
+    started = time.perf_counter()
+    local = LSHIndex(threshold)
+    stats = {'tasks': 0, 'empty': 0, 'duplicates': 0}
+    groups: dict[int, list[dict]] = {}
+    async for rows in iter_tasks():
+        signatures = await asyncio.to_thread(lambda: [(x.id, signature(x.condition)) for x in rows])
+        values = []
+        for id, sig in signatures:
+            stats['tasks'] += 1
+            if sig is None:
+                stats['empty'] += 1
+                continue
+            match = local.query(sig)
+            duplicate_of = None
+            if match is not None:
+                duplicate_of = match[0]
+                stats['duplicates'] += 1
+                groups.setdefault(duplicate_of, []).append({'id': id, 'similarity': match[1]})
+            else:
+                local.add(id, sig)
+            values.append({'task_id': id, 'signature': pack(sig), 'duplicate_of': duplicate_of})
+        if apply and values:
+            async with database.sessions.begin() as session:
+                stmt = pg_insert(database.TaskSignatures)
+                await session.execute(stmt.on_conflict_do_update(
+                    index_elements=[database.TaskSignatures.task_id],
+                    set_={'signature': stmt.excluded.signature, 'duplicate_of': stmt.excluded.duplicate_of}), values)
+        print(f'{stats["tasks"]} задач, дубликатов {stats["duplicates"]}')
+    if apply:
+        async with database.sessions.begin() as session:
+            await catalog.bump(session)
+    if out:
+        with open(out, 'w', encoding='utf8') as f:
+            for original, duplicates in groups.items():
+                f.write(json.dumps({'original': original, 'duplicates': duplicates}) + '\n')
+    return stats | {'groups': len(groups), 'seconds': round(time.perf_counter() - started, 1)}
+
+
+async def scan_main(args) -> None:
+    stats = await scan(args.apply, args.out, args.threshold)
+    print(json.dumps(stats, indent=4))
+    await database.engine.dispose()
+
+
+if __name__ == '__main__':
+    # python -m dedup --out duplicates.ndjson            report only
+    # python -m dedup --apply                            store signatures and duplicate_of flags
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--apply', action='store_true')
+    parser.add_argument('--out', default=None)
+    parser.add_argument('--threshold', type=float, default=THRESHOLD)
+    asyncio.run(scan_main(parser.parse_args()))
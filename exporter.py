@@ -0,0 +1,148 @@
+from __future__ import annotations
+
+from sqlalchemy import select
+from typing import AsyncIterator
+import csv
+import io
+import zlib
+
+import database
+import utils
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+FORMATS = {
+    'json': ('application/json', 'json'),
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+    'csv': ('text/csv; charset=utf-8', 'csv'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+    'arrow': ('application/vnd.apache.arrow.stream', 'arrow'),
+}
+COLUMNS = ('id', 'level', 'category', 'subcategory', 'condition', 'solution', 'answer', 'source', 'answer_type')
+
+
+async def iter_task_pages(page_size: int = 1000) -> AsyncIterator[list[dict]]:
+    # keyset pagination by id, every page is a short query in its own session
+    last_id = None
+    while True:
+        query = select(*[getattr(database.Tasks, x) for x in COLUMNS]).order_by(database.Tasks.id).limit(page_size)
+        if last_id is not None:
+            query = query.where(database.Tasks.id > last_id)
+        async with database.sessions() as session:
+            rows = (await session.execute(query)).mappings().all()
+        if not rows:
+            return
+        last_id = rows[-1]['id']
+        yield [dict(x) for x in rows]
+
+
+def flat_row(row: dict) -> dict:
+    return row | {'subcategory': ';'.join(map(str, row['subcategory'] or []))}
+
+
+class ChunkSink:
+    # file-like object for pyarrow writers, written bytes are taken out after every page
+    def __init__(self) -> None:
+        self.chunks: list[bytes] = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self.chunks.append(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.position
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.closed = True
+
+    def take(self) -> bytes:
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+async def export_json(pages: AsyncIterator[list[dict]]) -> AsyncIterator[bytes]:
+    yield b'{"tasks": ['
+    first = True
+    async for page in pages:
+        data = b','.join(utils.dumps(flat_row(x)) for x in page)
+        yield data if first else b',' + data
+        first = False
+    yield b']}'
+
+
+async def export_ndjson(pages: AsyncIterator[list[dict]]) -> AsyncIterator[bytes]:
+    async for page in pages:
+        yield b''.join(utils.dumps(flat_row(x)) + b'\n' for x in page)
+
+
+async def export_csv(pages: AsyncIterator[list[dict]]) -> AsyncIterator[bytes]:
+    yield (','.join(COLUMNS) + '\r\n').encode()
+    async for page in pages:
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, COLUMNS)
+        writer.writerows(flat_row(x) for x in page)
+        yield buffer.getvalue().encode()
+
+
+def arrow_schema():
+    return pyarrow.schema([
+        ('id', pyarrow.int32()),
+        ('level', pyarrow.int32()),
+        ('category', pyarrow.int32()),
+        ('subcategory', pyarrow.list_(pyarrow.int32())),
+        ('condition', pyarrow.string()),
+        ('solution', pyarrow.string()),
+        ('answer', pyarrow.string()),
+        ('source', pyarrow.string()),
+        ('answer_type', pyarrow.string()),
+    ])
+
+
+async def export_columnar(pages: AsyncIterator[list[dict]], fmt: str) -> AsyncIterator[bytes]:
+    schema = arrow_schema()
+    sink = ChunkSink()
+    if fmt == 'parquet':
+        writer = pyarrow.parquet.ParquetWriter(pyarrow.PythonFile(sink, mode='w'), schema, compression='zstd')
+    else:
+        writer = pyarrow.ipc.new_stream(pyarrow.PythonFile(sink, mode='w'), schema)
+    async for page in pages:
+        # every page becomes one row group / record batch
+        writer.write_table(pyarrow.Table.from_pylist(page, schema=schema))
+        yield sink.take()
+    writer.close()
+    yield sink.take()
+
+
+async def gzip_stream(chunks: AsyncIterator[bytes], level: int = 6) -> AsyncIterator[bytes]:
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    async for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export_tasks(fmt: str, gzip: bool = False, page_size: int = 1000) -> AsyncIterator[bytes]:
+    pages = iter_task_pages(page_size)
+    if fmt == 'json':
+        stream = export_json(pages)
+    elif fmt == 'ndjson':
+        stream = export_ndjson(pages)
+    elif fmt == 'csv':
+        stream = export_csv(pages)
+    else:
+        stream = export_columnar(pages, fmt)
+    return gzip_stream(stream) if gzip else stream
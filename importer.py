@@ -0,0 +1,354 @@
+from __future__ import annotations
+
+from sqlalchemy import select, insert, update, tuple_, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext import asyncio as s_aio
+from typing import AsyncIterator
+import asyncio
+import codecs
+import os
+import time
+
+import catalog
+import database
+import dedup
+import records
+import taxonomy
+
+REQUIRED_FIELDS = ('category', 'level', 'condition')
+TEXT_FIELDS = ('condition', 'solution', 'answer', 'source', 'answer_type')
+DEDUP_MODE = os.getenv('IMPORT_DEDUP') or None
+DEDUP_MODES = ('flag', 'merge')
+
+# progress of running and finished streaming imports by job id
+jobs: dict[str, dict] = {}
+
+
+def chunks(items: list, size: int):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def split_subcategories(value) -> list:
+    if value is None or value == '':
+        return []
+    if isinstance(value, str):
+        # export_tasks writes subcategory ids joined with ';'
+        return [int(x) if x.strip().isnumeric() else x.strip() for x in value.split(';') if x.strip()]
+    return list(dict.fromkeys(value))
+
+
+class BulkImporter:
+    # category and subcategory names come from the taxonomy index, only unknown names reach the database,
+    # tasks go in as multi-row inserts
+    def __init__(self, session: s_aio.AsyncSession, batch_size: int = 1000, dedup_mode: str | None = None) -> None:
+        self.session = session
+        self.batch_size = batch_size
+        # None, 'flag' (insert and mark as duplicate) or 'merge' (only add subcategories to the original)
+        self.dedup_mode = dedup_mode
+        self.dedup_version = None
+        self.categories: dict[str, int] = {}
+        self.subcategories: dict[tuple[int, str], int] = {}
+        self.rows = 0
+        self.inserted = 0
+        self.skipped = 0
+        self.invalid = 0
+        self.errors: list[dict] = []
+        self.flagged = 0
+        self.merged = 0
+        self.duplicates: list[dict] = []
+        self.indexed: list[int] = []
+        self.explicit_ids = False
+        self.started = time.perf_counter()
+
+    def error(self, row: int, message: str) -> None:
+        self.invalid += 1
+        if len(self.errors) < 1000:
+            self.errors.append({'row': row, 'error': message})
+
+    def parse_error(self, message: str) -> None:
+        self.error(self.rows, message)
+        self.rows += 1
+
+    def save_state(self) -> dict:
+        return {
+            'rows': self.rows,
+            'inserted': self.inserted,
+            'skipped': self.skipped,
+            'invalid': self.invalid,
+            'errors': len(self.errors),
+            'flagged': self.flagged,
+            'merged': self.merged,
+            'duplicates': len(self.duplicates),
+            'indexed': len(self.indexed),
+            'categories': dict(self.categories),
+            'subcategories': dict(self.subcategories),
+        }
+
+    def restore_state(self, state: dict) -> None:
+        self.rows = state['rows']
+        self.inserted = state['inserted']
+        self.skipped = state['skipped']
+        self.invalid = state['invalid']
+        del self.errors[state['errors']:]
+        self.flagged = state['flagged']
+        self.merged = state['merged']
+        del self.duplicates[state['duplicates']:]
+        for id in self.indexed[state['indexed']:]:
+            dedup.index.remove(id)
+        del self.indexed[state['indexed']:]
+        # ids created inside a rolled back savepoint do not exist anymore
+        self.categories = state['categories']
+        self.subcategories = state['subcategories']
+
+    async def write_batch_safe(self, records: list) -> None:
+        # a failing batch is retried row by row so one bad record does not abort the import
+        state = self.save_state()
+        try:
+            async with self.session.begin_nested():
+                await self.write_batch(records)
+            return
+        except Exception:
+            self.restore_state(state)
+        for record in records:
+            row_state = self.save_state()
+            try:
+                async with self.session.begin_nested():
+                    await self.write_batch([record])
+            except Exception as e:
+                self.restore_state(row_state)
+                self.parse_error(str(e).split('\n')[0])
+
+    async def resolve_categories(self, names: set[str]) -> None:
+        names = {x for x in names if x not in self.categories}
+        index = await taxonomy.ensure_current()
+        self.categories |= {x: index.category_ids[x] for x in names if x in index.category_ids}
+        names = {x for x in names if x not in self.categories}
+        if not names:
+            return
+        request = await self.session.execute(
+            select(database.Categories.id, database.Categories.name).where(database.Categories.name.in_(names)))
+        self.categories |= {name: id for id, name in request.all()}
+        missing = [x for x in names if x not in self.categories]
+        if missing:
+            request = await self.session.execute(
+                insert(database.Categories).returning(database.Categories.id, database.Categories.name),
+                [{'name': x} for x in missing])
+            self.categories |= {name: id for id, name in request.all()}
+
+    async def resolve_subcategories(self, pairs: set[tuple[int, str]]) -> None:
+        pairs = {x for x in pairs if x not in self.subcategories}
+        index = await taxonomy.ensure_current()
+        self.subcategories |= {x: index.subcategory_ids[x] for x in pairs if x in index.subcategory_ids}
+        pairs = {x for x in pairs if x not in self.subcategories}
+        if not pairs:
+            return
+        for part in chunks(list(pairs), 1000):
+            request = await self.session.execute(
+                select(database.SubCategories.id, database.SubCategories.category_id, database.SubCategories.name).where(
+                    tuple_(database.SubCategories.category_id, database.SubCategories.name).in_(part)))
+            self.subcategories |= {(category_id, name): id for id, category_id, name in request.all()}
+        missing = [x for x in pairs if x not in self.subcategories]
+        if missing:
+            request = await self.session.execute(
+                insert(database.SubCategories).returning(
+                    database.SubCategories.id, database.SubCategories.category_id, database.SubCategories.name),
+                [{'category_id': category_id, 'name': name} for category_id, name in missing])
+            self.subcategories |= {(category_id, name): id for id, category_id, name in request.all()}
+
+    def validate(self, row: int, data) -> dict | None:
+        if not isinstance(data, dict):
+            self.error(row, 'запись должна быть объектом')
+            return None
+        missing = [x for x in REQUIRED_FIELDS if data.get(x) is None]
+        if missing:
+            self.error(row, 'нет полей: ' + ', '.join(missing))
+            return None
+        try:
+            record = {
+                'level': int(data['level']),
+                'category': data['category'],
+                'subcategory': split_subcategories(data.get('subcategory')),
+            }
+            if data.get('id') is not None:
+                record['id'] = int(data['id'])
+        except (TypeError, ValueError) as e:
+            self.error(row, str(e))
+            return None
+        for x in TEXT_FIELDS:
+            record[x] = str(data.get(x) or '')
+        return record
+
+    async def write_batch(self, records: list) -> None:
+        first_row = self.rows
+        self.rows += len(records)
+        valid = []
+        for i, data in enumerate(records):
+            record = self.validate(first_row + i, data)
+            if record is not None:
+                valid.append(record)
+        if not valid:
+            return
+
+        await self.resolve_categories({x['category'] for x in valid if isinstance(x['category'], str)})
+        for x in valid:
+            if isinstance(x['category'], str):
+                x['category'] = self.categories[x['category']]
+        await self.resolve_subcategories({(x['category'], s) for x in valid for s in x['subcategory'] if isinstance(s, str)})
+        for x in valid:
+            x['subcategory'] = [s if isinstance(s, int) else self.subcategories[(x['category'], s)] for s in x['subcategory']]
+
+        signatures = duplicate_of = None
+        if self.dedup_mode:
+            valid, signatures, duplicate_of = await self.find_duplicates(valid)
+
+        ids: list[int | None] = [None] * len(valid)
+        with_id = [i for i, x in enumerate(valid) if 'id' in x]
+        without_id = [i for i, x in enumerate(valid) if 'id' not in x]
+        if with_id:
+            self.explicit_ids = True
+            stmt = pg_insert(database.Tasks).on_conflict_do_nothing(index_elements=[database.Tasks.id]).returning(database.Tasks.id)
+            inserted = {x for x, in (await self.session.execute(stmt, [valid[i] for i in with_id])).all()}
+            for i in with_id:
+                if valid[i]['id'] in inserted:
+                    ids[i] = valid[i]['id']
+            self.inserted += len(inserted)
+            self.skipped += len(with_id) - len(inserted)
+        if without_id:
+            stmt = insert(database.Tasks).returning(database.Tasks.id, sort_by_parameter_order=True)
+            request = await self.session.execute(stmt, [valid[i] for i in without_id])
+            for i, (id,) in zip(without_id, request.all()):
+                ids[i] = id
+            self.inserted += len(without_id)
+
+        if self.dedup_mode:
+            await self.store_signatures(valid, ids, signatures, duplicate_of)
+
+    async def find_duplicates(self, valid: list[dict]) -> tuple[list[dict], list, list]:
+        # compares every record with the indexed tasks and with the earlier records of the same batch
+        index = await dedup.ensure_current(self.session)
+        if self.dedup_version is None:
+            self.dedup_version = index.version
+        signatures = await asyncio.to_thread(lambda: [dedup.signature(x['condition']) for x in valid])
+        batch = dedup.LSHIndex(index.threshold)
+        merges: dict[int, set[int]] = {}
+        keep, keep_signatures, duplicate_of = [], [], []
+        for record, sig in zip(valid, signatures):
+            match = None
+            if sig is not None:
+                existing = index.query(sig, exclude=record.get('id'))
+                earlier = batch.query(sig)
+                if existing is not None:
+                    match = existing
+                elif earlier is not None:
+                    # a record of this batch, stored as a negative position until it has an id
+                    match = (-1 - earlier[0], earlier[1])
+            if match is not None and self.dedup_mode == 'merge':
+                self.merged += 1
+                if match[0] >= 0:
+                    merges.setdefault(match[0], set()).update(record['subcategory'])
+                    self.report_duplicate(record, match[0], match[1])
+                else:
+                    original = keep[-1 - match[0]]
+                    original['subcategory'] = list(dict.fromkeys(original['subcategory'] + record['subcategory']))
+                    self.report_duplicate(record, original.get('id'), match[1])
+                continue
+            if match is not None:
+                self.flagged += 1
+            elif sig is not None:
+                batch.add(len(keep), sig)
+            keep.append(record)
+            keep_signatures.append(sig)
+            duplicate_of.append(match)
+
+        if merges:
+            request = await self.session.execute(select(database.Tasks.id, database.Tasks.subcategory).where(
+                database.Tasks.id.in_(merges)))
+            await self.session.execute(update(database.Tasks), [
+                {'id': id, 'subcategory': list(dict.fromkeys((subcategory or []) + sorted(merges[id])))}
+                for id, subcategory in request.all()])
+        return keep, keep_signatures, duplicate_of
+
+    async def store_signatures(self, valid: list[dict], ids: list, signatures: list, duplicate_of: list) -> None:
+        values = []
+        for record, id, sig, match in zip(valid, ids, signatures, duplicate_of):
+            if id is None or sig is None:
+                continue
+            original = None
+            if match is not None:
+                original = match[0] if match[0] >= 0 else ids[-1 - match[0]] or valid[-1 - match[0]].get('id')
+                self.report_duplicate(record, original, match[1], id)
+            else:
+                dedup.index.add(id, sig)
+                self.indexed.append(id)
+            values.append({'task_id': id, 'signature': dedup.pack(sig), 'duplicate_of': original})
+        if values:
+            await self.session.execute(pg_insert(database.TaskSignatures).on_conflict_do_nothing(
+                index_elements=[database.TaskSignatures.task_id]), values)
+
+    def report_duplicate(self, record: dict, original: int | None, score: float, id: int | None = None) -> None:
+        if len(self.duplicates) < 1000:
+            self.duplicates.append({
+                'id': id if id is not None else record.get('id'),
+                'duplicate_of': original,
+                'similarity': round(score, 3),
+                'condition': record['condition'][:100],
+            })
+
+    async def add(self, records: list) -> None:
+        for part in chunks(records, self.batch_size):
+            await self.write_batch(part)
+
+    async def finish(self) -> None:
+        if self.inserted or self.merged:
+            await catalog.bump(self.session)
+        if self.explicit_ids:
+            # explicit ids do not move the serial, later inserts without id would collide
+            await self.session.execute(text(
+                "SELECT setval(pg_get_serial_sequence('tasks', 'id'), (SELECT COALESCE(MAX(id), 1) FROM tasks))"))
+
+    def report(self) -> dict:
+        seconds = time.perf_counter() - self.started
+        return {
+            'rows': self.rows,
+            'inserted': self.inserted,
+            'skipped': self.skipped,
+            'invalid': self.invalid,
+            'errors': self.errors,
+            'flagged': self.flagged,
+            'merged': self.merged,
+            'duplicates': self.duplicates,
+            'seconds': round(seconds, 3),
+            'rows_per_sec': round(self.rows / seconds, 1) if seconds > 0 else 0,
+        }
+
+
+async def iter_records(stream: AsyncIterator[bytes]) -> AsyncIterator[tuple[dict | None, str | None]]:
+    # accepts NDJSON or a JSON array, yields (record, None) or (None, error) without reading the whole body
+    reader = records.RecordReader()
+    utf8 = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    async for chunk in stream:
+        for item in reader.feed(utf8.decode(chunk)):
+            yield item
+        if reader.done:
+            return
+    for item in reader.feed(utf8.decode(b'', final=True), eof=True):
+        yield item
+
+
+async def bulk_import_tasks(records: list, batch_size: int = 1000, dedup_mode: str | None = DEDUP_MODE) -> dict:
+    try:
+        async with database.sessions.begin() as session:
+            importer = BulkImporter(session, batch_size, dedup_mode)
+            await importer.add(records)
+            await importer.finish()
+    except Exception:
+        # signatures added to the index belong to a rolled back transaction
+        dedup.invalidate()
+        raise
+    if importer.inserted or importer.merged:
+        await taxonomy.refresh()
+        await dedup.committed(importer.dedup_version)
+    report = importer.report()
+    print(f'Импортировано задач: {report["inserted"]} из {report["rows"]}, {report["rows_per_sec"]} строк/с')
+    return report
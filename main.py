@@ -1,50 +1,78 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 from contextlib import asynccontextmanager
-from sqlalchemy import update
+from sqlalchemy import update, and_
 import uvicorn
+import asyncio
 import json
+import logging
+import os
 
 import database
+import metrics
+import profiling
 import routes
 
+try:
+    from brotli_asgi import BrotliMiddleware
+except ImportError:
+    BrotliMiddleware = None
+import snapshots
+import taxonomy
+
+logging.basicConfig(level=os.getenv('LOG_LEVEL', 'INFO'), format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+metrics.instrument_engine(database.engine)
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     print("Creating tables in database")
     async with database.engine.begin() as connection:
         await connection.run_sync(database.MainBase.metadata.create_all)
+        await connection.run_sync(database.create_indexes)
         
+    print("Loading taxonomy")
+    await taxonomy.refresh()
+
+    print("Restoring battles")
+    async with database.sessions.begin() as session:
+        in_game = await snapshots.restore_battles(session)
+
     print("Clearing battle status")
     async with database.sessions.begin() as session:
-        await session.execute(update(database.Users).values(status=None).where(database.Users.status == 'battle'))
+        await session.execute(update(database.Users).values(status=None).where(
+            and_(database.Users.status == 'battle', database.Users.id.not_in(in_game))))
 
     if 0:
         print('Adding tasks from json')
         name = 'Математический анализ'
-        with open(f'misc/{name}.json', encoding='utf8') as f:
-            data = json.load(f)
-        i = 0
-        for record in data:
-            i += 1
-            print(i / len(data) * 100)
-            await routes.administration.import_tasks_to_db([{
-                'id': record['id'],
-                'level': int(record['difficulty']),
-                'category': name,
-                'subcategory': list(set(record['subcategory'])),
-                'condition': record['condition'],
-                'solution': record['solution'],
-                'answer': record['answer'],
-                'source': 'problems.ru',
-                'answer_type': 'string'
-            }])
+        # misc/parse_json.py already writes records in the importer format
+        with open(f'misc/{name}.ndjson', encoding='utf8') as f:
+            await routes.administration.import_tasks_to_db(json.loads(line) for line in f if line.strip())
+
+    snapshot_task = asyncio.create_task(snapshots.snapshot_loop())
+    matchmaking_task = asyncio.create_task(routes.websocket.matchmaking_loop())
+    watchdog = profiling.start_watchdog()
 
     yield
 
+    if watchdog is not None:
+        watchdog.close()
+    matchmaking_task.cancel()
+    snapshot_task.cancel()
+    print("Saving battles")
+    await snapshots.save()
+
 app = FastAPI(lifespan=lifespan)
 app.include_router(routes.router)
 
+# large task payloads are compressed, brotli (with gzip fallback) when brotli-asgi is installed
+if BrotliMiddleware is not None:
+    app.add_middleware(BrotliMiddleware, minimum_size=1024, gzip_fallback=True)
+else:
+    app.add_middleware(GZipMiddleware, minimum_size=1024)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -53,11 +81,14 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# outermost, so the timing covers compression and CORS as well
+app.add_middleware(metrics.MetricsMiddleware)
+
 if __name__ == "__main__":
     uvicorn.run(
         "__main__:app",
         host="0.0.0.0",
         port=8000,
         reload=True,
-        reload_excludes=['test_websocket.py'],
+        reload_excludes=['bench/*'],
         workers=2)
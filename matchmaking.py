@@ -0,0 +1,159 @@
+from __future__ import annotations
+
+from bisect import bisect_left
+from collections import deque
+import itertools
+import time
+
+
+# players are only matched when they asked for the same game
+MATCH_PARAMS = ('category', 'subcategory', 'level_start', 'level_end', 'count', 'time_limit')
+
+
+def match_key(params: dict) -> tuple:
+    return tuple(tuple(x) if isinstance(x, list) else x for x in (params.get(name) for name in MATCH_PARAMS))
+
+
+class Ticket:
+    __slots__ = ('user_id', 'rating', 'key', 'created', 'seq', 'data')
+
+    def __init__(self, user_id: int, rating: int, key: tuple, created: float, seq: int, data: dict | None) -> None:
+        self.user_id = user_id
+        self.rating = rating
+        self.key = key
+        self.created = created
+        self.seq = seq
+        self.data = data or {}
+
+
+class MatchQueue:
+    # tickets of one bucket of game settings, kept sorted by rating; finding neighbours is a binary search,
+    # insert and remove shift the list, O(n) but a memmove, cheap for queues of tens of thousands
+    def __init__(self) -> None:
+        self.order: list[tuple[int, int]] = []
+        self.tickets: dict[int, Ticket] = {}
+
+    def __len__(self) -> int:
+        return len(self.order)
+
+    def add(self, ticket: Ticket) -> None:
+        item = (ticket.rating, ticket.seq)
+        self.order.insert(bisect_left(self.order, item), item)
+        self.tickets[ticket.seq] = ticket
+
+    def remove(self, ticket: Ticket) -> None:
+        item = (ticket.rating, ticket.seq)
+        i = bisect_left(self.order, item)
+        if i < len(self.order) and self.order[i] == item:
+            del self.order[i]
+        self.tickets.pop(ticket.seq, None)
+
+    def neighbours(self, rating: int, seq: int) -> list[Ticket]:
+        i = bisect_left(self.order, (rating, seq))
+        return [self.tickets[self.order[j][1]] for j in (i - 1, i) if 0 <= j < len(self.order)]
+
+
+class Matchmaker:
+    def __init__(self, base_window: int = 100, widen_rate: float = 25, max_window: int = 800) -> None:
+        self.base_window = base_window
+        self.widen_rate = widen_rate  # rating points per second of waiting
+        self.max_window = max_window
+        self.queues: dict[tuple, MatchQueue] = {}
+        self.by_user: dict[int, Ticket] = {}
+        self.seq = itertools.count()
+
+        self.started = time.monotonic()
+        self.enqueued = 0
+        self.matched = 0
+        self.cancelled = 0
+        self.waits: deque[float] = deque(maxlen=10000)
+
+    def window(self, ticket: Ticket, now: float) -> float:
+        return min(self.base_window + self.widen_rate * (now - ticket.created), self.max_window)
+
+    def acceptable(self, a: Ticket, b: Ticket, now: float) -> bool:
+        return abs(a.rating - b.rating) <= min(self.window(a, now), self.window(b, now))
+
+    def is_queued(self, user_id: int) -> bool:
+        return user_id in self.by_user
+
+    def enqueue(self, user_id: int, rating: int, params: dict,
+                data: dict | None = None, now: float | None = None) -> tuple[Ticket, Ticket] | None:
+        now = time.monotonic() if now is None else now
+        self.cancel(user_id)
+        key = match_key(params)
+        ticket = Ticket(user_id, rating, key, now, next(self.seq), data)
+        self.enqueued += 1
+
+        queue = self.queues.setdefault(key, MatchQueue())
+        best = None
+        for other in queue.neighbours(rating, ticket.seq):
+            if self.acceptable(ticket, other, now) and (
+                    best is None or abs(other.rating - rating) < abs(best.rating - rating)):
+                best = other
+        if best is not None:
+            return self._pair(best, ticket, now)
+
+        queue.add(ticket)
+        self.by_user[user_id] = ticket
+        return None
+
+    def cancel(self, user_id: int) -> bool:
+        ticket = self.by_user.pop(user_id, None)
+        if ticket is None:
+            return False
+        self._remove(ticket)
+        self.cancelled += 1
+        return True
+
+    def sweep(self, now: float | None = None) -> list[tuple[Ticket, Ticket]]:
+        # windows grow while players wait, so neighbours that were too far apart may now fit
+        now = time.monotonic() if now is None else now
+        pairs = []
+        for queue in list(self.queues.values()):
+            tickets = [queue.tickets[seq] for _, seq in queue.order]
+            i = 0
+            while i + 1 < len(tickets):
+                if self.acceptable(tickets[i], tickets[i + 1], now):
+                    pairs.append(self._pair(tickets[i], tickets[i + 1], now))
+                    i += 2
+                else:
+                    i += 1
+        return pairs
+
+    def _remove(self, ticket: Ticket) -> None:
+        queue = self.queues.get(ticket.key)
+        if queue is None:
+            return
+        queue.remove(ticket)
+        if len(queue) == 0:
+            del self.queues[ticket.key]
+
+    def _pair(self, a: Ticket, b: Ticket, now: float) -> tuple[Ticket, Ticket]:
+        # the ticket that waited longer goes first and becomes the room host
+        a, b = (a, b) if a.created <= b.created else (b, a)
+        for t in (a, b):
+            if self.by_user.get(t.user_id) is t:
+                del self.by_user[t.user_id]
+                self._remove(t)
+            self.waits.append(now - t.created)
+        self.matched += 1
+        return a, b
+
+    def stats(self, now: float | None = None) -> dict:
+        now = time.monotonic() if now is None else now
+        waits = sorted(self.waits)
+        queued = [now - t.created for t in self.by_user.values()]
+        return {
+            'queued': len(self.by_user),
+            'buckets': len(self.queues),
+            'enqueued': self.enqueued,
+            'matched': self.matched,
+            'cancelled': self.cancelled,
+            'matches_per_minute': self.matched / max(now - self.started, 1e-9) * 60,
+            'wait_avg': sum(waits) / len(waits) if waits else 0,
+            'wait_p50': waits[len(waits) // 2] if waits else 0,
+            'wait_p95': waits[int(len(waits) * 0.95)] if waits else 0,
+            'wait_max': waits[-1] if waits else 0,
+            'longest_queued': max(queued, default=0),
+        }
@@ -0,0 +1,291 @@
+from __future__ import annotations
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from sqlalchemy import event
+import bisect
+import logging
+import os
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Minimal Prometheus-style metrics: counters, gauges and histograms with labels, rendered in the text
+# exposition format on /metrics. Request middleware, SQL engine events and GigaChat calls feed them.
+
+log = logging.getLogger('olymp')
+
+SQL_QUERY_WARN = int(os.getenv('SQL_QUERY_WARN', 50))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200, 500)
+
+
+def escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(names: tuple, values: tuple, extra: str = '') -> str:
+    parts = [f'{x}="{escape(y)}"' for x, y in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+
+def format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class Metric:
+    kind = ''
+
+    def __init__(self, name: str, help: str, labels: tuple = ()) -> None:
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        registry.register(self)
+
+    def key(self, labels: dict) -> tuple:
+        return tuple(labels.get(x, '') for x in self.labels)
+
+    def samples(self):
+        return []
+
+    def render(self) -> list[str]:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+        for name, key, extra, value in self.samples():
+            lines.append(f'{name}{format_labels(self.labels, key, extra)} {format_value(value)}')
+        return lines
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def __init__(self, name: str, help: str, labels: tuple = ()) -> None:
+        super().__init__(name, help, labels)
+        self.values: dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self.key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels) -> float:
+        return self.values.get(self.key(labels), 0)
+
+    def samples(self):
+        for key, value in sorted(self.values.items()):
+            yield self.name, key, '', value
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def __init__(self, name: str, help: str, labels: tuple = (), function=None) -> None:
+        super().__init__(name, help, labels)
+        self.values: dict[tuple, float] = {}
+        # called on every scrape, returns a value or {label values tuple: value}
+        self.function = function
+
+    def set(self, value: float, **labels) -> None:
+        self.values[self.key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self.key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    def samples(self):
+        values = self.values
+        if self.function is not None:
+            result = self.function()
+            values = result if isinstance(result, dict) else {(): result}
+        for key, value in sorted(values.items()):
+            yield self.name, key, '', value
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS) -> None:
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+        # per label set: counts per bucket (not cumulative), sum, count
+        self.values: dict[tuple, list] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self.key(labels)
+        data = self.values.get(key)
+        if data is None:
+            data = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        data[0][bisect.bisect_left(self.buckets, value)] += 1
+        data[1] += value
+        data[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        for key, (counts, total, count) in sorted(self.values.items()):
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float('inf'),), counts):
+                cumulative += n
+                yield self.name + '_bucket', key, f'le="{format_value(bound)}"', cumulative
+            yield self.name + '_sum', key, '', total
+            yield self.name + '_count', key, '', count
+
+
+class Registry:
+    def __init__(self) -> None:
+        self.metrics: dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> None:
+        self.metrics[metric.name] = metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics.values():
+            lines += metric.render()
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+http_requests = Counter('http_requests_total', 'HTTP requests by route template and status', ('method', 'route', 'status'))
+http_latency = Histogram('http_request_duration_seconds', 'HTTP request latency', ('method', 'route'))
+http_sql_queries = Histogram('http_request_sql_queries', 'SQL statements per HTTP request', ('route',), COUNT_BUCKETS)
+http_sql_time = Histogram('http_request_sql_seconds', 'Time spent in SQL per HTTP request', ('route',))
+sql_queries = Counter('sql_queries_total', 'SQL statements executed')
+sql_latency = Histogram('sql_query_duration_seconds', 'SQL statement latency')
+pool_wait = Histogram('db_pool_wait_seconds', 'Time waiting for a pooled DB connection',
+                      buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30))
+pool_timeouts = Counter('db_pool_timeouts_total', 'Pool checkouts that timed out')
+gigachat_requests = Counter('gigachat_requests_total', 'GigaChat checks', ('backend', 'kind', 'result'))
+gigachat_latency = Histogram('gigachat_request_duration_seconds', 'GigaChat check latency', ('backend', 'kind'))
+
+
+def resident_memory() -> int:
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        # peak instead of current RSS outside Linux
+        if resource is None:
+            return 0
+        usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return usage if os.uname().sysname == 'Darwin' else usage * 1024
+
+
+process_memory = Gauge('process_resident_memory_bytes', 'Resident memory of the worker', function=resident_memory)
+
+
+class RequestStats:
+    __slots__ = ('queries', 'sql_time')
+
+    def __init__(self) -> None:
+        self.queries = 0
+        self.sql_time = 0.0
+
+
+# statistics of the request (or websocket event) currently being handled
+current_stats: ContextVar[RequestStats | None] = ContextVar('current_stats', default=None)
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+    elapsed = time.perf_counter() - conn.info['query_start'].pop()
+    sql_queries.inc()
+    sql_latency.observe(elapsed)
+    stats = current_stats.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.sql_time += elapsed
+
+
+def handle_error(context) -> None:
+    starts = context.connection.info.get('query_start') if context.connection is not None else None
+    if starts:
+        starts.pop()
+
+
+def instrument_engine(engine) -> None:
+    sync_engine = getattr(engine, 'sync_engine', engine)
+    event.listen(sync_engine, 'before_cursor_execute', before_cursor_execute)
+    event.listen(sync_engine, 'after_cursor_execute', after_cursor_execute)
+    event.listen(sync_engine, 'handle_error', handle_error)
+    pool = sync_engine.pool
+    if hasattr(pool, 'checkedout'):
+        Gauge('db_pool_size', 'Configured pool size', function=pool.size)
+        Gauge('db_pool_checked_out', 'DB connections in use', function=pool.checkedout)
+        Gauge('db_pool_idle', 'Idle DB connections in the pool', function=pool.checkedin)
+        Gauge('db_pool_overflow', 'Connections above the pool size', function=lambda: max(pool.overflow(), 0))
+
+
+@contextmanager
+def track_gigachat(kind: str, backend: str = 'gigachat'):
+    start = time.perf_counter()
+    result = 'error'
+    try:
+        yield
+        result = 'ok'
+    except BaseException as e:
+        # the GigaChat client raises httpx timeouts, the fake one TimeoutError
+        if isinstance(e, TimeoutError) or 'Timeout' in type(e).__name__:
+            result = 'timeout'
+        raise
+    finally:
+        gigachat_latency.observe(time.perf_counter() - start, backend=backend, kind=kind)
+        gigachat_requests.inc(backend=backend, kind=kind, result=result)
+
+
+class MetricsMiddleware:
+    # plain ASGI middleware, so streaming responses are timed to the last byte and not buffered
+    def __init__(self, app) -> None:
+        self.app = app
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats()
+        token = current_stats.set(stats)
+        status = 500
+        start = time.perf_counter()
+
+        async def send_wrapper(message) -> None:
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            current_stats.reset(token)
+            route = scope.get('route')
+            # route templates keep the label set small, unmatched paths share one label
+            path = getattr(route, 'path', None) or 'unmatched'
+            method = scope['method']
+            http_requests.inc(method=method, route=path, status=status)
+            http_latency.observe(elapsed, method=method, route=path)
+            http_sql_queries.observe(stats.queries, route=path)
+            http_sql_time.observe(stats.sql_time, route=path)
+            if stats.queries > SQL_QUERY_WARN:
+                log.warning('%s %s: %d SQL statements (%.3f s in SQL, %.3f s total)',
+                            method, path, stats.queries, stats.sql_time, elapsed)
@@ -0,0 +1,193 @@
+import argparse
+import asyncio
+import hashlib
+import io
+import json
+import os
+import re
+import sys
+import time
+
+import aiohttp
+
+# records.py is shared with the server's importer and lives in the repository root
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from records import iter_records
+from scraper import RateLimiter
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+# Image pipeline for task documents (show_document.php?id=N pictures inside conditions and solutions).
+# References are collected from the streamed task file with one regex pass per field, pictures are
+# downloaded concurrently behind a rate limiter and stored by content hash, so identical pictures under
+# different ids are kept once. manifest.json maps document id -> stored file and makes reruns incremental;
+# parse_json.py uses it to rewrite the links.
+# python assets.py tasks.ndjson --out-dir documents --transcode webp
+
+DOCUMENT = re.compile(r'show_document\.php\?id=(\d+)')
+TEXT_FIELDS = ('condition', 'solution', 'answer')
+SIGNATURES = {b'GIF8': 'gif', b'\x89PNG': 'png', b'\xff\xd8\xff': 'jpg', b'RIFF': 'webp'}
+
+
+def collect_documents(path: str) -> set[int]:
+    ids = set()
+    for record in iter_records(path):
+        for field in TEXT_FIELDS:
+            ids.update(map(int, DOCUMENT.findall(record.get(field) or '')))
+    return ids
+
+
+def sniff_extension(data: bytes) -> str:
+    for signature, extension in SIGNATURES.items():
+        if data.startswith(signature):
+            return extension
+    return 'bin'
+
+
+def transcode(data: bytes, fmt: str) -> tuple[bytes, str] | None:
+    # the smaller of the original and the transcoded picture is kept, animations stay as they are
+    image = Image.open(io.BytesIO(data))
+    if getattr(image, 'n_frames', 1) > 1:
+        return None
+    if fmt == 'png' and image.mode not in ('1', 'L', 'P', 'RGB', 'RGBA'):
+        image = image.convert('RGBA')
+    out = io.BytesIO()
+    image.save(out, format=fmt.upper(), optimize=True, **({'lossless': True} if fmt == 'webp' else {}))
+    result = out.getvalue()
+    return (result, fmt) if len(result) < len(data) else None
+
+
+class Manifest:
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.documents: dict[str, dict] = {}
+        self.failed: dict[str, str] = {}
+        if os.path.isfile(path):
+            with open(path, encoding='utf8') as f:
+                data = json.load(f)
+            self.documents = data['documents']
+            self.failed = data['failed']
+        # content hash -> stored entry, for dedupe across ids
+        self.by_hash = {x['sha256']: x for x in self.documents.values()}
+
+    def save(self) -> None:
+        with open(self.path + '.tmp', 'w', encoding='utf8') as f:
+            json.dump({'documents': self.documents, 'failed': self.failed}, f, ensure_ascii=False, indent=1)
+        os.replace(self.path + '.tmp', self.path)
+
+
+class AssetDownloader:
+    def __init__(self, args, manifest: Manifest) -> None:
+        self.args = args
+        self.manifest = manifest
+        self.base_url = args.base_url.rstrip('/')
+        self.limiter = RateLimiter(args.rate, args.jitter)
+        self.session = None
+        self.stats = {'downloaded': 0, 'duplicates': 0, 'bytes': 0, 'stored_bytes': 0, 'failed': 0}
+
+    async def fetch(self, doc_id: int) -> bytes:
+        error = None
+        for attempt in range(self.args.retries + 1):
+            await self.limiter.wait()
+            try:
+                async with self.session.get(f'{self.base_url}/show_document.php?id={doc_id}') as response:
+                    if response.status == 200:
+                        return await response.read()
+                    error = f'HTTP {response.status}'
+                    if response.status == 404:
+                        break
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                error = str(e) or type(e).__name__
+            await asyncio.sleep(min(2 ** attempt, 60))
+        raise RuntimeError(error)
+
+    async def store(self, doc_id: int, data: bytes) -> None:
+        digest = hashlib.sha256(data).hexdigest()
+        self.stats['downloaded'] += 1
+        self.stats['bytes'] += len(data)
+        entry = self.manifest.by_hash.get(digest)
+        if entry is None:
+            extension = sniff_extension(data)
+            if self.args.transcode and Image is not None and extension in ('gif', 'png', 'jpg'):
+                converted = await asyncio.to_thread(transcode, data, self.args.transcode)
+                if converted is not None:
+                    data, extension = converted
+            entry = {'sha256': digest, 'file': f'{digest[:20]}.{extension}', 'size': len(data)}
+            path = os.path.join(self.args.out_dir, entry['file'])
+            if not os.path.isfile(path):
+                with open(path + '.tmp', 'wb') as f:
+                    f.write(data)
+                os.replace(path + '.tmp', path)
+            self.stats['stored_bytes'] += len(data)
+            self.manifest.by_hash[digest] = entry
+        else:
+            self.stats['duplicates'] += 1
+        self.manifest.documents[str(doc_id)] = entry
+        self.manifest.failed.pop(str(doc_id), None)
+
+    async def worker(self, queue: asyncio.Queue) -> None:
+        while True:
+            doc_id = await queue.get()
+            try:
+                await self.store(doc_id, await self.fetch(doc_id))
+            except Exception as e:
+                self.stats['failed'] += 1
+                self.manifest.failed[str(doc_id)] = str(e)
+            finally:
+                queue.task_done()
+                done = self.stats['downloaded'] + self.stats['failed']
+                if done % 100 == 0:
+                    self.manifest.save()
+                    print(f'{done} документов, {self.stats}')
+
+    async def run(self, ids: list[int]) -> None:
+        queue = asyncio.Queue()
+        for x in ids:
+            queue.put_nowait(x)
+        timeout = aiohttp.ClientTimeout(total=self.args.timeout)
+        connector = aiohttp.TCPConnector(limit=self.args.concurrency)
+        async with aiohttp.ClientSession(timeout=timeout, connector=connector) as self.session:
+            workers = [asyncio.create_task(self.worker(queue)) for _ in range(self.args.concurrency)]
+            try:
+                await queue.join()
+            finally:
+                for x in workers:
+                    x.cancel()
+                self.manifest.save()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('tasks', help='tasks.json or NDJSON from scraper.py / parse_pages.py')
+    parser.add_argument('--out-dir', default='documents')
+    parser.add_argument('--manifest', default=None, help='defaults to <out-dir>/manifest.json')
+    parser.add_argument('--base-url', default='https://problems.ru')
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--rate', type=float, default=0.5, help='requests per second over all workers')
+    parser.add_argument('--jitter', type=float, default=1)
+    parser.add_argument('--retries', type=int, default=3)
+    parser.add_argument('--timeout', type=float, default=30)
+    parser.add_argument('--transcode', choices=['webp', 'png'], default=None, help='needs Pillow')
+    parser.add_argument('--retry-failed', action='store_true')
+    args = parser.parse_args()
+    if args.transcode and Image is None:
+        parser.error('--transcode needs Pillow')
+
+    os.makedirs(args.out_dir, exist_ok=True)
+    manifest = Manifest(args.manifest or os.path.join(args.out_dir, 'manifest.json'))
+    t = time.perf_counter()
+    ids = collect_documents(args.tasks)
+    skip = set(manifest.documents) | (set() if args.retry_failed else set(manifest.failed))
+    todo = sorted(x for x in ids if str(x) not in skip)
+    print(f'Ссылок на документы: {len(ids)}, скачать: {len(todo)} (поиск {time.perf_counter() - t:.1f} с)')
+
+    downloader = AssetDownloader(args, manifest)
+    asyncio.run(downloader.run(todo))
+    print(json.dumps(downloader.stats | {'seconds': round(time.perf_counter() - t, 1)}, indent=4))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,40 @@
+import argparse
+import json
+import os
+import tempfile
+import time
+
+from parse_pages import list_pages, parse_pages
+
+# Parsing throughput on a corpus of saved pages (scraper.py --raw-dir, the fixture server works too),
+# serial and with a growing process pool.
+# python bench_parse.py pages --workers 1 2 4 8
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('raw_dir')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, os.cpu_count()])
+    parser.add_argument('--chunksize', type=int, default=16)
+    parser.add_argument('--limit', type=int, default=None, help='use only the first N pages')
+    args = parser.parse_args()
+
+    paths = list_pages(args.raw_dir)[:args.limit]
+    size = sum(os.path.getsize(x) for x in paths)
+    result = {'pages': len(paths), 'megabytes': round(size / 2 ** 20, 1), 'runs': []}
+    with tempfile.TemporaryDirectory() as tmp:
+        for workers in dict.fromkeys(args.workers):
+            t = time.perf_counter()
+            parse_pages(paths, os.path.join(tmp, 'out.ndjson'), workers, args.chunksize)
+            seconds = time.perf_counter() - t
+            result['runs'].append({
+                'workers': workers,
+                'seconds': round(seconds, 3),
+                'pages_per_sec': round(len(paths) / seconds, 1),
+                'speedup': round(result['runs'][0]['seconds'] / seconds, 2) if result['runs'] else 1,
+            })
+    print(json.dumps(result, indent=4))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+import argparse
+import asyncio
+import random
+
+from aiohttp import web
+
+# Local stand-in for problems.ru with the same page structure the parsers expect.
+# Listings show --page-size problems per page, pages can be slowed down and fail with 503.
+# python fixture_server.py --port 8081 --problems 500 --latency 0.05 --error-rate 0.02
+
+LISTING = '''<html><body><table>{rows}</table></body></html>'''
+LISTING_ROW = '''<tr><td><a class="componentboxlink" href="/view_problem_details_new.php?id={id}">{id}</a></td></tr>'''
+PROBLEM = '''<html><body>
+<a class="componentboxlink" href="/view_by_subject_new.php?parent={parent}">{subject}</a>
+<a class="componentboxlink" href="/view_by_subject_new.php?parent={sub}">Подтема {sub}</a>
+<table><tr><td class="problemdetailsdifficulty"><nobr>Сложность: {difficulty}+</nobr></td></tr></table>
+<!-- комментарий -->
+<h3>Условие</h3>
+<p>Задача {id}. Найдите предел последовательности {text}</p>
+<p><img src="show_document.php?id={document}"></p>
+<h3>Решение</h3>
+<p>{solution}</p>
+<h3>Ответ</h3>
+<p>{answer}</p>
+<h3>Источники и прецеденты использования</h3>
+</body></html>'''
+
+
+def make_app(args) -> web.Application:
+    rnd = random.Random(args.seed)
+    first_id = 100000
+    words = ['функция', 'предел', 'интеграл', 'ряд', 'x<sup>2</sup>', 'сходится', 'при', 'n → ∞']
+
+    async def slow_down() -> None:
+        if args.latency:
+            await asyncio.sleep(rnd.expovariate(1 / args.latency))
+        if rnd.random() < args.error_rate:
+            raise web.HTTPServiceUnavailable()
+
+    async def listing(request: web.Request) -> web.Response:
+        await slow_down()
+        start = int(request.query.get('start', 0))
+        ids = range(first_id + start, first_id + min(start + args.page_size, args.problems))
+        rows = ''.join(LISTING_ROW.format(id=x) for x in ids)
+        return web.Response(text=LISTING.format(rows=rows), content_type='text/html')
+
+    async def problem(request: web.Request) -> web.Response:
+        await slow_down()
+        p_id = int(request.query['id'])
+        if not first_id <= p_id < first_id + args.problems:
+            raise web.HTTPNotFound()
+        local = random.Random(p_id)
+        return web.Response(text=PROBLEM.format(
+            id=p_id,
+            parent=214,
+            subject='Математический анализ',
+            sub=local.randint(1, 20),
+            difficulty=local.randint(1, 6),
+            text=' '.join(local.choices(words, k=30)),
+            document=local.randint(1, 1000),
+            solution=' '.join(local.choices(words, k=120)),
+            answer=local.randint(0, 100),
+        ), content_type='text/html')
+
+    app = web.Application()
+    app.router.add_get('/view_by_subject_new.php', listing)
+    app.router.add_get('/view_problem_details_new.php', problem)
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--problems', type=int, default=500)
+    parser.add_argument('--page-size', type=int, default=100)
+    parser.add_argument('--latency', type=float, default=0.05, help='mean response delay in seconds')
+    parser.add_argument('--error-rate', type=float, default=0)
+    parser.add_argument('--seed', type=int, default=1518)
+    args = parser.parse_args()
+    web.run_app(make_app(args), port=args.port)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,50 +1,106 @@
+import argparse
 import json
-from ntpath import isfile
+import os
 import re
-import requests
+import sys
 import time
-import os
-import random
 
+# records.py is shared with the server's importer and lives in the repository root
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from records import iter_records, write_record
+
+# Normalizes scraped problems (tasks.json or NDJSON from scraper.py / parse_pages.py) into the bulk
+# importer format, one record at a time, so memory stays flat on any dump size.
+# The output goes straight to POST /admin/import_tasks_stream.
+# python parse_json.py tasks.ndjson --category 'Математический анализ' --manifest documents/manifest.json
+
+# one pass per field: whitespace runs, document links (with any number of repeated site prefixes)
+# and repeated site prefixes in front of other links
+REWRITE = re.compile(
+    r'(?P<space>\s+)'
+    r'|(?:https://problems\.ru/)*show_document\.php\?id=(?P<document>\d+)'
+    r'|(?P<prefix>(?:https://problems\.ru/)+)(?=https://problems\.ru)')
+
+
+class Normalizer:
+    def __init__(self, category: str, source: str, answer_type: str, cdn_url: str, manifest: dict | None) -> None:
+        self.category = category
+        self.source = source
+        self.answer_type = answer_type
+        self.cdn_url = cdn_url.rstrip('/')
+        self.manifest = manifest
+        self.documents: set[int] = set()
+        self.missing: set[int] = set()
 
-with open('tasks.json', encoding='utf8') as f:
-    data = json.load(f)
+    def link(self, doc_id: str) -> str:
+        self.documents.add(int(doc_id))
+        if self.manifest is None:
+            return f'{self.cdn_url}/{doc_id}.gif'
+        entry = self.manifest.get(doc_id)
+        if entry is None:
+            # not downloaded (yet), the original link keeps working
+            self.missing.add(int(doc_id))
+            return f'https://problems.ru/show_document.php?id={doc_id}'
+        return f'{self.cdn_url}/{entry["file"]}'
 
-name = input('name> ')
+    def rewrite(self, match: re.Match) -> str:
+        if match.lastgroup == 'space':
+            return ' '
+        if match.lastgroup == 'document':
+            return self.link(match.group('document'))
+        return ''
 
-links = set()
+    def text(self, value) -> str:
+        return REWRITE.sub(self.rewrite, value or '').strip()
 
-pattern = re.compile(r"https://problems.ru/show_document.php\?id=(\d+)")
+    def record(self, data: dict) -> dict:
+        return {
+            'id': int(data['id']),
+            'level': int(data['difficulty']),
+            'category': self.category,
+            'subcategory': sorted({x for x in data.get('subcategory') or [] if x != 'Неопределено'}),
+            'condition': self.text(data.get('condition')),
+            'solution': self.text(data.get('solution')),
+            'answer': self.text(data.get('answer')),
+            'source': self.source,
+            'answer_type': self.answer_type,
+        }
 
 
-def replace_links(s):
-    return pattern.sub(lambda x: f'https://cdn.saslo.fun/{x.group(1)}.gif', s)
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('tasks', nargs='?', default='tasks.json')
+    parser.add_argument('--category', required=True, help='category name, e.g. Математический анализ')
+    parser.add_argument('--out', default=None, help='defaults to <category>.ndjson')
+    parser.add_argument('--source', default='problems.ru')
+    parser.add_argument('--answer-type', default='string')
+    parser.add_argument('--cdn-url', default='https://cdn.saslo.fun')
+    parser.add_argument('--manifest', default=None, help='manifest.json from assets.py, links point to stored files')
+    args = parser.parse_args()
 
+    manifest = None
+    if args.manifest:
+        with open(args.manifest, encoding='utf8') as f:
+            manifest = json.load(f)['documents']
+    normalizer = Normalizer(args.category, args.source, args.answer_type, args.cdn_url, manifest)
 
-for d in data:
-    d['condition'] = d['condition'].replace('https://problems.ru/https://problems.ru', 'https://problems.ru')
-    d['solution'] = d['solution'].replace('https://problems.ru/https://problems.ru', 'https://problems.ru')
-    d['answer'] = d['answer'].replace('https://problems.ru/https://problems.ru', 'https://problems.ru')
-    links |= set(map(int, pattern.findall(d['condition'])))
-    links |= set(map(int, pattern.findall(d['solution'])))
-    links |= set(map(int, pattern.findall(d['answer'])))
-    d['condition'] = replace_links(' '.join(d['condition'].split()))
-    d['solution'] = replace_links(' '.join(d['solution'].split()))
-    d['answer'] = replace_links(' '.join(d['answer'].split()))
-    d['subcategory'] = sorted([x for x in set(d['subcategory']) if x != 'Неопределено'])
+    t = time.perf_counter()
+    written = skipped = 0
+    with open(args.out or args.category + '.ndjson', 'w', encoding='utf8') as f:
+        for data in iter_records(args.tasks):
+            try:
+                record = normalizer.record(data)
+            except (KeyError, TypeError, ValueError) as e:
+                skipped += 1
+                print(f'пропущена запись {data.get("id") if isinstance(data, dict) else data!r}: {e!r}')
+                continue
+            write_record(f, record)
+            written += 1
+    print(f'{written} задач за {time.perf_counter() - t:.1f} с, пропущено {skipped}, '
+          f'документов {len(normalizer.documents)}, не скачано {len(normalizer.missing)}')
+    if normalizer.missing:
+        print(f'скачать недостающие: python assets.py {args.tasks}')
 
-with open(name + '.json', 'w', encoding='utf8') as f:
-    json.dump(data, f, indent=4, ensure_ascii=False)
 
-for i, id in enumerate(links):
-    url = f'https://problems.ru/show_document.php?id={id}'
-    print(f'downloading document {url} {i + 1}/{len(links)}')
-    if os.path.isfile(f'documents/{id}.gif'):
-        continue
-    r = requests.get(url)
-    if r.status_code == 200:
-        with open(f'documents/{id}.gif', 'wb') as f:
-            f.write(r.content)
-            time.sleep(random.randint(3, 5))
-    else:
-        print('error')
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from parse_problems_ru import parse_problem_html
+
+# Parsing stage for pages saved by `scraper.py --raw-dir`: BeautifulSoup work is CPU-bound,
+# so files are spread over a process pool and the records are written as NDJSON in id order.
+# python parse_pages.py pages --out tasks.ndjson --workers 8
+
+
+def list_pages(raw_dir: str) -> list[str]:
+    names = [x for x in os.listdir(raw_dir) if x.endswith('.html') and x[:-5].isnumeric()]
+    return [os.path.join(raw_dir, x) for x in sorted(names, key=lambda x: int(x[:-5]))]
+
+
+def parse_file(path: str) -> dict:
+    p_id = int(os.path.basename(path)[:-5])
+    with open(path, encoding='utf8') as f:
+        return parse_problem_html(p_id, f.read())
+
+
+def write_records(f, records) -> int:
+    count = 0
+    for record in records:
+        f.write(json.dumps(record, ensure_ascii=False) + '\n')
+        count += 1
+    return count
+
+
+def parse_pages(paths: list[str], out: str, workers: int | None = None, chunksize: int = 16) -> int:
+    with open(out, 'w', encoding='utf8') as f:
+        if workers == 1:
+            return write_records(f, map(parse_file, paths))
+        with ProcessPoolExecutor(workers) as pool:
+            return write_records(f, pool.map(parse_file, paths, chunksize=chunksize))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('raw_dir')
+    parser.add_argument('--out', default='tasks.ndjson')
+    parser.add_argument('--workers', type=int, default=None, help='defaults to the number of CPUs')
+    parser.add_argument('--chunksize', type=int, default=16)
+    args = parser.parse_args()
+
+    paths = list_pages(args.raw_dir)
+    t = time.perf_counter()
+    count = parse_pages(paths, args.out, args.workers, args.chunksize)
+    seconds = time.perf_counter() - t
+    print(f'{count} страниц за {seconds:.1f} с, {count / seconds:.1f} страниц/с')
+
+
+if __name__ == '__main__':
+    main()
@@ -9,78 +9,89 @@ def get_all_text_after(element):
     if not element:
         return ''
 
-    result_text = ''
+    parts = []
 
     next_element = element.next_sibling
 
     while next_element and not (
             next_element.name is not None and next_element.name.startswith('h')):
-        # print('!' + str(next_element))
-        # if next_element.string:
-        #     result_text += next_element.string.strip()
-        # elif next_element.name == 'p':
-        #     result_text += next_element.get_text().strip()
-        result_text += str(next_element).strip()
-        # print('?' + result_text)
+        parts.append(str(next_element).strip())
         next_element = next_element.next_sibling
 
-    return result_text.replace('<p></p>', '').replace('\n', ' ').replace('\r', ' ').replace(
+    return ''.join(parts).replace('<p></p>', '').replace('\n', ' ').replace('\r', ' ').replace(
         'show_document.php', 'https://problems.ru/show_document.php').replace('/view_by_author.php', 'https://problems.ru/view_by_author.php').strip()
 
 
+def parse_problem_html(p_id, html):
+    soup = BeautifulSoup(html, "lxml")
+
+    for comment in soup.find_all(
+            text=lambda text: isinstance(text, Comment)):
+        comment.extract()
+    # print(soup.prettify())
+
+    condition_text = get_all_text_after(soup.find('h3', string='Условие'))
+    solution_text = get_all_text_after(soup.find('h3', string='Решение'))
+    answer_text = get_all_text_after(soup.find('h3', string='Ответ'))
+
+    # print(condition_text)
+    # print()
+    # print(solution_text)
+    # print()
+    # print(answer_text)
+
+    x = soup.find_all('a', class_='componentboxlink')
+    # print(theme)
+    subcategory = []
+    for el in x:
+        if el['href'] and el['href'].startswith(
+                '/view_by_subject_new.php'):
+            subcategory.append(el.string.strip())
+
+    # print()
+    # print(subcategory)
+
+    x = soup.find('td', class_='problemdetailsdifficulty')
+    diff = -1
+
+    if x:
+        for c in x.children:
+            if c.string and 'Сложность' in c.string:
+                diff = c.string.split(
+                )[-1].replace('-', '').replace('+', '')
+
+    # print()
+    # print(diff)
+
+    return {
+        'id': p_id,
+        'condition': condition_text,
+        'solution': solution_text,
+        'answer': answer_text,
+        'subcategory': subcategory,
+        'difficulty': diff
+    }
+
+
+def parse_listing_html(html):
+    # problem ids linked from one page of a subject listing
+    soup = BeautifulSoup(html, 'lxml')
+    res = []
+    for el in soup.find_all('a', class_='componentboxlink'):
+        if el['href'] and el['href'].startswith(
+                '/view_problem_details_new.php'):
+            s = el.string.strip()
+            if s.isnumeric():
+                res.append(int(s))
+    return res
+
+
 def parse_problem(p_id):
     url = f'https://problems.ru/view_problem_details_new.php?id={p_id}'
     page = requests.get(url)
 
     if page.status_code == 200:
-        soup = BeautifulSoup(page.text, "lxml")
-
-        for comment in soup.find_all(
-                text=lambda text: isinstance(text, Comment)):
-            comment.extract()
-        # print(soup.prettify())
-
-        condition_text = get_all_text_after(soup.find('h3', string='Условие'))
-        solution_text = get_all_text_after(soup.find('h3', string='Решение'))
-        answer_text = get_all_text_after(soup.find('h3', string='Ответ'))
-
-        # print(condition_text)
-        # print()
-        # print(solution_text)
-        # print()
-        # print(answer_text)
-
-        x = soup.find_all('a', class_='componentboxlink')
-        # print(theme)
-        subcategory = []
-        for el in x:
-            if el['href'] and el['href'].startswith(
-                    '/view_by_subject_new.php'):
-                subcategory.append(el.string.strip())
-
-        # print()
-        # print(subcategory)
-
-        x = soup.find('td', class_='problemdetailsdifficulty')
-        diff = -1
-
-        if x:
-            for c in x.children:
-                if c.string and 'Сложность' in c.string:
-                    diff = c.string.split(
-                    )[-1].replace('-', '').replace('+', '')
-
-        # print()
-        # print(diff)
-
-        return {
-            'id': p_id,
-            'condition': condition_text,
-            'solution': solution_text,
-            'answer': answer_text,
-            'subcategory': subcategory,
-            'difficulty': diff
-        }
+        return parse_problem_html(p_id, page.text)
     else:
         # print(page.status_code)
         return {}
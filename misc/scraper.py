@@ -0,0 +1,217 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+
+import aiohttp
+
+from parse_problems_ru import parse_problem_html, parse_listing_html
+
+# Async problems.ru scraper: listing pages are walked in order, problem pages are fetched by a few
+# workers behind one shared rate limiter. Every parsed problem is appended to an NDJSON file and the
+# listing offsets are checkpointed, so an interrupted run continues where it stopped.
+# python scraper.py --parent 214 --total 500 --out tasks.ndjson
+# fetching only, parsing is done separately by parse_pages.py:
+# python scraper.py --parent 214 --raw-dir pages
+# against the local fixture server:
+# python scraper.py --base-url http://localhost:8081 --parent 214 --rate 100 --concurrency 16
+
+
+class RateLimiter:
+    # at most `rate` request starts per second over all workers, with a random extra pause
+    def __init__(self, rate: float, jitter: float = 0) -> None:
+        self.interval = 1 / rate if rate > 0 else 0
+        self.jitter = jitter
+        self.next_time = 0.0
+        self.lock = asyncio.Lock()
+
+    async def wait(self) -> None:
+        async with self.lock:
+            now = time.monotonic()
+            delay = self.next_time - now
+            self.next_time = max(now, self.next_time) + self.interval + random.uniform(0, self.jitter)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class Checkpoint:
+    # listing offsets, listed but not yet written ids and failed ids, written atomically;
+    # done ids are read back from the output file
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.offsets: dict[str, int] = {}
+        self.finished: set[str] = set()
+        self.pending: set[int] = set()
+        self.failed: dict[str, str] = {}
+        if os.path.isfile(path):
+            with open(path, encoding='utf8') as f:
+                data = json.load(f)
+            self.offsets = data['offsets']
+            self.finished = set(data['finished'])
+            self.pending = set(data['pending'])
+            self.failed = data['failed']
+
+    def save(self) -> None:
+        with open(self.path + '.tmp', 'w', encoding='utf8') as f:
+            json.dump({'offsets': self.offsets, 'finished': sorted(self.finished), 'pending': sorted(self.pending),
+                       'failed': self.failed}, f, ensure_ascii=False)
+        os.replace(self.path + '.tmp', self.path)
+
+
+def read_done(path: str) -> set[int]:
+    # a run killed in the middle of a write leaves a partial last line, it is cut off here
+    done = set()
+    if not os.path.isfile(path):
+        return done
+    good = 0
+    with open(path, 'rb') as f:
+        for line in f:
+            try:
+                done.add(json.loads(line)['id'])
+            except (ValueError, KeyError):
+                break
+            good += len(line)
+    with open(path, 'rb+') as f:
+        f.truncate(good)
+    return done
+
+
+def read_raw_done(raw_dir: str) -> set[int]:
+    os.makedirs(raw_dir, exist_ok=True)
+    return {int(x[:-5]) for x in os.listdir(raw_dir) if x.endswith('.html') and x[:-5].isnumeric()}
+
+
+def save_raw(raw_dir: str, p_id: int, html: str) -> None:
+    path = os.path.join(raw_dir, f'{p_id}.html')
+    with open(path + '.tmp', 'w', encoding='utf8') as f:
+        f.write(html)
+    os.replace(path + '.tmp', path)
+
+
+class Scraper:
+    def __init__(self, args) -> None:
+        self.args = args
+        self.base_url = args.base_url.rstrip('/')
+        self.limiter = RateLimiter(args.rate, args.jitter)
+        self.checkpoint = Checkpoint(args.checkpoint or args.out + '.state')
+        # with --raw-dir pages are only saved, parse_pages.py turns them into records later
+        self.done = read_raw_done(args.raw_dir) if args.raw_dir else read_done(args.out)
+        self.checkpoint.pending -= self.done
+        self.queue: asyncio.Queue[int] = asyncio.Queue(maxsize=args.concurrency * 4)
+        self.out = None
+        self.session = None
+        self.written = 0
+        self.started = time.monotonic()
+
+    async def fetch(self, path: str) -> str | None:
+        for attempt in range(self.args.retries + 1):
+            await self.limiter.wait()
+            try:
+                async with self.session.get(self.base_url + path) as response:
+                    if response.status == 200:
+                        return await response.text()
+                    if response.status == 404:
+                        return None
+                    error = f'HTTP {response.status}'
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                error = str(e) or type(e).__name__
+            print(f'{path}: {error}, попытка {attempt + 1}')
+            await asyncio.sleep(min(2 ** attempt, 60))
+        raise RuntimeError(error)
+
+    async def walk_listing(self, parent: str) -> None:
+        key = str(parent)
+        if key in self.checkpoint.finished:
+            return
+        start = self.checkpoint.offsets.get(key, 0)
+        while self.args.total is None or start < self.args.total:
+            html = await self.fetch(f'/view_by_subject_new.php?parent={parent}&start={start}')
+            ids = parse_listing_html(html) if html else []
+            if not ids:
+                break
+            new = [x for x in ids if x not in self.done and x not in self.checkpoint.pending]
+            self.checkpoint.pending.update(new)
+            start += len(ids)
+            self.checkpoint.offsets[key] = start
+            self.checkpoint.save()
+            for p_id in new:
+                await self.queue.put(p_id)
+        self.checkpoint.finished.add(key)
+        self.checkpoint.save()
+
+    async def worker(self) -> None:
+        while True:
+            p_id = await self.queue.get()
+            try:
+                if p_id in self.done:
+                    continue
+                html = await self.fetch(f'/view_problem_details_new.php?id={p_id}')
+                if html is None:
+                    self.checkpoint.pending.discard(p_id)
+                    self.checkpoint.failed[str(p_id)] = 'not found'
+                    continue
+                if self.args.raw_dir:
+                    save_raw(self.args.raw_dir, p_id, html)
+                else:
+                    record = parse_problem_html(p_id, html)
+                    self.out.write(json.dumps(record, ensure_ascii=False) + '\n')
+                    self.out.flush()
+                self.done.add(p_id)
+                self.checkpoint.pending.discard(p_id)
+                self.checkpoint.failed.pop(str(p_id), None)
+                self.written += 1
+                if self.written % 50 == 0:
+                    print(f'{self.written} задач, {self.written / (time.monotonic() - self.started):.2f} задач/с')
+            except Exception as e:
+                self.checkpoint.pending.discard(p_id)
+                self.checkpoint.failed[str(p_id)] = str(e)
+            finally:
+                self.queue.task_done()
+
+    async def run(self) -> None:
+        timeout = aiohttp.ClientTimeout(total=self.args.timeout)
+        headers = {'User-Agent': self.args.user_agent}
+        connector = aiohttp.TCPConnector(limit=self.args.concurrency)
+        async with aiohttp.ClientSession(timeout=timeout, headers=headers, connector=connector) as self.session:
+            with open(os.devnull if self.args.raw_dir else self.args.out, 'a', encoding='utf8') as self.out:
+                workers = [asyncio.create_task(self.worker()) for _ in range(self.args.concurrency)]
+                try:
+                    # ids listed by the previous run but not written yet go first
+                    resume = self.checkpoint.pending - self.done
+                    if self.args.retry_failed:
+                        resume |= set(map(int, self.checkpoint.failed)) - self.done
+                        self.checkpoint.pending |= resume
+                    for p_id in sorted(resume):
+                        await self.queue.put(p_id)
+                    for parent in self.args.parent:
+                        await self.walk_listing(parent)
+                    await self.queue.join()
+                finally:
+                    for x in workers:
+                        x.cancel()
+                    self.checkpoint.save()
+        print(f'Готово: {self.written} новых задач, всего {len(self.done)}, ошибок {len(self.checkpoint.failed)}')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--base-url', default='https://problems.ru')
+    parser.add_argument('--parent', action='append', required=True, help='subject id, can be repeated')
+    parser.add_argument('--total', type=int, default=None, help='stop every listing after this many problems')
+    parser.add_argument('--out', default='tasks.ndjson')
+    parser.add_argument('--checkpoint', default=None, help='defaults to <out>.state')
+    parser.add_argument('--raw-dir', default=None, help='save raw pages as <id>.html instead of parsing them')
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--rate', type=float, default=0.2, help='requests per second over all workers')
+    parser.add_argument('--jitter', type=float, default=2, help='extra random pause in seconds')
+    parser.add_argument('--retries', type=int, default=3)
+    parser.add_argument('--timeout', type=float, default=30)
+    parser.add_argument('--retry-failed', action='store_true')
+    parser.add_argument('--user-agent', default='olymp-backend scraper')
+    asyncio.run(Scraper(parser.parse_args()).run())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+from __future__ import annotations
+
+from collections import Counter
+import asyncio
+import cProfile
+import io
+import logging
+import marshal
+import os
+import pstats
+import sys
+import threading
+import time
+import traceback
+
+import metrics
+
+# On-demand profiling of a running worker (POST /admin/profile) and an event loop stall watchdog.
+# The sampling profiler walks sys._current_frames() of every thread (event loop and to_thread pool)
+# and returns collapsed stacks for flamegraph.pl / speedscope; cProfile mode profiles the event loop
+# thread and returns a pstats dump.
+
+log = logging.getLogger('olymp.profiling')
+
+# a stall longer than this (seconds) is logged with the stack of the loop thread, 0 disables the watchdog
+LOOP_STALL_THRESHOLD = float(os.getenv('LOOP_STALL_THRESHOLD', 0.5))
+MAX_PROFILE_SECONDS = 60
+
+loop_lag = metrics.Histogram('event_loop_lag_seconds', 'Event loop scheduling delay',
+                             buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10))
+loop_stalls = metrics.Counter('event_loop_stalls_total', 'Event loop stalls above LOOP_STALL_THRESHOLD')
+
+# one capture at a time per worker
+lock = asyncio.Lock()
+
+
+def frame_name(frame) -> str:
+    code = frame.f_code
+    return f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'
+
+
+def collapse(frame) -> list[str]:
+    stack = []
+    while frame is not None:
+        stack.append(frame_name(frame))
+        frame = frame.f_back
+    stack.reverse()
+    return stack
+
+
+def sample_stacks(seconds: float, interval: float, idle: bool = False) -> tuple[Counter, int]:
+    # runs in its own thread, so the event loop keeps working while it is sampled
+    me = threading.get_ident()
+    stacks = Counter()
+    samples = 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        names = {x.ident: x.name for x in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            stack = collapse(frame)
+            # threads parked in select() or a queue wait would dominate the graph
+            if not idle and stack and stack[-1].split(' ', 1)[0] in ('select', 'poll', 'wait', '_worker', 'sleep'):
+                continue
+            stacks[';'.join([names.get(ident, str(ident))] + stack)] += 1
+        samples += 1
+        time.sleep(interval)
+    return stacks, samples
+
+
+async def sample(seconds: float, interval: float = 0.005, idle: bool = False) -> str:
+    async with lock:
+        stacks, samples = await asyncio.to_thread(sample_stacks, seconds, interval, idle)
+    lines = [f'{stack} {count}' for stack, count in stacks.most_common()]
+    log.info('Профиль: %d снимков за %.1f с, %d стеков', samples, seconds, len(stacks))
+    return '\n'.join(lines) + '\n'
+
+
+async def cprofile(seconds: float, text: bool = False) -> bytes:
+    # the profiler is enabled on the event loop thread, every callback run there while we sleep is
+    # recorded; code in to_thread workers shows up only as the awaiting coroutine
+    async with lock:
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            profiler.disable()
+    profiler.create_stats()
+    if text:
+        out = io.StringIO()
+        pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(80)
+        return out.getvalue().encode()
+    return marshal.dumps(profiler.stats)
+
+
+class LoopWatchdog:
+    # a heartbeat coroutine stamps the time on every wakeup; a thread checks the stamp and, when the
+    # loop has not come back for longer than the threshold, logs what the loop thread is doing
+    def __init__(self, threshold: float) -> None:
+        self.threshold = threshold
+        self.interval = threshold / 4
+        self.beat = time.monotonic()
+        self.loop_thread: int | None = None
+        self.stop = threading.Event()
+        self.task: asyncio.Task | None = None
+
+    async def heartbeat(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            self.beat = time.monotonic()
+            loop_lag.observe(max(loop.time() - start - self.interval, 0))
+
+    def watch(self) -> None:
+        reported = None
+        while not self.stop.wait(self.interval):
+            beat = self.beat
+            stalled = time.monotonic() - beat
+            if stalled < self.threshold or reported == beat:
+                continue
+            reported = beat
+            loop_stalls.inc()
+            frame = sys._current_frames().get(self.loop_thread)
+            stack = ''.join(traceback.format_stack(frame)) if frame is not None else ''
+            log.warning('Цикл событий заблокирован %.2f с:\n%s', stalled, stack)
+
+    def start(self) -> None:
+        self.loop_thread = threading.get_ident()
+        self.beat = time.monotonic()
+        self.task = asyncio.create_task(self.heartbeat())
+        threading.Thread(target=self.watch, name='loop-watchdog', daemon=True).start()
+
+    def close(self) -> None:
+        self.stop.set()
+        if self.task is not None:
+            self.task.cancel()
+
+
+def start_watchdog() -> LoopWatchdog | None:
+    if LOOP_STALL_THRESHOLD <= 0:
+        return None
+    watchdog = LoopWatchdog(LOOP_STALL_THRESHOLD)
+    watchdog.start()
+    return watchdog
@@ -0,0 +1,89 @@
+import json
+from typing import Iterator
+
+# Streaming reader for task dumps: a JSON array (tasks.json) or NDJSON (scraper output). One tokenizer
+# for the HTTP import (importer.iter_records feeds it the request body) and the misc scripts (iter_records
+# below feeds it a file); records are yielded one by one, the input is never loaded whole.
+
+CHUNK_SIZE = 1 << 20
+# a single array element that does not parse within this many characters is reported as broken
+MAX_RECORD_SIZE = 16 * 1024 * 1024
+
+
+class RecordReader:
+    # feed() text as it arrives; yields (record, None) or (None, error) and keeps only the unfinished tail
+    def __init__(self, max_record_size: int = MAX_RECORD_SIZE) -> None:
+        self.decoder = json.JSONDecoder()
+        self.max_record_size = max_record_size
+        self.buffer = ''
+        self.mode = None
+        self.done = False
+
+    def feed(self, text: str, eof: bool = False) -> Iterator[tuple[dict | None, str | None]]:
+        if self.done:
+            return
+        self.buffer += text
+        if self.mode is None:
+            self.buffer = self.buffer.lstrip('\ufeff \t\r\n')
+            if not self.buffer:
+                self.done = eof
+                return
+            self.mode = 'array' if self.buffer[0] == '[' else 'lines'
+            if self.mode == 'array':
+                self.buffer = self.buffer[1:]
+
+        if self.mode == 'lines':
+            lines = self.buffer.split('\n')
+            self.buffer = '' if eof else lines.pop()
+            self.done = eof
+            for line in lines:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line), None
+                except json.JSONDecodeError as e:
+                    yield None, f'некорректный JSON: {e}'
+            return
+
+        buffer = self.buffer
+        pos = 0
+        while True:
+            while pos < len(buffer) and buffer[pos] in ' \t\r\n,':
+                pos += 1
+            if pos < len(buffer) and buffer[pos] == ']':
+                self.done = True
+                break
+            if pos >= len(buffer):
+                break
+            try:
+                record, pos = self.decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError as e:
+                if eof or len(buffer) - pos > self.max_record_size:
+                    self.done = True
+                    self.buffer = ''
+                    yield None, f'некорректный JSON: {e}'
+                    return
+                # the record is cut by the chunk boundary, wait for more
+                break
+            yield record, None
+        self.buffer = buffer[pos:]
+        if eof and not self.done:
+            # a truncated upload or file: every element parsed but the closing bracket never came
+            self.done = True
+            yield None, 'массив JSON не закрыт'
+
+
+def iter_records(path: str) -> Iterator[dict]:
+    reader = RecordReader()
+    with open(path, encoding='utf8') as f:
+        while not reader.done:
+            chunk = f.read(CHUNK_SIZE)
+            for record, error in reader.feed(chunk, eof=not chunk):
+                if error is not None:
+                    raise ValueError(f'{path}: {error}')
+                yield record
+
+
+def write_record(f, record: dict) -> None:
+    f.write(json.dumps(record, ensure_ascii=False) + '\n')
@@ -7,6 +7,8 @@ from . import battle
 from . import tasks
 from . import analytics
 from . import user
+from . import tournament
+from . import monitoring
 
 router.include_router(authorization.router)
 router.include_router(administration.router)
@@ -15,4 +17,6 @@ router.include_router(battle.router)
 router.include_router(tasks.router)
 router.include_router(analytics.router)
 router.include_router(user.router)
+router.include_router(tournament.router)
+router.include_router(monitoring.router)
 
@@ -1,197 +1,334 @@
+import base64
 import json
-from fastapi import APIRouter, HTTPException, Header, Query
-from fastapi.responses import JSONResponse
-from sqlalchemy import select, insert, or_, and_, update
-from typing import Annotated, Any
+import uuid
+from datetime import date
+from fastapi import APIRouter, HTTPException, Header, Query, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+from sqlalchemy import select, insert, or_, and_, update, func, tuple_
+from typing import Annotated, Any, Optional
 from pydantic import BaseModel
 from fastapi.security import APIKeyHeader
 from fastapi.params import Depends
 import database
+import dedup as dedup_index
+import exporter
+import importer
+import profiling
+import taxonomy
 import utils
 
 router = APIRouter(prefix='/admin')
 API_Key_Header = APIKeyHeader(name='Authorization', auto_error=True)
 
 
+HISTORY_SUMMARY_FIELDS = ('winner', 'total_points', 'tasks_count', 'duration_minutes', 'players', 'result1', 'result2')
+
+
 @router.get('/statistics')
-async def get_statistics(token: str = Depends(API_Key_Header)) -> JSONResponse:
-    async with database.sessions.begin() as session:
-        user = await utils.token_to_user(session, token)
-        if user is None:
-            raise HTTPException(403, {'error': 'Пользователь не существует'})
-        if user.role == 'administrator':
-            request = await session.execute(select(database.BattleHistory))
-        else:
-            request = await session.execute(select(database.BattleHistory).where(
-                or_(database.BattleHistory.id1 == user.id, database.BattleHistory.id2 == user.id)
-            ))
-        history = request.scalars().all()
-        history_list = []
-        for battle in history:
-            battle_dict = {
-                'id': battle.id,
-                'id1': battle.id1,
-                'id2': battle.id2,
-                'date': battle.date.isoformat() if battle.date else None,
-                'data': battle.data or {}
-            }
-            history_list.append(battle_dict)
-        return utils.json_response({'history': history_list})
+async def get_statistics(session: utils.Session, cursor: Optional[int] = None, limit: int = Query(50, ge=1, le=500),
+                         date_from: Optional[date] = None, date_to: Optional[date] = None,
+                         player: Optional[int] = None, full: bool = False,
+                         token: str = Depends(API_Key_Header)) -> JSONResponse:
+    user = await utils.token_to_user(session, token)
+    if user is None:
+        raise HTTPException(403, {'error': 'Пользователь не существует'})
+    if user.role != 'administrator':
+        player = user.id
+
+    history = database.BattleHistory
+    columns = [history.id, history.id1, history.id2, history.date]
+    if full:
+        columns.append(history.data)
+    else:
+        # only the summary fields are pulled out of the data blob
+        columns += [history.data[x].label(x) for x in HISTORY_SUMMARY_FIELDS]
+    query = select(*columns).order_by(history.id.desc()).limit(limit)
+    if cursor is not None:
+        query = query.where(history.id < cursor)
+    if date_from is not None:
+        query = query.where(history.date >= date_from)
+    if date_to is not None:
+        query = query.where(history.date <= date_to)
+    if player is not None:
+        query = query.where(or_(
+            history.id1 == player,
+            history.id2 == player,
+            history.id.in_(select(database.BattlePlayers.battle_id).where(database.BattlePlayers.user_id == player)),
+        ))
+
+    rows = (await session.execute(query)).mappings().all()
+    history_list = [dict(x) | {'date': x['date'].isoformat() if x['date'] else None} for x in rows]
+    if full:
+        for x in history_list:
+            x['data'] = x['data'] or {}
+    next_cursor = rows[-1]['id'] if len(rows) == limit else None
+    return utils.json_response({'history': history_list, 'next_cursor': next_cursor})
 
 
 @router.post('/change_role')
-async def change_role(role: str, user_id: int, token: str=Depends(API_Key_Header)) -> JSONResponse:
-    async with database.sessions.begin() as session:
-        user = await utils.token_to_user(session, token)
-        if user is None:
-            raise HTTPException(403, {'error': 'Пользователь не существует'})
-        if user.role == 'administrator':
-            await session.execute(update(database.Users).where(database.Users.id == user_id).values(role=role, blocked=False))
-        else:
-            raise HTTPException(403, {'error': 'нужны права администратора!'})
+async def change_role(session: utils.Session, role: str, user_id: int, token: str=Depends(API_Key_Header)) -> JSONResponse:
+    user = await utils.token_to_user(session, token)
+    if user is None:
+        raise HTTPException(403, {'error': 'Пользователь не существует'})
+    if user.role == 'administrator':
+        await session.execute(update(database.Users).where(database.Users.id == user_id).values(role=role, blocked=False))
+    else:
+        raise HTTPException(403, {'error': 'нужны права администратора!'})
+
 
+USER_SORT_KEYS = {
+    'id': lambda: database.Users.id,
+    'points': lambda: database.Users.points,
+    'name': lambda: database.Users.name,
+}
 
+
+def encode_cursor(value, id: int) -> str:
+    return base64.urlsafe_b64encode(json.dumps([value, id], ensure_ascii=False).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> list:
+    try:
+        value, id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return [value, int(id)]
+    except (ValueError, TypeError):
+        raise HTTPException(422, {'error': 'Некорректный курсор'})
+
+
+# without cursor and limit the answer is the old bare list of every matching user; with either of them it is
+# a page {'users': [...], 'next_cursor': ...} of limit (default 50) users, next_cursor is None on the last page
 @router.get('/get_all_users')
-async def get_all_users(token: str=Depends(API_Key_Header)) -> JSONResponse:
-    async with database.sessions.begin() as session:
-        user = await utils.token_to_user(session, token)
-        if user is None:
-            raise HTTPException(403, {'error': 'Пользователь не существует'})
-        if user.role == 'administrator':
-            data = (await session.execute(select(database.Users))).scalars().all()
-            return utils.json_response([
-                {
-                    'id': x.id,
-                    'role': x.role,
-                    'points': x.points,
-                    'name': x.name,
-                    'surname': x.surname,
-                    'status': x.status,
-                    'blocked': x.blocked
-                } for x in sorted(data, key=lambda i: i.id)
-            ])
-        else:
-            raise HTTPException(403, {'error': 'нужны права администратора!'})
+async def get_all_users(session: utils.Session, cursor: Optional[str] = None, limit: Optional[int] = Query(None, ge=1, le=500),
+                        sort: str = 'id', descending: bool = False, search: Optional[str] = None,
+                        status: Optional[str] = None, role: Optional[str] = None, blocked: Optional[bool] = None,
+                        token: str=Depends(API_Key_Header)) -> JSONResponse:
+    user = await utils.token_to_user(session, token)
+    if user is None:
+        raise HTTPException(403, {'error': 'Пользователь не существует'})
+    if user.role != 'administrator':
+        raise HTTPException(403, {'error': 'нужны права администратора!'})
+    if sort not in USER_SORT_KEYS:
+        raise HTTPException(422, {'error': 'Сортировка возможна по: ' + ', '.join(USER_SORT_KEYS)})
+
+    users = database.Users
+    key = USER_SORT_KEYS[sort]()
+    paginated = cursor is not None or limit is not None
+    limit = limit or 50
+    # (key, id) keyset, both columns in the same direction so one composite index serves the order
+    query = select(users.id, users.login, users.role, users.points, users.name, users.surname, users.status,
+                   users.blocked)
+    if paginated:
+        query = query.limit(limit)
+    if sort == 'id':
+        query = query.order_by(users.id.desc() if descending else users.id)
+    else:
+        query = query.order_by(*((key.desc(), users.id.desc()) if descending else (key, users.id)))
+    if cursor is not None:
+        value, last_id = decode_cursor(cursor)
+        position = users.id if sort == 'id' else tuple_(key, users.id)
+        bound = last_id if sort == 'id' else tuple_(value, last_id)
+        query = query.where(position < bound if descending else position > bound)
+    if search:
+        prefix = search.lower().replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+        query = query.where(or_(func.lower(users.login).like(prefix), func.lower(users.name).like(prefix)))
+    if status is not None:
+        query = query.where(users.status.is_(None) if status == 'none' else users.status == status)
+    if role is not None:
+        query = query.where(users.role == role)
+    if blocked is not None:
+        query = query.where(users.blocked.is_(blocked))
+
+    rows = (await session.execute(query)).mappings().all()
+    if not paginated:
+        return utils.json_response([dict(x) for x in rows])
+    next_cursor = None
+    if len(rows) == limit:
+        next_cursor = encode_cursor(rows[-1][sort], rows[-1]['id'])
+    return utils.json_response({'users': [dict(x) for x in rows], 'next_cursor': next_cursor})
 
 
 class GoofyModel(BaseModel):
     data: Any
 
 
+def dedup_mode(value: Optional[str]) -> Optional[str]:
+    # flag / merge / off, IMPORT_DEDUP from the environment when not given
+    if value is None:
+        return importer.DEDUP_MODE
+    if value == 'off':
+        return None
+    if value not in importer.DEDUP_MODES:
+        raise HTTPException(422, {'error': 'dedup может быть: flag, merge, off'})
+    return value
+
+
 @router.post('/import_task')
-async def import_task(data: GoofyModel, token: str=Depends(API_Key_Header)) -> JSONResponse:
-    async with database.sessions.begin() as session:
-        user = await utils.token_to_user(session, token)
-        if user is None:
-            raise HTTPException(403, {'error': 'Пользователь не существует'})
-        if user.role == 'administrator':
-            try:
-                await import_tasks_to_db([data.data])
-            except Exception as e:
-                raise HTTPException(403, {'error': 'Ошибка: ' + str(e)})
-        else:
-            raise HTTPException(403, {'error': 'Импортировать задачи может только администратор'})
+async def import_task(session: utils.Session, data: GoofyModel, dedup: Optional[str] = None, token: str=Depends(API_Key_Header)) -> JSONResponse:
+    user = await utils.token_to_user(session, token)
+    if user is None:
+        raise HTTPException(403, {'error': 'Пользователь не существует'})
+    if user.role == 'administrator':
+        try:
+            return utils.json_response(await import_tasks_to_db([data.data], dedup_mode(dedup)))
+        except Exception as e:
+            raise HTTPException(403, {'error': 'Ошибка: ' + str(e)})
+    else:
+        raise HTTPException(403, {'error': 'Импортировать задачи может только администратор'})
 
 
 @router.post('/import_tasks')
-async def import_tasks(data: GoofyModel, token: str=Depends(API_Key_Header)) -> JSONResponse:
+async def import_tasks(session: utils.Session, data: GoofyModel, dedup: Optional[str] = None, token: str=Depends(API_Key_Header)) -> JSONResponse:
+    user = await utils.token_to_user(session, token)
+    if user is None:
+        raise HTTPException(403, {'error': "Неверный токен"})
+    if user.role == 'administrator':
+        try:
+            return utils.json_response(await import_tasks_to_db(data.data, dedup_mode(dedup)))
+        except Exception as e:
+            raise HTTPException(403, {'error': 'Ошибка: ' + str(e)})
+    else:
+        raise HTTPException(403, {'error': 'Импортировать задачи может только администратор'})
+
+
+@router.post('/import_tasks_stream')
+async def import_tasks_stream(request: Request, job: Optional[str] = None, batch_size: int = 1000,
+                              dedup: Optional[str] = None, token: str = Depends(API_Key_Header)) -> JSONResponse:
+    # no utils.Session here: the import commits batch by batch in its own session, a request session would
+    # keep a second connection checked out for the whole upload
     async with database.sessions.begin() as session:
         user = await utils.token_to_user(session, token)
         if user is None:
             raise HTTPException(403, {'error': "Неверный токен"})
-        if user.role == 'administrator':
-            try:
-                await import_tasks_to_db(data.data)
-            except Exception as e:
-                raise HTTPException(403, {'error': 'Ошибка: ' + str(e)})
-        else:
+        if user.role != 'administrator':
             raise HTTPException(403, {'error': 'Импортировать задачи может только администратор'})
 
+    job = job or uuid.uuid4().hex
+    batch_size = min(max(batch_size, 1), 10000)
+    mode = dedup_mode(dedup)
+    async with database.sessions() as session:
+        bulk = importer.BulkImporter(session, batch_size, mode)
+        importer.jobs[job] = {'job': job, 'status': 'running'} | bulk.report()
+        batch = []
+        try:
+            async for record, error in importer.iter_records(request.stream()):
+                if error is not None:
+                    bulk.parse_error(error)
+                    continue
+                batch.append(record)
+                if len(batch) >= batch_size:
+                    await bulk.write_batch_safe(batch)
+                    await session.commit()
+                    batch = []
+                    importer.jobs[job] |= bulk.report()
+                    print(f'Импорт {job}: {bulk.rows} строк, {bulk.report()["rows_per_sec"]} строк/с')
+            if batch:
+                await bulk.write_batch_safe(batch)
+            await bulk.finish()
+            await session.commit()
+        except Exception as e:
+            dedup_index.invalidate()
+            importer.jobs[job] |= bulk.report() | {'status': 'failed', 'error': str(e)}
+            raise HTTPException(403, {'error': 'Ошибка: ' + str(e), 'job': job})
+    if bulk.inserted or bulk.merged:
+        await taxonomy.refresh()
+        await dedup_index.committed(bulk.dedup_version)
+    importer.jobs[job] |= bulk.report() | {'status': 'done'}
+    return utils.json_response(importer.jobs[job])
+
+
+@router.get('/import_status')
+async def import_status(session: utils.Session, job: str, token: str = Depends(API_Key_Header)) -> JSONResponse:
+    user = await utils.token_to_user(session, token)
+    if user is None:
+        raise HTTPException(403, {'error': 'Пользователь не существует'})
+    if user.role != 'administrator':
+        raise HTTPException(403, {'error': 'нужны права администратора!'})
+    if job not in importer.jobs:
+        raise HTTPException(404, {'error': 'Импорт не найден'})
+    return utils.json_response(importer.jobs[job])
+
 
 @router.post('/export_tasks')
-async def export_tasks(token: str=Depends(API_Key_Header)) -> JSONResponse:
+async def export_tasks(session: utils.Session, format: str = 'json', gzip: bool = False, page_size: int = Query(1000, ge=1, le=10000),
+                       token: str = Depends(API_Key_Header)) -> StreamingResponse:
+    user = await utils.token_to_user(session, token)
+    if user is None:
+        raise HTTPException(403, {'error': 'Пользователь не существует'})
+    if user.role != 'administrator':
+        raise HTTPException(403, {'error': ' Экспортировать задачи может только администратор'})
+    if format not in exporter.FORMATS:
+        raise HTTPException(422, {'error': 'Неизвестный формат, доступны: ' + ', '.join(exporter.FORMATS)})
+    if format in ('parquet', 'arrow') and exporter.pyarrow is None:
+        raise HTTPException(400, {'error': f'Формат {format} недоступен: не установлен pyarrow'})
+
+    media_type, extension = exporter.FORMATS[format]
+    filename = f'tasks.{extension}'
+    if gzip:
+        media_type, filename = 'application/gzip', filename + '.gz'
+    return StreamingResponse(exporter.export_tasks(format, gzip, page_size), media_type=media_type,
+                             headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+
+
+@router.post('/profile')
+async def profile_worker(seconds: float = Query(10, gt=0, le=profiling.MAX_PROFILE_SECONDS), mode: str = 'sample',
+                         interval_ms: float = Query(5, ge=1, le=1000), idle: bool = False, format: str = 'pstats',
+                         token: str = Depends(API_Key_Header)) -> Response:
+    # profiles the worker that received the request; with several workers repeat the call to reach the others.
+    # The token check gets its own short session so no connection stays checked out while profiling
     async with database.sessions.begin() as session:
         user = await utils.token_to_user(session, token)
         if user is None:
             raise HTTPException(403, {'error': 'Пользователь не существует'})
-        if user.role == 'administrator':
-            request = await session.execute(select(database.Tasks))
-            tasks = request.scalars().all()
-            tasks_data = [{"id": item.id,
-                           'level': item.level,
-                           'category': item.category,
-                           'subcategory': ';'.join(map(str, item.subcategory)),
-                           'condition': item.condition,
-                           'solution': item.solution,
-                           'answer': item.answer,
-                           'source': item.source,
-                           'answer_type': item.answer_type,
-                           } for item in tasks]
-            return utils.json_response({'tasks': tasks_data})
-        else:
-            raise HTTPException(403, {'error': ' Экспортировать задачи может только администратор'})
-
-
-async def import_tasks_to_db(data_list):
-    async with database.sessions.begin() as session:
-        for data in data_list:
-            if not any(x in data for x in [
-                'category', 'subcategory', 'level', 'condition', 'solution', 'answer', 'source', 'answer_type'
-            ]):
-                continue
-            cat = (await session.execute(select(database.Categories).where(database.Categories.name == data['category']))).scalar_one_or_none()
-            if cat is None:
-                cat_id = (await session.execute(insert(database.Categories).values(name=data['category']))).inserted_primary_key[0]
-            else:
-                cat_id = cat.id
-            subcat_id = []
-            for c in data['subcategory']:
-                cat = (await session.execute(select(database.SubCategories).where(and_(database.SubCategories.name == c, database.SubCategories.category_id == cat_id)))).scalar_one_or_none()
-                if cat is None:
-                    subcat_id.append((await session.execute(insert(database.SubCategories).values(name=c, category_id=cat_id))).inserted_primary_key[0])
-                else:
-                    subcat_id.append(cat.id)
-            data['category'] = cat_id
-            data['subcategory'] = subcat_id
-            if 'id' in data:
-                if (await session.execute(select(database.Tasks).where(database.Tasks.id == int(data['id'])))).scalar_one_or_none() != None:
-                    print(f'task {data["id"]} already exists')
-                    await session.commit()
-                    return
-            await session.execute(insert(database.Tasks), data)
-            await session.commit()
+        if user.role != 'administrator':
+            raise HTTPException(403, {'error': 'нужны права администратора!'})
+    if mode not in ('sample', 'cprofile'):
+        raise HTTPException(422, {'error': 'Режим профилирования: sample или cprofile'})
+    if profiling.lock.locked():
+        raise HTTPException(409, {'error': 'Профилирование уже запущено'})
+
+    if mode == 'sample':
+        # collapsed stacks: flamegraph.pl profile.folded > profile.svg, or open in speedscope
+        return PlainTextResponse(await profiling.sample(seconds, interval_ms / 1000, idle),
+                                 headers={'Content-Disposition': 'attachment; filename="profile.folded"'})
+    if format == 'text':
+        return PlainTextResponse(await profiling.cprofile(seconds, text=True))
+    # python -m pstats profile.prof, or snakeviz profile.prof
+    return Response(await profiling.cprofile(seconds), media_type='application/octet-stream',
+                    headers={'Content-Disposition': 'attachment; filename="profile.prof"'})
+
+
+async def import_tasks_to_db(data_list, dedup: Optional[str] = importer.DEDUP_MODE) -> dict:
+    return await importer.bulk_import_tasks(list(data_list), dedup_mode=dedup)
 
 @router.post('/block_user')
-async def block_user(id: Annotated[int, Query()], token: str = Depends(API_Key_Header)):
-    async with database.sessions.begin() as session:
-        user = await utils.token_to_user(session, token)
-        if user is None:
-            raise HTTPException(403, {'error': 'Пользователя не существует'})
-        request = await session.execute(select(database.Users).where(database.Users.id == id))
-        req = request.scalar_one_or_none()
-        if req.blocked:
-            raise HTTPException(403,  {'error': 'Пользователь уже заблокирован'})
-        if req.role == 'administrator':
-            raise HTTPException(403,  {'error': 'Администраторов нельзя блокировать'})
-        if user.role == 'administrator':
-            await session.execute(
-                update(database.Users).where(and_(database.Users.id == id)).values(blocked=True))
+async def block_user(session: utils.Session, id: Annotated[int, Query()], token: str = Depends(API_Key_Header)):
+    user = await utils.token_to_user(session, token)
+    if user is None:
+        raise HTTPException(403, {'error': 'Пользователя не существует'})
+    request = await session.execute(select(database.Users).where(database.Users.id == id))
+    req = request.scalar_one_or_none()
+    if req.blocked:
+        raise HTTPException(403,  {'error': 'Пользователь уже заблокирован'})
+    if req.role == 'administrator':
+        raise HTTPException(403,  {'error': 'Администраторов нельзя блокировать'})
+    if user.role == 'administrator':
+        await session.execute(
+            update(database.Users).where(and_(database.Users.id == id)).values(blocked=True))
 
 
 
 @router.post('/unblock_user')
-async def unblock_user(id: Annotated[int, Query()], token: str = Depends(API_Key_Header)):
-    async with database.sessions.begin() as session:
-        user = await utils.token_to_user(session, token)
-        if user is None:
-            raise HTTPException(403, {'error': 'Пользователя не существует'})
-        request = await session.execute(select(database.Users).where(database.Users.id == id))
-        req = request.scalar_one_or_none()
-        if not req.blocked:
-            raise HTTPException(403,  {'error': 'Пользователь не заблокирован'})
-        if req.role == 'administrator':
-            raise HTTPException(403,  {'error': 'Администраторов нельзя блокировать'})
-        if user.role == 'administrator':
-            await session.execute(
-                update(database.Users).where(and_(database.Users.id == id)).values(blocked=False))
+async def unblock_user(session: utils.Session, id: Annotated[int, Query()], token: str = Depends(API_Key_Header)):
+    user = await utils.token_to_user(session, token)
+    if user is None:
+        raise HTTPException(403, {'error': 'Пользователя не существует'})
+    request = await session.execute(select(database.Users).where(database.Users.id == id))
+    req = request.scalar_one_or_none()
+    if not req.blocked:
+        raise HTTPException(403,  {'error': 'Пользователь не заблокирован'})
+    if req.role == 'administrator':
+        raise HTTPException(403,  {'error': 'Администраторов нельзя блокировать'})
+    if user.role == 'administrator':
+        await session.execute(
+            update(database.Users).where(and_(database.Users.id == id)).values(blocked=False))
 
@@ -1,50 +1,216 @@
 from __future__ import annotations
 from asyncio import Task
+from collections import deque
+import asyncio
 
 from fastapi import APIRouter, HTTPException, WebSocket, Header, Depends
 from fastapi.security import APIKeyHeader
 
 from database.database import Tasks
-from utils import json_response, token_to_user, user_by_id
+from utils import Session, json_response, token_to_user, user_by_id, short_name, dumps_text
+from matchmaking import Matchmaker
 import database
+import os
 from typing import Annotated
 
 API_Key_Header = APIKeyHeader(name='Authorization', auto_error=True)
-class PlayerStats:
+EVENT_LOG_SIZE = 256
+
+
+class SeatStats:
+    # per-player stats kept as parallel arrays indexed by seat
     def __init__(self) -> None:
-        self.answered = False
-        self.correct = []
-        self.times = []
-        self.points = 0
-        self.finished = False
+        self.answered: list[bool] = []
+        self.correct: list[list[bool]] = []
+        self.times: list[list[int]] = []
+        self.points: list[int] = []
+        self.finished: list[bool] = []
+        self.answered_count: int = 0
+
+    def add_seat(self, task_count: int) -> None:
+        self.answered.append(False)
+        self.correct.append([False] * task_count)
+        self.times.append([])
+        self.points.append(0)
+        self.finished.append(False)
+
+    def remove_seat(self, seat: int) -> None:
+        if self.answered[seat]:
+            self.answered_count -= 1
+        for x in (self.answered, self.correct, self.times, self.points, self.finished):
+            del x[seat]
+
+    def reset_tasks(self, task_count: int) -> None:
+        self.correct = [[False] * task_count for _ in self.correct]
+
+    def reset_answered(self) -> None:
+        self.answered = [False] * len(self.answered)
+        self.answered_count = 0
+
+    def snapshot(self) -> list:
+        return [self.answered, self.correct, self.times, self.points, self.finished]
+
+    @classmethod
+    def from_snapshot(cls, data: list) -> SeatStats:
+        stats = cls()
+        stats.answered, stats.correct, stats.times, stats.points, stats.finished = data
+        stats.answered_count = sum(stats.answered)
+        return stats
 
 
 class Room:
-    def __init__(self, host: int, host_ws: WebSocket,
-                 other: int | None, id: int, name: str) -> None:
-        self.host = host
-        self.host_ws = host_ws
-        self.other = other
-        self.other_ws: WebSocket | None = None
+    def __init__(self, host: int, host_ws: WebSocket | None, id: int, name: str, max_players: int = 2) -> None:
         self.id = id
         self.name = name
+        self.max_players = max_players
+        self.players: list[int] = []
+        self.sockets: list[WebSocket | None] = []
+        self.seats: dict[int, int] = {}
+        self.stats = SeatStats()
+        self.spectators: dict[int, WebSocket] = {}
         self.task_data: list[dict] = []
         self.total_points: int = 0
         self.time_limit: int | None = None
         self.start_time: float | None = None
-        self.player_1_stats = PlayerStats()  # host
-        self.player_2_stats = PlayerStats()  # other
         self.status = "waiting"
         self.timer_task: Task | None = None
         self.category: int | None = None
         self.level_start: int | None = None
         self.level_end: int | None = None
         self.current_task: int = 0
+        self.tournament = None
+        # set by the first end_game, the timer and the last answer may both try to end the game
+        self.scoring = False
+        # every event sent to the room gets a seq, recent ones are kept for resume
+        self.seq: int = 0
+        self.events: deque[tuple[int, int | None, int | None, dict]] = deque(maxlen=EVENT_LOG_SIZE)
+        self.names: dict[int, str] = {}
+        self.ratings: dict[int, int] = {}
+        self.task_payloads: dict[int, dict] = {}
+        self.add_player(host, host_ws)
+
+    @property
+    def host(self) -> int:
+        return self.players[0]
+
+    @property
+    def other(self) -> int | None:
+        return self.players[1] if len(self.players) > 1 else None
+
+    def is_full(self) -> bool:
+        return len(self.players) >= self.max_players
+
+    def add_player(self, user_id: int, ws: WebSocket | None) -> int:
+        self.seats[user_id] = len(self.players)
+        self.players.append(user_id)
+        self.sockets.append(ws)
+        self.stats.add_seat(len(self.task_data))
+        return self.seats[user_id]
+
+    def remove_player(self, user_id: int) -> None:
+        seat = self.seats.pop(user_id)
+        del self.players[seat]
+        del self.sockets[seat]
+        self.stats.remove_seat(seat)
+        self.seats = {x: i for i, x in enumerate(self.players)}
+
+    def set_socket(self, user_id: int, ws: WebSocket | None) -> None:
+        if user_id in self.seats:
+            self.sockets[self.seats[user_id]] = ws
+        elif user_id in self.spectators:
+            self.spectators[user_id] = ws
+
+    def set_tasks(self, task_data: list[dict]) -> None:
+        self.task_data = task_data
+        self.task_payloads = {}
+        self.stats.reset_tasks(len(task_data))
+
+    def cache_player(self, user_id: int, name: str, points: int) -> None:
+        self.names[user_id] = name
+        self.ratings[user_id] = points
+
+    def opponent_of(self, user_id: int) -> int | None:
+        for x in self.players:
+            if x != user_id:
+                return x
+        return None
+
+    def socket_of(self, user_id: int) -> WebSocket | None:
+        if user_id in self.seats:
+            return self.sockets[self.seats[user_id]]
+        return self.spectators.get(user_id)
+
+    def task_payload(self, index: int | None = None) -> dict | None:
+        index = self.current_task if index is None else index
+        if not 0 <= index < len(self.task_data):
+            return None
+        if index not in self.task_payloads:
+            task = self.task_data[index]
+            self.task_payloads[index] = {
+                'id': task['id'],
+                'level': task['level'],
+                'subcategory': task['subcategory'],
+                'condition': task['condition'],
+                'source': task['source'],
+                'answer_type': task['answer_type'],
+            }
+        return self.task_payloads[index]
+
+    def players_json(self) -> list[dict]:
+        current = min(self.current_task, len(self.task_data) - 1)
+        return [{
+            'id': x,
+            'name': self.names.get(x),
+            'points': self.stats.points[i],
+            'answered': self.stats.answered[i],
+            'correct': self.stats.correct[i][current] if current >= 0 else False,
+        } for i, x in enumerate(self.players)]
+
+    def state(self, user_id: int, with_task: bool = True) -> dict:
+        current = min(self.current_task, len(self.task_data) - 1)
+        res = self.json() | {
+            'event': 'game_state',
+            'seq': self.seq,
+            'start_time': self.start_time,
+            'scoreboard': self.players_json(),
+            'spectator': user_id not in self.seats,
+        }
+        seat = self.seats.get(user_id)
+        if seat is not None:
+            res |= {
+                'correct': self.stats.correct[seat],
+                'points': self.stats.points[seat],
+                'answered': self.stats.answered[seat],
+                'finished': self.stats.finished[seat],
+                'times': self.stats.times[seat],
+            }
+            opponent = self.opponent_of(user_id)
+            if opponent is not None:
+                other_seat = self.seats[opponent]
+                res |= {
+                    'other_points': self.stats.points[other_seat],
+                    'other_answered': self.stats.answered[other_seat],
+                    'other_correct': self.stats.correct[other_seat][current] if current >= 0 else False,
+                    'other_name': self.names.get(opponent),
+                }
+        if with_task:
+            res['task'] = self.task_payload()
+        return res
+
+    def events_since(self, user_id: int, seq: int) -> list[dict] | None:
+        # None means the client is too far behind and needs the full state
+        if seq > self.seq or (self.events and self.events[0][0] > seq + 1) or (not self.events and seq < self.seq):
+            return None
+        return [data for event_seq, to, exclude, data in self.events
+                if event_seq > seq and to in (None, user_id) and exclude != user_id]
 
     def json(self) -> dict:
         return {
             'host': self.host,
             'other': self.other,
+            'players': self.players,
+            'max_players': self.max_players,
+            'spectators': len(self.spectators),
             'id': self.id,
             'name': self.name,
             'time_limit': self.time_limit,
@@ -57,72 +223,211 @@ class Room:
             'total_points': self.total_points
         }
 
-    async def broadcast(self, data: dict):
-        if self.host_ws:
-            await self.host_ws.send_json(data)
-        if self.other_ws:
-            await self.other_ws.send_json(data)
+    def snapshot(self) -> dict:
+        # tasks are stored by id only and re-fetched in one query on restore
+        return {
+            'id': self.id,
+            'name': self.name,
+            'players': self.players,
+            'max_players': self.max_players,
+            'tasks': [x['id'] for x in self.task_data],
+            'total_points': self.total_points,
+            'time_limit': self.time_limit,
+            'start_time': self.start_time,
+            'status': self.status,
+            'category': self.category,
+            'level_start': self.level_start,
+            'level_end': self.level_end,
+            'current_task': self.current_task,
+            'stats': self.stats.snapshot(),
+            'seq': self.seq,
+            'names': [[x, self.names[x], self.ratings.get(x)] for x in self.names],
+            'tournament': self.tournament.id if self.tournament is not None else None,
+        }
+
+    @classmethod
+    def from_snapshot(cls, data: dict, tasks: dict[int, dict]) -> Room:
+        room = cls(data['players'][0], None, data['id'], data['name'], data['max_players'])
+        for x in data['players'][1:]:
+            room.add_player(x, None)
+        room.task_data = [tasks[x] for x in data['tasks'] if x in tasks]
+        room.total_points = data['total_points']
+        room.time_limit = data['time_limit']
+        room.start_time = data['start_time']
+        room.status = data['status']
+        room.category = data['category']
+        room.level_start = data['level_start']
+        room.level_end = data['level_end']
+        room.current_task = data['current_task']
+        room.stats = SeatStats.from_snapshot(data['stats'])
+        room.seq = data['seq']
+        for user_id, name, points in data['names']:
+            room.cache_player(user_id, name, points)
+        return room
+
+    def apply_answer(self, user_id: int, correct: bool, points: int, time: int) -> bool:
+        seat = self.seats[user_id]
+        if correct:
+            self.stats.correct[seat][self.current_task] = True
+            self.stats.points[seat] += points
+        self.stats.times[seat].append(time)
+        self.stats.answered[seat] = True
+        self.stats.answered_count += 1
+
+        if self.stats.answered_count >= len(self.players):
+            self.stats.reset_answered()
+            self.current_task += 1
+            if self.current_task >= len(self.task_data):
+                # no task left to show or answer, set before any await so nothing reads past the end
+                self.status = 'finishing'
+            return True
+        return False
+
+    def log_event(self, to: int | None, exclude: int | None, data: dict) -> str:
+        self.seq += 1
+        data = data | {'seq': self.seq}
+        self.events.append((self.seq, to, exclude, data))
+        return dumps_text(data)
+
+    async def send(self, user_id: int, data: dict):
+        text = self.log_event(user_id, None, data)
+        ws = self.socket_of(user_id)
+        if ws:
+            await ws.send_text(text)
+
+    async def broadcast(self, data: dict, exclude: int | None = None):
+        # the event is serialized once and fanned out to players and spectators together
+        text = self.log_event(None, exclude, data)
+        audience = [ws for x, ws in zip(self.players, self.sockets) if ws and x != exclude]
+        audience += [ws for x, ws in self.spectators.items() if ws and x != exclude]
+        await asyncio.gather(*(ws.send_text(text) for ws in audience), return_exceptions=True)
 
 
 class BattleManager:
     def __init__(self) -> None:
-        self.rooms: list[Room] = []
+        self.rooms: dict[int, Room] = {}
         self.id: int = 0
         self.user_to_room: dict[int, Room] = {}
+        self.spectator_to_room: dict[int, Room] = {}
+        # every state change bumps seq, answers are also queued for the journal
+        self.seq: int = 0
+        self.pending_journal: list[dict] = []
+
+    def touch(self) -> int:
+        self.seq += 1
+        return self.seq
+
+    def journal_entry(self, room: Room, kind: str, **data) -> dict:
+        return {'seq': self.touch(), 'room_id': room.id, 'kind': kind, 'data': data}
 
-    def add_room(self, host: int, host_ws: WebSocket, name: str) -> int:
-        room = Room(host, host_ws, None, self.id, name)
-        self.rooms.append(room)
+    def journal(self, room: Room, kind: str, **data) -> None:
+        self.pending_journal.append(self.journal_entry(room, kind, **data))
+
+    def snapshot(self) -> dict:
+        return {
+            'seq': self.seq,
+            'id': self.id,
+            'rooms': [r.snapshot() for r in self.rooms.values()],
+        }
+
+    def restore(self, data: dict, tasks: dict[int, dict]) -> None:
+        self.seq = data['seq']
+        self.id = data['id']
+        self.rooms = {}
+        self.user_to_room = {}
+        self.spectator_to_room = {}
+        for x in data['rooms']:
+            self.restore_room(Room.from_snapshot(x, tasks))
+
+    def restore_room(self, room: Room) -> None:
+        self.rooms[room.id] = room
+        for x in room.players:
+            self.user_to_room[x] = room
+
+    def add_room(self, host: int, host_ws: WebSocket, name: str, max_players: int = 2) -> int:
+        room = Room(host, host_ws, self.id, name, max_players)
+        self.rooms[room.id] = room
         self.user_to_room[host] = room
         self.id += 1
+        self.touch()
         return self.id - 1
 
     def get_room(self, room_id: int) -> Room | None:
-        for r in self.rooms:
-            if r.id == room_id:
-                return r
-        return None
+        return self.rooms.get(room_id, None)
     
     def has_room(self, room: Room) -> bool:
-        return room in self.rooms
+        return self.rooms.get(room.id) is room
 
     def get_room_by_user(self, user_id: int) -> Room | None:
         return self.user_to_room.get(user_id, None)
 
+    def get_spectated_room(self, user_id: int) -> Room | None:
+        return self.spectator_to_room.get(user_id, None)
+
     def get_rooms(self) -> list[Room]:
-        return self.rooms
+        return list(self.rooms.values())
 
     def remove_room(self, room: Room):
-        if room in self.rooms:
-            self.rooms.remove(room)
-        if room.host in self.user_to_room:
-            del self.user_to_room[room.host]
-        if room.other and room.other in self.user_to_room:
-            del self.user_to_room[room.other]
+        self.touch()
+        if self.has_room(room):
+            del self.rooms[room.id]
+        for x in room.players:
+            if self.user_to_room.get(x) is room:
+                del self.user_to_room[x]
+        for x in room.spectators:
+            if self.spectator_to_room.get(x) is room:
+                del self.spectator_to_room[x]
 
     def user_join_room(self, user_id: int, room: Room, websocket: WebSocket):
-        room.other = user_id
-        room.other_ws = websocket
+        room.add_player(user_id, websocket)
         self.user_to_room[user_id] = room
+        self.touch()
+
+    def user_leave_room(self, user_id: int, room: Room):
+        room.remove_player(user_id)
+        if user_id in self.user_to_room:
+            del self.user_to_room[user_id]
+        self.touch()
+
+    def spectate(self, user_id: int, room: Room, websocket: WebSocket):
+        self.stop_spectating(user_id)
+        room.spectators[user_id] = websocket
+        self.spectator_to_room[user_id] = room
+
+    def stop_spectating(self, user_id: int):
+        room = self.spectator_to_room.pop(user_id, None)
+        if room is not None:
+            room.spectators.pop(user_id, None)
 
 
 router = APIRouter(prefix='/battle')
 battle_manager = BattleManager()
+matchmaker = Matchmaker(int(os.getenv('MATCHMAKING_BASE_WINDOW', 100)),
+                        float(os.getenv('MATCHMAKING_WIDEN_RATE', 25)),
+                        int(os.getenv('MATCHMAKING_MAX_WINDOW', 800)))
 
 
 @router.get('/rooms')
-async def get_rooms(token: str=Depends(API_Key_Header)):
-    async with database.sessions.begin() as session:
-        if (await token_to_user(session, token)) is None:
-            raise HTTPException(403, {"error": "Токен недействителен"})
-        res = []
-        for x in battle_manager.get_rooms():
-            a = x.json()
-            host_user = await user_by_id(session, x.host)
-            a['host_name'] = f'{host_user.name} {host_user.surname[0]}.'
-            a['host_points'] = host_user.points
-            if x.other:
-                other_user = await user_by_id(session, x.other)
-                a['other_name'] = f'{other_user.name} {other_user.surname[0]}.'
-            res.append(a)
-        return json_response(res)
\ No newline at end of file
+async def get_rooms(session: Session, token: str=Depends(API_Key_Header)):
+    if (await token_to_user(session, token)) is None:
+        raise HTTPException(403, {"error": "Токен недействителен"})
+    res = []
+    for x in battle_manager.get_rooms():
+        a = x.json()
+        for player in x.players:
+            if player not in x.names:
+                player_user = await user_by_id(session, player)
+                x.cache_player(player, short_name(player_user), player_user.points)
+        a['host_name'] = x.names[x.host]
+        a['host_points'] = x.ratings[x.host]
+        if x.other:
+            a['other_name'] = x.names[x.other]
+        a['player_names'] = [x.names[player] for player in x.players]
+        res.append(a)
+    return json_response(res)
+
+@router.get('/matchmaking')
+async def get_matchmaking_stats(session: Session, token: str=Depends(API_Key_Header)):
+    if (await token_to_user(session, token)) is None:
+        raise HTTPException(403, {"error": "Токен недействителен"})
+    return json_response(matchmaker.stats())
@@ -0,0 +1,34 @@
+from fastapi import APIRouter, HTTPException, Header
+from fastapi.responses import JSONResponse, PlainTextResponse
+from typing import Optional
+import os
+import secrets
+
+import metrics
+import tracing
+import utils
+
+router = APIRouter()
+
+# scrape token, Prometheus has to send "Authorization: Bearer <token>"; without it the endpoints are closed
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+
+
+def check_token(authorization: str | None) -> None:
+    if not METRICS_TOKEN:
+        raise HTTPException(403, {'error': 'Метрики отключены: не задан METRICS_TOKEN'})
+    if not secrets.compare_digest((authorization or '').encode(), f'Bearer {METRICS_TOKEN}'.encode()):
+        raise HTTPException(403, {'error': 'Доступ запрещён'})
+
+
+@router.get('/metrics', include_in_schema=False)
+async def get_metrics(authorization: Optional[str] = Header(default=None)) -> PlainTextResponse:
+    check_token(authorization)
+    return PlainTextResponse(metrics.registry.render(), media_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+@router.get('/traces', include_in_schema=False)
+async def get_traces(limit: int = 50, authorization: Optional[str] = Header(default=None)) -> JSONResponse:
+    # sampled websocket event traces, newest first (TRACE_SAMPLE_RATE > 0)
+    check_token(authorization)
+    return utils.json_response({'sample_rate': tracing.SAMPLE_RATE, 'traces': tracing.recent(min(max(limit, 1), 1000))})
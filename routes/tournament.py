@@ -0,0 +1,308 @@
+from __future__ import annotations
+
+from fastapi import APIRouter, HTTPException, Depends
+from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.security import APIKeyHeader
+from pydantic import BaseModel
+from sqlalchemy import select, update, bindparam
+import asyncio
+import logging
+import os
+import random
+
+import database
+import utils
+from . import websocket
+from .battle import battle_manager, matchmaker, Room
+
+API_Key_Header = APIKeyHeader(name='Authorization', auto_error=True)
+
+router = APIRouter(prefix='/tournament')
+log = logging.getLogger(__name__)
+
+TASK_POOL_LIMIT = int(os.getenv('TOURNAMENT_TASK_POOL', 2000))
+
+
+class Tournament:
+    # swiss system: every round players with equal scores meet, nobody plays the same opponent twice
+    def __init__(self, id: int, name: str, players: list[int], rounds: int, params: dict, round_pause: int) -> None:
+        self.id = id
+        self.name = name
+        self.players = players
+        self.rounds = rounds
+        self.params = params
+        self.round_pause = round_pause
+        self.round = 0
+        self.status = 'waiting'
+        self.scores: dict[int, float] = {x: 0 for x in players}
+        self.opponents: dict[int, set[int]] = {x: set() for x in players}
+        self.byes: set[int] = set()
+        self.ratings: dict[int, int] = {}
+        # ratings at the start of the round, finish_round writes only the change since then
+        self.round_ratings: dict[int, int] = {}
+        self.names: dict[int, str] = {}
+        self.rooms: dict[int, Room] = {}
+        self.round_players: list[int] = []
+        self.games: list[dict] = []
+        self.subscribers: list[asyncio.Queue] = []
+        self.next_round_task: asyncio.Task | None = None
+
+    def pairings(self, players: list[int]) -> tuple[list[tuple[int, int]], int | None]:
+        order = sorted(players, key=lambda x: (-self.scores[x], -self.ratings[x], x))
+        bye = None
+        if len(order) % 2:
+            bye = next((x for x in reversed(order) if x not in self.byes), order[-1])
+            order.remove(bye)
+        pairs = []
+        while order:
+            a = order.pop(0)
+            j = next((i for i, b in enumerate(order) if b not in self.opponents[a]), 0)
+            pairs.append((a, order.pop(j)))
+        return pairs, bye
+
+    async def start_round(self, session) -> None:
+        self.round += 1
+        self.status = 'running'
+        # players may have played regular battles since the last round
+        users = (await session.execute(select(database.Users.id, database.Users.points).where(
+            database.Users.id.in_(self.players)))).all()
+        self.ratings.update({user_id: points for user_id, points in users})
+        self.round_ratings = dict(self.ratings)
+
+        # a player still busy in a regular battle forfeits the round instead of being pulled out of it
+        busy = [x for x in self.players if self.in_battle(x)]
+        for x in busy:
+            self.games.append({'round': self.round, 'players': [x], 'forfeit': True})
+        pairs, bye = self.pairings([x for x in self.players if x not in busy])
+        if bye is not None:
+            self.scores[bye] += 1
+            self.byes.add(bye)
+        if not pairs:
+            self.round_players = []
+            await self.finish_round(session)
+            return
+
+        # one query for the whole round, every room draws its own set from the pool
+        p = self.params
+        pool = await utils.filter_tasks(session, p['level_start'], p['level_end'], p['subcategory'], None, p['category'],
+                                        True, min(p['count'] * len(pairs), TASK_POOL_LIMIT), [], True)
+        if len(pool) == 0:
+            self.status = 'finished'
+            raise HTTPException(403, {'error': 'Нет задач с такими параметрами'})
+
+        self.round_players = [x for pair in pairs for x in pair]
+        await session.execute(update(database.Users).where(database.Users.id.in_(self.round_players)).values(status='battle'))
+
+        for a, b in pairs:
+            for x in (a, b):
+                matchmaker.cancel(x)
+                previous = battle_manager.get_room_by_user(x)
+                if previous is not None and previous.status == 'waiting':
+                    battle_manager.remove_room(previous)
+            room_id = battle_manager.add_room(a, websocket.user_sockets.get(a), f'{self.name}: тур {self.round}')
+            room = battle_manager.get_room(room_id)
+            battle_manager.user_join_room(b, room, websocket.user_sockets.get(b))
+            room.tournament = self
+            room.time_limit = p['time_limit']
+            room.category = p['category']
+            room.level_start = p['level_start']
+            room.level_end = p['level_end']
+            room.set_tasks(random.sample(pool, min(p['count'], len(pool))))
+            room.total_points = sum(utils.level_to_points(x['level']) for x in room.task_data)
+            for x in (a, b):
+                room.cache_player(x, self.names[x], self.ratings[x])
+            self.opponents[a].add(b)
+            self.opponents[b].add(a)
+            self.rooms[room_id] = room
+
+        for room in list(self.rooms.values()):
+            for x in room.players:
+                await room.send(x, {
+                    'event': 'tournament_round',
+                    'tournament_id': self.id,
+                    'round': self.round,
+                    'room_id': room.id,
+                    'other_id': room.opponent_of(x),
+                    'other_name': room.names[room.opponent_of(x)],
+                })
+            await websocket.launch_game(room)
+        self.publish()
+
+    @staticmethod
+    def in_battle(user_id: int) -> bool:
+        room = battle_manager.get_room_by_user(user_id)
+        return room is not None and room.status != 'waiting'
+
+    async def record_result(self, session, room: Room, after: list[int]) -> None:
+        a, b = room.players
+        points_a, points_b = room.stats.points
+        self.scores[a] += 1 if points_a > points_b else (0.5 if points_a == points_b else 0)
+        self.scores[b] += 1 if points_b > points_a else (0.5 if points_a == points_b else 0)
+        self.ratings[a], self.ratings[b] = after
+        self.games.append({'round': self.round, 'room_id': room.id, 'players': [a, b], 'points': [points_a, points_b]})
+        self.rooms.pop(room.id, None)
+        if not self.rooms:
+            await self.finish_round(session)
+        else:
+            self.publish()
+
+    async def finish_round(self, session) -> None:
+        # a delta, not the cached value: regular battles finished during the round keep their points
+        users = database.Users.__table__
+        if self.round_players:
+            await session.execute(
+                update(users).where(users.c.id == bindparam('user_id')).values(
+                    points=users.c.points + bindparam('delta'), status=None),
+                [{'user_id': x, 'delta': self.ratings[x] - self.round_ratings[x]} for x in self.round_players])
+        if self.round >= self.rounds:
+            self.status = 'finished'
+        else:
+            self.status = 'pause'
+            self.next_round_task = asyncio.create_task(self.next_round_later())
+        self.publish()
+
+    async def next_round_later(self) -> None:
+        await asyncio.sleep(self.round_pause)
+        try:
+            async with database.sessions.begin() as session:
+                await self.start_round(session)
+        except Exception as e:
+            log.exception('Ошибка запуска тура %d турнира %d: %s', self.round, self.id, e)
+
+    def standings(self) -> list[dict]:
+        buchholz = {x: sum(self.scores[o] for o in self.opponents[x]) for x in self.players}
+        order = sorted(self.players, key=lambda x: (-self.scores[x], -buchholz[x], -self.ratings[x]))
+        return [{
+            'place': i + 1,
+            'id': x,
+            'name': self.names[x],
+            'score': self.scores[x],
+            'buchholz': buchholz[x],
+            'rating': self.ratings[x],
+        } for i, x in enumerate(order)]
+
+    def json(self) -> dict:
+        return {
+            'id': self.id,
+            'name': self.name,
+            'status': self.status,
+            'round': self.round,
+            'rounds': self.rounds,
+            'players': len(self.players),
+            'rooms_running': len(self.rooms),
+        }
+
+    def publish(self) -> None:
+        if not self.subscribers:
+            return
+        data = self.json() | {'standings': self.standings()}
+        for queue in self.subscribers:
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(data)
+
+
+tournaments: dict[int, Tournament] = {}
+
+
+class TournamentModel(BaseModel):
+    name: str
+    players: list[int]
+    rounds: int = 5
+    count: int = 5
+    time_limit: int = 15
+    category: int | None = None
+    subcategory: str | None = None
+    level_start: int = 0
+    level_end: int = 10
+    round_pause: int = 30
+
+
+async def check_user(session, token: str):
+    if (await utils.token_to_user(session, token)) is None:
+        raise HTTPException(403, {'error': 'Токен недействителен'})
+
+
+async def check_admin(session, token: str):
+    user = await utils.token_to_user(session, token)
+    if user is None:
+        raise HTTPException(403, {'error': 'Пользователь не существует'})
+    if user.role != 'administrator':
+        raise HTTPException(403, {'error': 'нужны права администратора!'})
+    return user
+
+
+def get_tournament(tournament_id: int) -> Tournament:
+    tournament = tournaments.get(tournament_id)
+    if tournament is None:
+        raise HTTPException(404, {'error': 'Турнир не найден'})
+    return tournament
+
+
+@router.post('/create')
+async def create_tournament(session: utils.Session, info: TournamentModel, token: str = Depends(API_Key_Header)) -> JSONResponse:
+    await check_admin(session, token)
+    players = list(dict.fromkeys(info.players))
+    if len(players) < 2:
+        raise HTTPException(422, {'error': 'Нужно минимум два участника'})
+    users = (await session.execute(select(database.Users).where(database.Users.id.in_(players)))).scalars().all()
+    if len(users) != len(players):
+        raise HTTPException(422, {'error': 'Некоторые участники не существуют'})
+
+    tournament = Tournament(len(tournaments), info.name, players, info.rounds, {
+        'count': info.count,
+        'time_limit': info.time_limit,
+        'category': info.category,
+        'subcategory': info.subcategory,
+        'level_start': info.level_start,
+        'level_end': info.level_end,
+    }, info.round_pause)
+    for x in users:
+        tournament.ratings[x.id] = x.points
+        tournament.names[x.id] = utils.short_name(x)
+    tournaments[tournament.id] = tournament
+    return utils.json_response(tournament.json())
+
+
+@router.post('/{tournament_id}/start')
+async def start_tournament(session: utils.Session, tournament_id: int, token: str = Depends(API_Key_Header)) -> JSONResponse:
+    await check_admin(session, token)
+    tournament = get_tournament(tournament_id)
+    if tournament.status != 'waiting':
+        raise HTTPException(403, {'error': 'Турнир уже запущен'})
+    await tournament.start_round(session)
+    return utils.json_response(tournament.json())
+
+
+@router.get('/list')
+async def get_tournaments(session: utils.Session, token: str = Depends(API_Key_Header)) -> JSONResponse:
+    await check_user(session, token)
+    return utils.json_response([x.json() for x in tournaments.values()])
+
+
+@router.get('/{tournament_id}/standings')
+async def get_standings(session: utils.Session, tournament_id: int, token: str = Depends(API_Key_Header)) -> JSONResponse:
+    await check_user(session, token)
+    tournament = get_tournament(tournament_id)
+    return utils.json_response(tournament.json() | {'standings': tournament.standings(), 'games': tournament.games})
+
+
+@router.get('/{tournament_id}/stream')
+async def stream_standings(session: utils.Session, tournament_id: int, token: str = Depends(API_Key_Header)) -> StreamingResponse:
+    await check_user(session, token)
+    tournament = get_tournament(tournament_id)
+    queue = asyncio.Queue(maxsize=16)
+    queue.put_nowait(tournament.json() | {'standings': tournament.standings()})
+    tournament.subscribers.append(queue)
+
+    async def events():
+        try:
+            while True:
+                data = await queue.get()
+                yield f'data: {utils.dumps_text(data)}\n\n'
+                if data['status'] == 'finished':
+                    break
+        finally:
+            tournament.subscribers.remove(queue)
+
+    return StreamingResponse(events(), media_type='text/event-stream')
@@ -15,41 +15,37 @@ router = APIRouter(prefix='/status')
 
 
 @router.get('/status_training_begin')
-async def get_status_training_begin(token: str = Depends(API_Key_Header)):
-    async with database.sessions.begin() as session:
-        user = await utils.token_to_user(session, token)
-        if user is None:
-            raise HTTPException(403, {'error': "Пользователь не найден"})
-        user.status = 'training'
-        await session.commit()
+async def get_status_training_begin(session: utils.Session, token: str = Depends(API_Key_Header)):
+    user = await utils.token_to_user(session, token)
+    if user is None:
+        raise HTTPException(403, {'error': "Пользователь не найден"})
+    user.status = 'training'
+    await session.commit()
 
 
 @router.get('/status_training_end')
-async def get_status_training_end(token: str = Depends(API_Key_Header)):
-    async with database.sessions.begin() as session:
-        user = await utils.token_to_user(session, token)
-        if user is None:
-            raise HTTPException(403, {'error': "Пользователь не найден"})
-        user.status = None
-        await session.commit()
+async def get_status_training_end(session: utils.Session, token: str = Depends(API_Key_Header)):
+    user = await utils.token_to_user(session, token)
+    if user is None:
+        raise HTTPException(403, {'error': "Пользователь не найден"})
+    user.status = None
+    await session.commit()
 
 
 @router.get('/get_status')
-async def get_status(token: str = Depends(API_Key_Header)) -> JSONResponse:
-    async with database.sessions.begin() as session:
-        user = await utils.token_to_user(session, token)
-        if user is None:
-            raise HTTPException(403, {'error': "Пользователь не найден"})
-        return utils.json_response({'status': user.status})
+async def get_status(session: utils.Session, token: str = Depends(API_Key_Header)) -> JSONResponse:
+    user = await utils.token_to_user(session, token)
+    if user is None:
+        raise HTTPException(403, {'error': "Пользователь не найден"})
+    return utils.json_response({'status': user.status})
 
 
 @router.get('/get_training')
-async def get_training(token: str = Depends(API_Key_Header)) -> JSONResponse:
-    async with database.sessions.begin() as session:
-        user = await utils.token_to_user(session, token)
-        if user is None:
-            raise HTTPException(403, {'error': "Пользователь не найден"})
-        return utils.json_response({'training': user.current_training})
+async def get_training(session: utils.Session, token: str = Depends(API_Key_Header)) -> JSONResponse:
+    user = await utils.token_to_user(session, token)
+    if user is None:
+        raise HTTPException(403, {'error': "Пользователь не найден"})
+    return utils.json_response({'training': user.current_training})
 
 
 class TrainingModel(BaseModel):
@@ -57,22 +53,20 @@ class TrainingModel(BaseModel):
 
 
 @router.post('/set_training')
-async def set_training(info: TrainingModel, token: str = Depends(API_Key_Header)) -> JSONResponse:
-    async with database.sessions.begin() as session:
-        user = await utils.token_to_user(session, token)
-        if user is None:
-            raise HTTPException(403, {'error': "Пользователь не найден"})
-        print(info.training)
-        await session.execute(update(database.Users).where(database.Users.id == user.id).values(current_training=info.training))
+async def set_training(session: utils.Session, info: TrainingModel, token: str = Depends(API_Key_Header)) -> JSONResponse:
+    user = await utils.token_to_user(session, token)
+    if user is None:
+        raise HTTPException(403, {'error': "Пользователь не найден"})
+    print(info.training)
+    await session.execute(update(database.Users).where(database.Users.id == user.id).values(current_training=info.training))
 
 
 @router.get('/top_players')
-async def top_players() -> JSONResponse:
-    async with database.sessions.begin() as session:
-        data = (await session.execute(select(database.Users))).scalars().all()
-        return utils.json_response([{
-            'id': u.id,
-            'name': f'{u.name} {u.surname[0]}.',
-            'points': u.points,
-            'place': i+1,
-        } for i, u in enumerate(sorted(data, key=lambda u: -u.points))])
+async def top_players(session: utils.Session) -> JSONResponse:
+    data = (await session.execute(select(database.Users))).scalars().all()
+    return utils.json_response([{
+        'id': u.id,
+        'name': f'{u.name} {u.surname[0]}.',
+        'points': u.points,
+        'place': i+1,
+    } for i, u in enumerate(sorted(data, key=lambda u: -u.points))])
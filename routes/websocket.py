@@ -9,82 +9,103 @@ import time
 from routes import analytics
 from utils import token_to_user
 import utils
-from .battle import battle_manager, Room
+from .battle import battle_manager, matchmaker, Room
+from matchmaking import Ticket
+from contextlib import contextmanager
+from contextvars import ContextVar
 import database
+import logging
+import metrics
+import os
+import tracing
 
 
 router = APIRouter()
 
+MATCHMAKING_INTERVAL = float(os.getenv('MATCHMAKING_INTERVAL', 1))
+MAX_ROOM_PLAYERS = int(os.getenv('MAX_ROOM_PLAYERS', 100))
+
+log = logging.getLogger(__name__)
+
+WS_EVENTS = ('ping', 'create_room', 'find_match', 'cancel_match', 'join_room', 'spectate_room', 'leave_room',
+             'start_game', 'send_answer', 'get_game_state')
+ROOM_STATUSES = ('waiting', 'started', 'finishing')
+
+ws_events = metrics.Counter('ws_events_total', 'Websocket events by type and outcome', ('event', 'outcome'))
+ws_latency = metrics.Histogram('ws_event_duration_seconds', 'Websocket event handling latency', ('event',))
+ws_sql_queries = metrics.Histogram('ws_event_sql_queries', 'SQL statements per websocket event', ('event',), metrics.COUNT_BUCKETS)
+ws_errors = metrics.Counter('ws_errors_total', 'Error replies sent to websocket clients', ('event',))
+
 
 def verify_params(data: dict, params: list[str]) -> bool:
     return all(x in data for x in params)
 
 
 async def end_game(session, room: Room):
-    if room.status != 'started':
+    # 'finishing' without scoring: the last answer is in, results are not written yet
+    if room.status not in ('started', 'finishing') or room.scoring:
         return
 
+    room.scoring = True
     room.status = 'finishing'
 
-    p1u = (await session.execute(select(database.Users).where(database.Users.id == room.host))).scalar_one()
-    p2u = (await session.execute(select(database.Users).where(database.Users.id == room.other))).scalar_one()
-    score_1_now = p1u.points
-    score_2_now = p2u.points
-
-    winner = 1 if room.player_1_stats.points > room.player_2_stats.points else (
-        2 if room.player_1_stats.points < room.player_2_stats.points else 0)
-
-    score1new, score2new = utils.calculate_elo_rating(
-        score_1_now, score_2_now, 1 if winner == 1 else (0 if winner == 2 else 0.5), 1 if winner == 2 else (0 if winner == 1 else 0.5))
-
-    t1 = [x for i, x in enumerate(room.player_1_stats.times) if room.player_1_stats.correct[i]]
-    t2 = [x for i, x in enumerate(room.player_2_stats.times) if room.player_2_stats.correct[i]]
+    if room.tournament is not None:
+        # tournament ratings are cached for the round and written in bulk when it ends
+        ratings = room.tournament.ratings
+    else:
+        users = (await session.execute(select(database.Users).where(database.Users.id.in_(room.players)))).scalars().all()
+        ratings = {x.id: x.points for x in users}
+        for x in users:
+            room.names[x.id] = utils.short_name(x)
+    results = room.stats.points
+    before = [ratings[x] for x in room.players]
+    after = utils.calculate_elo_ratings(before, results)
+
+    best = max(results)
+    winner = results.index(best) + 1 if results.count(best) == 1 else 0
 
     data = {'total_points': room.total_points,
             'winner': winner,
-            'result1': room.player_1_stats.points,
-            'result2': room.player_2_stats.points,
-            'rating_change1': score1new - score_1_now,
-            'rating_change2': score2new - score_2_now,
-            'rating_before1': score_1_now,
-            'rating_after1': score1new,
-            'rating_before2': score_2_now,
-            'rating_after2': score2new,
             'duration_minutes': room.time_limit,
             'tasks_count': len(room.task_data),
-            'player1': {
-                'name': f'{p1u.name} {p1u.surname[0]}.',
-                'id': room.host,
-                'points': room.player_1_stats.points,
-                'total_time': sum(room.player_1_stats.times),
-                'avg_time': sum(t1) / len(t1) if len(t1) > 0 else 0,
-                'score_before': score_1_now,
-                'score_after': score1new,
-            },
-            'player2': {
-                'name': f'{p2u.name} {p2u.surname[0]}.',
-                'id': room.other,
-                'points': room.player_2_stats.points,
-                'total_time': sum(room.player_2_stats.times),
-                'avg_time': sum(t2) / len(t2) if len(t2) > 0 else 0,
-                'score_before': score_2_now,
-                'score_after': score2new,
+            'players': room.players}
+    for i, x in enumerate(room.players):
+        n = i + 1
+        solved_times = [t for j, t in enumerate(room.stats.times[i]) if room.stats.correct[i][j]]
+        data |= {
+            f'result{n}': results[i],
+            f'rating_change{n}': after[i] - before[i],
+            f'rating_before{n}': before[i],
+            f'rating_after{n}': after[i],
+            f'player{n}': {
+                'name': room.names[x],
+                'id': x,
+                'points': results[i],
+                'total_time': sum(room.stats.times[i]),
+                'avg_time': sum(solved_times) / len(solved_times) if len(solved_times) > 0 else 0,
+                'score_before': before[i],
+                'score_after': after[i],
             }}
 
     await room.broadcast({'event': 'scores'} | data)
 
-    await session.execute(update(database.Users).where(database.Users.id == room.host).values(status=None, points=score1new))
-    await session.execute(update(database.Users).where(database.Users.id == room.other).values(status=None, points=score2new))
+    if room.tournament is not None:
+        await room.tournament.record_result(session, room, after)
+    else:
+        await session.execute(update(database.Users), [
+            {'id': x, 'status': None, 'points': after[i]} for i, x in enumerate(room.players)])
 
-    await analytics.change_values(room.host, {'task_quantity': sum(1 if x else 0 for x in room.player_1_stats.correct), 'answer_quantity': len(room.task_data), 'time_per_task': {
-        room.task_data[i]['id']: room.player_1_stats.times[i] for i in range(len(room.task_data)) if room.player_1_stats.correct[i]
-    }})
-    await analytics.change_values(room.other, {'task_quantity': sum(1 if x else 0 for x in room.player_2_stats.correct), 'answer_quantity': len(room.task_data), 'time_per_task': {
-        room.task_data[i]['id']: room.player_2_stats.times[i] for i in range(len(room.task_data)) if room.player_2_stats.correct[i]
-    }})
+    for i, x in enumerate(room.players):
+        await analytics.change_values(x, {'task_quantity': sum(room.stats.correct[i]), 'answer_quantity': len(room.task_data), 'time_per_task': {
+            room.task_data[j]['id']: room.stats.times[i][j] for j in range(len(room.task_data)) if room.stats.correct[i][j]
+        }}, session)
 
-    await session.execute(insert(database.BattleHistory).values(id1=room.host, id2=room.other, date=date.today(), data=data))
+    battle_id = (await session.execute(insert(database.BattleHistory).values(
+        id1=room.players[0], id2=room.players[1], date=date.today(), data=data).returning(database.BattleHistory.id))).scalar_one()
+    await session.execute(insert(database.BattlePlayers), [{'battle_id': battle_id, 'user_id': x} for x in room.players])
 
+    # written in the same transaction as the results: a restore must never replay a game that was already scored
+    await session.execute(insert(database.BattleJournal), [battle_manager.journal_entry(room, 'end')])
     battle_manager.remove_room(room)
 
 
@@ -95,27 +116,161 @@ async def start_game_timer(room: Room):
     room.status = 'started'
     room.start_time = time.time()
 
+    battle_manager.journal(room, 'start', start_time=room.start_time)
+
     await room.broadcast({
         'event': 'game_started',
         'start_time': room.start_time
     })
 
-    await asyncio.sleep(room.time_limit * 60)
+    await game_timer(room, room.time_limit * 60)
+
+
+async def game_timer(room: Room, delay: float):
+    await asyncio.sleep(delay)
 
     async with database.sessions.begin() as session:
         await end_game(session, room)
 
 
+def room_params(data: dict) -> dict:
+    return {
+        'level_start': int(data.get('level_start', 0)),
+        'level_end': int(data.get('level_end', 10)),
+        'subcategory': data.get('subcategory', None),
+        'category': int(data['category']) if data.get('category') is not None else None,
+        'count': int(data['count']),
+        'time_limit': int(data['time_limit']),
+    }
+
+
+async def setup_room(session, room: Room, params: dict):
+    room.category = params['category']
+    room.time_limit = params['time_limit']
+    room.level_start = params['level_start']
+    room.level_end = params['level_end']
+
+    tasks_data = await utils.filter_tasks(session, params['level_start'], params['level_end'], params['subcategory'],
+                                          None, params['category'], True, params['count'], [], True)
+
+    room.set_tasks(tasks_data)
+    room.total_points = sum([utils.level_to_points(x['level']) for x in room.task_data])
+
+
+async def start_game(session, room: Room):
+    await session.execute(update(database.Users).where(database.Users.id.in_(room.players)).values(status='battle'))
+    await launch_game(room)
+
+
+async def launch_game(room: Room):
+    await room.broadcast({
+        'event': 'new_task',
+        'index': room.current_task,
+        'task': room.task_payload()
+    })
+
+    room.timer_task = asyncio.create_task(start_game_timer(room))
+
+
+async def create_match_room(session, host: Ticket, other: Ticket):
+    room_id = battle_manager.add_room(host.user_id, host.data['ws'], f'Матч {host.data["name"]} - {other.data["name"]}')
+    room = battle_manager.get_room(room_id)
+    await setup_room(session, room, host.data['params'])
+    if len(room.task_data) == 0:
+        battle_manager.remove_room(room)
+        for t in (host, other):
+            await ws_error(t.data['ws'], 'No tasks for these settings')
+        return
+    battle_manager.user_join_room(other.user_id, room, other.data['ws'])
+    for t in (host, other):
+        room.cache_player(t.user_id, t.data['name'], t.rating)
+
+    for me, opponent in ((host, other), (other, host)):
+        await room.send(me.user_id, {
+            'event': 'match_found',
+            'room_id': room_id,
+            'other_id': opponent.user_id,
+            'other_name': opponent.data['name'],
+            'other_points': opponent.rating,
+        })
+
+    await start_game(session, room)
+
+
+async def matchmaking_loop():
+    while True:
+        await asyncio.sleep(MATCHMAKING_INTERVAL)
+        for host, other in matchmaker.sweep():
+            try:
+                async with database.sessions.begin() as session:
+                    await create_match_room(session, host, other)
+            except Exception as e:
+                log.exception('Ошибка подбора соперника: %s', e)
+
+
 connected_websockets: list[WebSocket] = []
+user_sockets: dict[int, WebSocket] = {}
+
+# event of the message being handled, for the error counter
+current_event: ContextVar[str] = ContextVar('current_event', default='unknown')
+
+
+def rooms_by_status() -> dict[tuple, int]:
+    counts = dict.fromkeys(((x,) for x in ROOM_STATUSES), 0)
+    for room in battle_manager.get_rooms():
+        counts[(room.status,)] = counts.get((room.status,), 0) + 1
+    return counts
+
+
+def pending_timers() -> int:
+    return sum(1 for x in battle_manager.get_rooms() if x.timer_task is not None and not x.timer_task.done())
+
+
+metrics.Gauge('ws_connections', 'Open websocket connections', function=lambda: len(connected_websockets))
+metrics.Gauge('battle_rooms', 'Battle rooms by status', ('status',), function=rooms_by_status)
+metrics.Gauge('battle_pending_timers', 'Running game timers', function=pending_timers)
+
+
+def event_label(event: str | None) -> str:
+    return event if event in WS_EVENTS else 'unknown'
+
+
+@contextmanager
+def track_event(event: str | None, trace):
+    label = event_label(event)
+    stats = metrics.RequestStats()
+    stats_token = metrics.current_stats.set(stats)
+    event_token = current_event.set(label)
+    outcome = 'exception'
+    start = time.perf_counter()
+    try:
+        yield
+        outcome = 'ok'
+    finally:
+        elapsed = time.perf_counter() - start
+        metrics.current_stats.reset(stats_token)
+        current_event.reset(event_token)
+        ws_events.inc(event=label, outcome=outcome)
+        ws_latency.observe(elapsed, event=label)
+        ws_sql_queries.observe(stats.queries, event=label)
+        trace.set(outcome=outcome, queries=stats.queries, sql_ms=round(stats.sql_time * 1000, 3))
+        trace.finish()
+
+
+async def send_json(websocket: WebSocket, data: dict) -> None:
+    await websocket.send_text(utils.dumps_text(data))
 
 
 async def broadcast(data: dict) -> None:
+    text = utils.dumps_text(data)
     for s in connected_websockets:
-        await s.send_json(data)
+        await s.send_text(text)
 
 
-async def ws_error(websocket: WebSocket, msg: str):
-    await websocket.send_json({
+async def ws_error(websocket: WebSocket, msg: str, event: str | None = None):
+    # outside track_event (the exception handler) the label has to be passed in
+    ws_errors.inc(event=event or current_event.get())
+    await send_json(websocket, {
         'event': 'error',
         'message': msg
     })
@@ -129,305 +284,337 @@ async def websocket_endpoint(websocket: WebSocket):
     connected_websockets.append(websocket)
 
     while True:
+        event = None
         try:
-            data = await websocket.receive_json()
+            data = utils.loads(await websocket.receive_text())
 
-            if 'event' not in data or 'token' not in data:
-                await ws_error(websocket, 'specify event and token')
-                continue
-
-            async with database.sessions.begin() as session:
-                user = await token_to_user(session, data['token'])
-                if user is None:
-                    await ws_error(websocket, 'Failed to verify token')
+            event = data.get('event') if isinstance(data, dict) else None
+            trace = tracing.sample(event)
+            with track_event(event, trace):
+                if 'event' not in data or 'token' not in data:
+                    await ws_error(websocket, 'specify event and token')
                     continue
 
-                user_id = user.id
-                cmd = data['event']
-
-                if current_room is None:
-                    current_room = battle_manager.get_room_by_user(user_id)
-                    # print(user_id, 'dbg 1')
-                    if current_room is not None:
-                        # print(user_id, 'dbg 2')
-                        if current_room.host == user_id:
-                            # print(user_id, 'dbg 3')
-                            current_room.host_ws = websocket
-                        elif current_room.other == user_id:
-                            # print(user_id, 'dbg 4')
-                            current_room.other_ws = websocket
-
-                if current_room is not None and not battle_manager.has_room(current_room):
-                    print('current room is none!')
-                    current_room = None
-
-                if cmd == 'create_room':
-                    if not verify_params(data, ['name']):
-                        await ws_error(websocket, 'Specify room name')
+                async with database.sessions.begin() as session:
+                    with trace.span('auth'):
+                        user = await token_to_user(session, data['token'])
+                    if user is None:
+                        await ws_error(websocket, 'Failed to verify token')
                         continue
 
-                    existing_room = battle_manager.get_room_by_user(user_id)
-                    if existing_room:
-                        await ws_error(websocket, 'You are already in a room')
-                        continue
+                    user_id = user.id
+                    user_sockets[user_id] = websocket
+                    cmd = data['event']
 
-                    if not verify_params(data, ['count', 'time_limit']):
-                        await ws_error(websocket, 'not enough params')
-                        continue
+                    if current_room is not None and not battle_manager.has_room(current_room):
+                        current_room = None
 
-                    room_id = battle_manager.add_room(
-                        user_id, websocket, data['name'])
-                    current_room = battle_manager.get_room(room_id)
-
-                    level_start = int(data.get('level_start', 0))
-                    level_end = int(data.get('level_end', 10))
-                    subcategory = data.get('subcategory', None)
-                    category = int(data['category']) if 'category' in data else None
-                    count = int(data['count'])
-
-                    current_room.category = category
-                    current_room.time_limit = int(data['time_limit'])
-                    current_room.level_start = level_start
-                    current_room.level_end = level_end
-
-                    tasks_data = await utils.filter_tasks(session, level_start, level_end, subcategory, None, category, True, count, [], True)
-
-                    current_room.task_data = tasks_data
-                    print(current_room.task_data)
-                    current_room.total_points = sum([utils.level_to_points(x['level']) for x in current_room.task_data])
-                    current_room.player_1_stats.correct = [False] * len(tasks_data)
-                    current_room.player_2_stats.correct = [False] * len(tasks_data)
-
-                    await websocket.send_json({
-                        'event': 'your_room_created',
-                        'room_id': room_id,
-                    })
-
-                    await broadcast({
-                        'event': 'room_created',
-                        'host': user_id,
-                        'id': room_id,
-                        'name': data['name'],
-                        'host_name': f'{user.name} {user.surname[0]}.',
-                        'host_points': user.points
-                    })
-                elif cmd == 'join_room':
-                    if not verify_params(data, ['room_id']):
-                        await ws_error(websocket, 'Specify room id')
-                        continue
+                    if current_room is None:
+                        current_room = battle_manager.get_room_by_user(user_id) or battle_manager.get_spectated_room(user_id)
+                        if current_room is not None:
+                            current_room.set_socket(user_id, websocket)
+
+                    if cmd == 'ping':
+                        await send_json(websocket, {
+                            'event': 'pong',
+                            'room_id': current_room.id if current_room else None
+                        })
+                    elif cmd == 'create_room':
+                        if matchmaker.is_queued(user_id):
+                            # the matchmaker would put the player into a second room
+                            await ws_error(websocket, 'You are searching for a match')
+                            continue
 
-                    room = battle_manager.get_room(int(data['room_id']))
-                    if room is None:
-                        await ws_error(websocket, 'Room not found')
-                        continue
+                        if not verify_params(data, ['name']):
+                            await ws_error(websocket, 'Specify room name')
+                            continue
 
-                    if room.other is not None:
-                        await ws_error(websocket, 'Room is already full')
-                        continue
+                        existing_room = battle_manager.get_room_by_user(user_id)
+                        if existing_room:
+                            await ws_error(websocket, 'You are already in a room')
+                            continue
 
-                    if user_id == room.host:
-                        await ws_error(websocket, 'You are the host')
-                        continue
+                        if not verify_params(data, ['count', 'time_limit']):
+                            await ws_error(websocket, 'not enough params')
+                            continue
 
-                    battle_manager.user_join_room(user_id, room, websocket)
-                    current_room = room
-
-                    await room.host_ws.send_json({
-                        'event': 'player_joined',
-                        'user_id': user_id,
-                        'name': f'{user.name} {user.surname[0]}.'
-                    })
-
-                    await websocket.send_json({
-                        'event': 'join_successful'
-                    })
-                elif cmd == 'leave_room':
-                    if current_room:
-                        if user_id == current_room.host:
-                            await broadcast({
-                                'event': 'room_deleted',
-                                'room_id': current_room.id
-                            })
-                            battle_manager.remove_room(current_room)
-                        else:
-                            current_room.other = None
-                            current_room.other_ws = None
+                        max_players = min(max(int(data.get('max_players', 2)), 2), MAX_ROOM_PLAYERS)
+                        battle_manager.stop_spectating(user_id)
+                        room_id = battle_manager.add_room(
+                            user_id, websocket, data['name'], max_players)
+                        current_room = battle_manager.get_room(room_id)
+                        current_room.cache_player(user_id, utils.short_name(user), user.points)
 
-                            await broadcast({
-                                'event': 'player_left',
-                                'room_id': current_room.id,
-                            })
+                        await setup_room(session, current_room, room_params(data))
 
-                            if user_id in battle_manager.user_to_room:
-                                del battle_manager.user_to_room[user_id]
-                        current_room = None
+                        await send_json(websocket, {
+                            'event': 'your_room_created',
+                            'room_id': room_id,
+                        })
 
-                        await websocket.send_json({
-                            'event': 'leave_successful',
+                        await broadcast({
+                            'event': 'room_created',
+                            'host': user_id,
+                            'id': room_id,
+                            'name': data['name'],
+                            'host_name': f'{user.name} {user.surname[0]}.',
+                            'host_points': user.points,
+                            'max_players': max_players
                         })
-                    else:
-                        await ws_error(websocket, 'not in a room')
-                        continue
-                elif cmd == 'start_game':
-                    if current_room is None:
-                        await ws_error(websocket, 'You are not in a room')
-                        continue
+                    elif cmd == 'find_match':
+                        if battle_manager.get_room_by_user(user_id):
+                            await ws_error(websocket, 'You are already in a room')
+                            continue
 
-                    if user_id != current_room.host:
-                        await ws_error(websocket, 'Only host can start game')
-                        continue
+                        if not verify_params(data, ['count', 'time_limit']):
+                            await ws_error(websocket, 'not enough params')
+                            continue
 
-                    if current_room.other is None:
-                        await ws_error(websocket, 'Room is not full yet')
-                        continue
+                        params = room_params(data)
+                        pair = matchmaker.enqueue(user_id, user.points, params, {
+                            'ws': websocket,
+                            'name': f'{user.name} {user.surname[0]}.',
+                            'params': params,
+                        })
 
-                    if current_room.status != 'waiting':
-                        await ws_error(websocket, 'Room has already been started')
-                        continue
+                        await send_json(websocket, {
+                            'event': 'match_searching'
+                        })
 
-                    await session.execute(update(database.Users).where(database.Users.id == current_room.host).values(status='battle'))
-                    await session.execute(update(database.Users).where(database.Users.id == current_room.other).values(status='battle'))
-
-                    await current_room.broadcast({
-                        'event': 'new_task',
-                        'index': current_room.current_task,
-                        'task': {
-                            'id': current_room.task_data[current_room.current_task]['id'],
-                            'level': current_room.task_data[current_room.current_task]['level'],
-                            'subcategory': current_room.task_data[current_room.current_task]['subcategory'],
-                            'condition': current_room.task_data[current_room.current_task]['condition'],
-                            'source': current_room.task_data[current_room.current_task]['source'],
-                            'answer_type': current_room.task_data[current_room.current_task]['answer_type'],
-                        }
-                    })
-
-                    current_room.timer_task = asyncio.create_task(start_game_timer(current_room))
-                elif cmd == 'send_answer':
-                    if not verify_params(data, ['answer', 'time']):
-                        await ws_error(websocket, 'Wrong params')
-                        continue
+                        if pair is not None:
+                            await create_match_room(session, *pair)
+                            current_room = battle_manager.get_room_by_user(user_id)
+                    elif cmd == 'cancel_match':
+                        if not matchmaker.cancel(user_id):
+                            await ws_error(websocket, 'Not searching for a match')
+                            continue
 
-                    if current_room is None or current_room.status != 'started':
-                        await ws_error(websocket, 'Not in game')
-                        continue
+                        await send_json(websocket, {
+                            'event': 'match_cancelled'
+                        })
+                    elif cmd == 'join_room':
+                        if matchmaker.is_queued(user_id):
+                            # the matchmaker would put the player into a second room
+                            await ws_error(websocket, 'You are searching for a match')
+                            continue
 
-                    if user_id == current_room.host:
-                        if current_room.player_1_stats.answered:
-                            await ws_error(websocket, 'Task already solved')
+                        if not verify_params(data, ['room_id']):
+                            await ws_error(websocket, 'Specify room id')
                             continue
-                    else:
-                        if current_room.player_2_stats.answered:
-                            await ws_error(websocket, 'Task already solved')
+
+                        room = battle_manager.get_room(int(data['room_id']))
+                        if room is None:
+                            await ws_error(websocket, 'Room not found')
                             continue
 
-                    task = (await session.execute(select(database.Tasks).where(database.Tasks.id == int(current_room.task_data[current_room.current_task]['id'])))).scalar_one_or_none()
-                    if task is None:
-                        await ws_error(websocket, 'Task not found')
-                        continue
+                        if user_id == room.host:
+                            await ws_error(websocket, 'You are the host')
+                            continue
 
-                    correct = (await utils.gigachat_check_answer(data['answer'].strip(), task.condition, task.answer)).lower() == 'да'
-
-                    if correct:
-                        if user_id == current_room.host:  # player 1
-                            current_room.player_1_stats.correct[current_room.current_task] = True
-                            current_room.player_1_stats.points += utils.level_to_points(
-                                task.level)
-                        else:  # player 2
-                            current_room.player_2_stats.correct[current_room.current_task] = True
-                            current_room.player_2_stats.points += utils.level_to_points(
-                                task.level)
-                        await websocket.send_json({'event': 'check_result', 'correct': True, 'points': utils.level_to_points(task.level)})
-                    else:
-                        await websocket.send_json({'event': 'check_result', 'correct': False})
+                        if battle_manager.get_room_by_user(user_id):
+                            await ws_error(websocket, 'You are already in a room')
+                            continue
 
-                    if user_id == current_room.host:
-                        current_room.player_1_stats.times.append(int(data['time']))
-                        current_room.player_1_stats.answered = True
-                        await current_room.other_ws.send_json({'event': 'other_solved', 'correct': correct, 'total_points': current_room.player_1_stats.points})
-                    else:
-                        current_room.player_2_stats.times.append(int(data['time']))
-                        current_room.player_2_stats.answered = True
-                        await current_room.host_ws.send_json({'event': 'other_solved', 'correct': correct, 'total_points': current_room.player_2_stats.points})
-
-                    if current_room.player_1_stats.answered and current_room.player_2_stats.answered:
-                        current_room.player_1_stats.answered = False
-                        current_room.player_2_stats.answered = False
-
-                        current_room.current_task += 1
-                        if current_room.current_task == len(current_room.task_data):
-                            await end_game(session, current_room)
-                            if current_room.timer_task:
-                                current_room.timer_task.cancel()
+                        if room.is_full():
+                            await ws_error(websocket, 'Room is already full')
+                            continue
+
+                        if room.status != 'waiting':
+                            await ws_error(websocket, 'Room has already been started')
+                            continue
+
+                        battle_manager.stop_spectating(user_id)
+                        battle_manager.user_join_room(user_id, room, websocket)
+                        room.cache_player(user_id, utils.short_name(user), user.points)
+                        current_room = room
+
+                        await room.broadcast({
+                            'event': 'player_joined',
+                            'user_id': user_id,
+                            'name': room.names[user_id]
+                        }, exclude=user_id)
+
+                        await send_json(websocket, {
+                            'event': 'join_successful'
+                        })
+                    elif cmd == 'spectate_room':
+                        if matchmaker.is_queued(user_id):
+                            # the matchmaker would put the player into a second room
+                            await ws_error(websocket, 'You are searching for a match')
+                            continue
+
+                        if not verify_params(data, ['room_id']):
+                            await ws_error(websocket, 'Specify room id')
+                            continue
+
+                        room = battle_manager.get_room(int(data['room_id']))
+                        if room is None:
+                            await ws_error(websocket, 'Room not found')
+                            continue
+
+                        if battle_manager.get_room_by_user(user_id):
+                            await ws_error(websocket, 'You are already in a room')
+                            continue
+
+                        battle_manager.spectate(user_id, room, websocket)
+                        current_room = room
+
+                        res = {'event': 'spectate_successful', 'room_id': room.id, 'seq': room.seq}
+                        if room.status == 'started':
+                            res['state'] = room.state(user_id)
+                        await send_json(websocket, res)
+                    elif cmd == 'leave_room':
+                        if current_room:
+                            if user_id in current_room.seats and current_room.status != 'waiting':
+                                # a seat can not be given up mid-game, the round waits for every player's answer
+                                await ws_error(websocket, 'Game is already running')
+                                continue
+                            if user_id in current_room.seats and current_room.tournament is not None:
+                                # the tournament round only ends when every one of its rooms reports a result
+                                await ws_error(websocket, 'Tournament games can not be left')
+                                continue
+                            if user_id in current_room.spectators:
+                                battle_manager.stop_spectating(user_id)
+                            elif user_id == current_room.host:
+                                await broadcast({
+                                    'event': 'room_deleted',
+                                    'room_id': current_room.id
+                                })
+                                battle_manager.remove_room(current_room)
+                            else:
+                                battle_manager.user_leave_room(user_id, current_room)
+
+                                await broadcast({
+                                    'event': 'player_left',
+                                    'room_id': current_room.id,
+                                    'user_id': user_id,
+                                })
                             current_room = None
-                        else:
-                            await current_room.broadcast({
-                                'event': 'new_task',
-                                'index': current_room.current_task,
-                                'task': {
-                                    'id': current_room.task_data[current_room.current_task]['id'],
-                                    'level': current_room.task_data[current_room.current_task]['level'],
-                                    'subcategory': current_room.task_data[current_room.current_task]['subcategory'],
-                                    'condition': current_room.task_data[current_room.current_task]['condition'],
-                                    'source': current_room.task_data[current_room.current_task]['source'],
-                                    'answer_type': current_room.task_data[current_room.current_task]['answer_type'],
-                                }
+
+                            await send_json(websocket, {
+                                'event': 'leave_successful',
                             })
-                elif cmd == 'get_game_state':
-                    if current_room is None:
-                        await ws_error(websocket, 'Not in a room')
-                        continue
-                    if current_room.status != 'started':
-                        await ws_error(websocket, 'Room is not running')
-                        continue
-                    res = current_room.json()
-                    if user_id == current_room.host:
-                        other_user = await utils.user_by_id(session, current_room.other)
-                        res |= {
-                            'correct': current_room.player_1_stats.correct,
-                            'points': current_room.player_1_stats.points,
-                            'other_points': current_room.player_2_stats.points,
-                            'other_answered': current_room.player_2_stats.answered,
-                            'other_correct': current_room.player_2_stats.correct[current_room.current_task],
-                            'answered': current_room.player_1_stats.answered,
-                            'finished': current_room.player_1_stats.finished,
-                            'times': current_room.player_1_stats.times,
-                        }
+                        else:
+                            await ws_error(websocket, 'not in a room')
+                            continue
+                    elif cmd == 'start_game':
+                        if current_room is None:
+                            await ws_error(websocket, 'You are not in a room')
+                            continue
+
+                        if user_id != current_room.host:
+                            await ws_error(websocket, 'Only host can start game')
+                            continue
+
+                        if len(current_room.players) < 2:
+                            await ws_error(websocket, 'Room is not full yet')
+                            continue
+
+                        if current_room.status != 'waiting':
+                            await ws_error(websocket, 'Room has already been started')
+                            continue
+
+                        await start_game(session, current_room)
+                    elif cmd == 'send_answer':
+                        if not verify_params(data, ['answer', 'time']):
+                            await ws_error(websocket, 'Wrong params')
+                            continue
+
+                        if current_room is None or current_room.status != 'started':
+                            await ws_error(websocket, 'Not in game')
+                            continue
+
+                        if user_id not in current_room.seats:
+                            await ws_error(websocket, 'Spectators cannot answer')
+                            continue
+
+                        seat = current_room.seats[user_id]
+                        if current_room.stats.answered[seat]:
+                            await ws_error(websocket, 'Task already solved')
+                            continue
+
+                        with trace.span('db'):
+                            task = (await session.execute(select(database.Tasks).where(database.Tasks.id == int(current_room.task_data[current_room.current_task]['id'])))).scalar_one_or_none()
+                        if task is None:
+                            await ws_error(websocket, 'Task not found')
+                            continue
+
+                        with trace.span('verdict'):
+                            correct = (await utils.gigachat_check_answer(data['answer'].strip(), task.condition, task.answer)).lower() == 'да'
+                        trace.set(room_id=current_room.id, players=len(current_room.players), correct=correct)
+
+                        points = utils.level_to_points(task.level) if correct else 0
+                        with trace.span('check_result'):
+                            if correct:
+                                await current_room.send(user_id, {'event': 'check_result', 'correct': True, 'points': points})
+                            else:
+                                await current_room.send(user_id, {'event': 'check_result', 'correct': False})
+
+                        next_task = current_room.apply_answer(user_id, correct, points, int(data['time']))
+                        battle_manager.journal(current_room, 'answer', user_id=user_id, correct=correct, points=points, time=int(data['time']))
+
+                        with trace.span('broadcast_solved'):
+                            await current_room.broadcast({'event': 'other_solved', 'user_id': user_id, 'correct': correct, 'total_points': current_room.stats.points[seat]}, exclude=user_id)
+
+                        if next_task:
+                            if current_room.current_task == len(current_room.task_data):
+                                with trace.span('end_game'):
+                                    await end_game(session, current_room)
+                                if current_room.timer_task:
+                                    current_room.timer_task.cancel()
+                                current_room = None
+                            else:
+                                with trace.span('broadcast_new_task'):
+                                    await current_room.broadcast({
+                                        'event': 'new_task',
+                                        'index': current_room.current_task,
+                                        'task': current_room.task_payload()
+                                    })
+                    elif cmd == 'get_game_state':
+                        if current_room is None:
+                            await ws_error(websocket, 'Not in a room')
+                            continue
+                        if current_room.status != 'started':
+                            await ws_error(websocket, 'Room is not running')
+                            continue
+
+                        # a client that knows its last seq only gets the events it missed
+                        if data.get('seq') is not None:
+                            events = current_room.events_since(user_id, int(data['seq']))
+                            if events is not None:
+                                await send_json(websocket, {
+                                    'event': 'game_delta',
+                                    'seq': current_room.seq,
+                                    'events': events
+                                })
+                                continue
+
+                        missing = [x for x in current_room.players if x not in current_room.names]
+                        if missing:
+                            for x in (await session.execute(select(database.Users).where(database.Users.id.in_(missing)))).scalars().all():
+                                current_room.cache_player(x.id, utils.short_name(x), x.points)
+
+                        task = current_room.task_payload()
+                        with_task = task is not None and (data.get('task_id') is None or int(data['task_id']) != task['id'])
+                        await send_json(websocket, current_room.state(user_id, with_task))
                     else:
-                        other_user = await utils.user_by_id(session, current_room.host)
-                        res |= {
-                            'correct': current_room.player_2_stats.correct,
-                            'points': current_room.player_2_stats.points,
-                            'other_points': current_room.player_1_stats.points,
-                            'other_answered': current_room.player_1_stats.answered,
-                            'other_correct': current_room.player_1_stats.correct[current_room.current_task],
-                            'answered': current_room.player_2_stats.answered,
-                            'finished': current_room.player_2_stats.finished,
-                            'times': current_room.player_2_stats.times,
-                        }
-
-                    res['task'] = {
-                        'id': current_room.task_data[current_room.current_task]['id'],
-                        'level': current_room.task_data[current_room.current_task]['level'],
-                        'subcategory': current_room.task_data[current_room.current_task]['subcategory'],
-                        'condition': current_room.task_data[current_room.current_task]['condition'],
-                        'source': current_room.task_data[current_room.current_task]['source'],
-                        'answer_type': current_room.task_data[current_room.current_task]['answer_type'],
-                    }
-                    res['event'] = 'game_state'
-                    res['other_name'] = f'{other_user.name} {other_user.surname[0]}.'
-                    res['start_time'] = current_room.start_time
-                    await websocket.send_json(res)
-                else:
-                    await ws_error(websocket, f'Unknown command: {cmd}')
+                        await ws_error(websocket, f'Unknown command: {cmd}')
         except WebSocketDisconnect:
             # if current_room and user_id:
             #     await handle_player_leave(current_room, user_id)
-            print(f"Игрок {user_id} отключился")
+            log.info('Игрок %s отключился', user_id)
+            if user_id is not None:
+                matchmaker.cancel(user_id)
+                battle_manager.stop_spectating(user_id)
+                if user_sockets.get(user_id) is websocket:
+                    del user_sockets[user_id]
+                if current_room is not None and current_room.socket_of(user_id) is websocket:
+                    current_room.set_socket(user_id, None)
             if websocket in connected_websockets:
                 connected_websockets.remove(websocket)
             break
         except json.JSONDecodeError:
             await ws_error(websocket, 'Incorrect JSON data')
         except Exception as e:
-            print(f"Ошибка: {e}")
-            await ws_error(websocket, f'Internal server error: {str(e)}')
+            log.exception('Ошибка обработки события %s', event)
+            await ws_error(websocket, f'Internal server error: {str(e)}', event_label(event))
@@ -0,0 +1,122 @@
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime
+
+from sqlalchemy import select, insert, delete
+
+import database
+import utils
+from routes.battle import battle_manager
+from routes.websocket import game_timer
+
+log = logging.getLogger(__name__)
+
+JOURNAL_INTERVAL = float(os.getenv('BATTLE_JOURNAL_INTERVAL', 1))
+SNAPSHOT_INTERVAL = float(os.getenv('BATTLE_SNAPSHOT_INTERVAL', 10))
+
+last_snapshot_seq = -1
+
+
+async def flush_journal(session) -> None:
+    entries = battle_manager.pending_journal
+    if not entries:
+        return
+    battle_manager.pending_journal = []
+    try:
+        await session.execute(insert(database.BattleJournal), entries)
+    except Exception:
+        battle_manager.pending_journal = entries + battle_manager.pending_journal
+        raise
+
+
+async def write_snapshot(session) -> None:
+    global last_snapshot_seq
+    seq = battle_manager.seq
+    if seq == last_snapshot_seq:
+        return
+    data = utils.dumps_text(battle_manager.snapshot())
+    await session.execute(insert(database.BattleSnapshots).values(seq=seq, data=data, date=datetime.now()))
+    await session.execute(delete(database.BattleSnapshots).where(database.BattleSnapshots.seq < seq))
+    # everything up to seq is already in the snapshot
+    await session.execute(delete(database.BattleJournal).where(database.BattleJournal.seq <= seq))
+    last_snapshot_seq = seq
+
+
+async def save(snapshot: bool = True) -> None:
+    async with database.sessions.begin() as session:
+        await flush_journal(session)
+        if snapshot:
+            await write_snapshot(session)
+
+
+async def snapshot_loop() -> None:
+    last_snapshot = time.monotonic()
+    while True:
+        await asyncio.sleep(JOURNAL_INTERVAL)
+        now = time.monotonic()
+        try:
+            await save(now - last_snapshot >= SNAPSHOT_INTERVAL)
+            if now - last_snapshot >= SNAPSHOT_INTERVAL:
+                last_snapshot = now
+        except Exception as e:
+            log.exception('Ошибка при сохранении состояния боёв: %s', e)
+
+
+def apply_journal_entry(entry: database.BattleJournal) -> None:
+    battle_manager.seq = max(battle_manager.seq, entry.seq)
+    room = battle_manager.get_room(entry.room_id)
+    if room is None:
+        return
+    if entry.kind == 'start':
+        room.status = 'started'
+        room.start_time = entry.data['start_time']
+    elif entry.kind == 'answer' and room.status == 'started':
+        room.apply_answer(entry.data['user_id'], entry.data['correct'], entry.data['points'], entry.data['time'])
+    elif entry.kind == 'end':
+        battle_manager.remove_room(room)
+
+
+# rebuilds battle_manager from the latest snapshot and journal, returns ids of users still in a game
+async def restore_battles(session) -> set[int]:
+    global last_snapshot_seq
+    row = (await session.execute(
+        select(database.BattleSnapshots).order_by(database.BattleSnapshots.seq.desc()).limit(1))).scalar_one_or_none()
+    if row is None:
+        await session.execute(delete(database.BattleJournal))
+        return set()
+
+    data = utils.loads(row.data)
+    # tournaments live only in memory, their rooms could never report the result after a restart;
+    # their players are not returned as in game, so their battle status is cleared
+    dropped = [x for x in data['rooms'] if x['tournament'] is not None]
+    data['rooms'] = [x for x in data['rooms'] if x['tournament'] is None]
+    task_ids = {x for room in data['rooms'] for x in room['tasks']}
+    tasks = {}
+    if task_ids:
+        request = await session.execute(select(database.Tasks).where(database.Tasks.id.in_(task_ids)))
+        tasks = {x.id: utils.task_to_dict(x) for x in request.scalars().all()}
+    battle_manager.restore(data, tasks)
+
+    journal = (await session.execute(
+        select(database.BattleJournal).where(database.BattleJournal.seq > row.seq).order_by(database.BattleJournal.seq))).scalars().all()
+    for entry in journal:
+        apply_journal_entry(entry)
+    last_snapshot_seq = -1
+
+    in_game = set()
+    for room in battle_manager.get_rooms():
+        if room.status not in ('started', 'finishing'):
+            continue
+        room.status = 'started'
+        in_game |= set(room.players)
+        if room.current_task >= len(room.task_data):
+            remaining = 0
+        else:
+            remaining = room.start_time + room.time_limit * 60 - time.time()
+        room.timer_task = asyncio.create_task(game_timer(room, max(remaining, 0)))
+    log.info('Восстановлено комнат: %d, записей журнала: %d', len(battle_manager.get_rooms()), len(journal))
+    if dropped:
+        log.warning('Отменено турнирных комнат: %d', len(dropped))
+    return in_game
@@ -0,0 +1,81 @@
+from __future__ import annotations
+
+from sqlalchemy import select
+
+import catalog
+import database
+
+
+class Taxonomy:
+    # categories and subcategories only change on import, they are kept in memory and reloaded
+    # when the catalog version moves
+    def __init__(self) -> None:
+        self.version: int | None = None
+        self.categories: dict[int, str] = {}
+        self.category_ids: dict[str, int] = {}
+        self.subcategories: dict[int, tuple[int, str]] = {}
+        self.subcategory_ids: dict[tuple[int, str], int] = {}
+        self.by_category: dict[int, list[int]] = {}
+        self.categories_json: list[dict] = []
+        self.subcategories_json: dict[int | None, list[dict]] = {None: []}
+
+    def clear(self) -> None:
+        self.categories.clear()
+        self.category_ids.clear()
+        self.subcategories.clear()
+        self.subcategory_ids.clear()
+        self.by_category.clear()
+
+    def add_category(self, id: int, name: str) -> None:
+        self.categories[id] = name
+        self.category_ids.setdefault(name, id)
+        self.by_category.setdefault(id, [])
+
+    def add_subcategory(self, id: int, category_id: int, name: str) -> None:
+        self.subcategories[id] = (category_id, name)
+        self.subcategory_ids.setdefault((category_id, name), id)
+        self.by_category.setdefault(category_id, []).append(id)
+
+    def build(self) -> None:
+        # responses are prepared once per reload, endpoints only pick the ready lists
+        self.categories_json = [{'id': id, 'name': name} for id, name in sorted(self.categories.items())]
+        self.subcategories_json = {None: [{'id': id, 'name': name} for id, (_, name) in sorted(self.subcategories.items())]}
+        for category_id, ids in self.by_category.items():
+            self.subcategories_json[category_id] = [{'id': id, 'name': self.subcategories[id][1]} for id in sorted(ids)]
+
+    async def load(self, session) -> None:
+        version, _ = await catalog.get_version()
+        categories = (await session.execute(select(database.Categories.id, database.Categories.name))).all()
+        subcategories = (await session.execute(select(
+            database.SubCategories.id, database.SubCategories.category_id, database.SubCategories.name))).all()
+        self.clear()
+        for id, name in categories:
+            self.add_category(id, name)
+        for id, category_id, name in subcategories:
+            self.add_subcategory(id, category_id, name)
+        self.build()
+        self.version = version
+        print(f'Загружено категорий: {len(self.categories)}, подкатегорий: {len(self.subcategories)}')
+
+    def get_categories(self) -> list[dict]:
+        return self.categories_json
+
+    def get_subcategories(self, category_id: int | None = None) -> list[dict]:
+        return self.subcategories_json.get(category_id, [])
+
+
+index = Taxonomy()
+
+
+async def refresh() -> None:
+    catalog.cache['expires'] = 0.0
+    async with database.sessions() as session:
+        await index.load(session)
+
+
+async def ensure_current() -> Taxonomy:
+    # no query while the cached catalog version is fresh and unchanged
+    version, _ = await catalog.get_version()
+    if version != index.version:
+        await refresh()
+    return index
@@ -0,0 +1,4 @@
+import os
+
+# checkers.py builds the module-level checker on import; tests never call GigaChat
+os.environ.setdefault('ANSWER_CHECKER', 'fake')
@@ -0,0 +1,116 @@
+import asyncio
+import random
+
+import pytest
+
+import checkers
+from checkers import CheckerError, FakeChecker, parse_latency
+
+
+def check(checker: FakeChecker, answer: str, task_answer: str = '42') -> str:
+    return asyncio.run(checker.check_answer(answer, 'условие', task_answer))
+
+
+def test_verdicts_are_deterministic():
+    a = FakeChecker(latency='0', seed=1)
+    b = FakeChecker(latency='0', seed=2)
+    answers = [str(x) for x in range(200)]
+    verdicts = [a.verdict(x, '1000') for x in answers]
+    assert verdicts == [b.verdict(x, '1000') for x in answers]
+    assert verdicts == [a.verdict(x, '1000') for x in answers]
+    assert 0.35 < sum(verdicts) / len(verdicts) < 0.65
+
+
+def test_verdict_modes():
+    assert check(FakeChecker(latency='0', verdicts='exact'), ' 42 ') == 'Да'
+    assert check(FakeChecker(latency='0', verdicts='exact'), '41') == 'Нет'
+    assert check(FakeChecker(latency='0', verdicts='always'), '41') == 'Да'
+    assert check(FakeChecker(latency='0', verdicts='never'), '42') == 'Нет'
+    assert check(FakeChecker(latency='0', correct_rate=0), '41') == 'Нет'
+    assert check(FakeChecker(latency='0', correct_rate=1), '41') == 'Да'
+    with pytest.raises(ValueError):
+        FakeChecker(verdicts='maybe')
+
+
+def test_training_answer_explains_wrong_answers():
+    checker = FakeChecker(latency='0', verdicts='exact')
+    assert asyncio.run(checker.check_training_answer('42', '', 'условие', '42', 'решение')) == 'Да'
+    assert asyncio.run(checker.check_training_answer('41', '', 'условие', '42', 'решение')) != 'Да'
+
+
+@pytest.mark.parametrize('spec, low, high', [
+    ('0.3', 0.3, 0.3),
+    ('fixed:0.3', 0.3, 0.3),
+    ('uniform:0.1,0.8', 0.1, 0.8),
+    ('normal:0.5,0.2', 0, float('inf')),
+    ('lognormal:0.5,0.3', 0, float('inf')),
+    ('exp:0.2', 0, float('inf')),
+    ('exp:0', 0, 0),
+])
+def test_parse_latency(spec, low, high):
+    sampler = parse_latency(spec)
+    rng = random.Random(1)
+    values = [sampler(rng) for _ in range(500)]
+    assert all(low <= x <= high for x in values)
+    rng = random.Random(1)
+    assert values == [sampler(rng) for _ in range(500)]
+
+
+def test_parse_latency_rejects_bad_specs():
+    with pytest.raises(ValueError):
+        parse_latency('gamma:1,2')
+    with pytest.raises(TypeError):
+        parse_latency('uniform:0.1')
+
+
+def outcomes(seed: int, n: int = 1000) -> list[str]:
+    checker = FakeChecker(latency='0', error_rate=0.2, timeout_rate=0.1, timeout=0, seed=seed)
+
+    async def run():
+        res = []
+        for i in range(n):
+            try:
+                await checker.check_answer(str(i), 'условие', '42')
+                res.append('ok')
+            except TimeoutError:
+                res.append('timeout')
+            except CheckerError:
+                res.append('error')
+        return res
+
+    return asyncio.run(run())
+
+
+def test_error_and_timeout_rates():
+    res = outcomes(1518)
+    assert res == outcomes(1518)
+    assert res != outcomes(1519)
+    assert 0.15 < res.count('error') / len(res) < 0.25
+    assert 0.06 < res.count('timeout') / len(res) < 0.14
+
+
+def test_create_checker(monkeypatch):
+    monkeypatch.setenv('FAKE_CHECKER_VERDICTS', 'never')
+    monkeypatch.setenv('FAKE_CHECKER_LATENCY', 'uniform:0,0.01')
+    checker = checkers.create_checker('fake')
+    assert isinstance(checker, FakeChecker) and checker.verdicts == 'never'
+    with pytest.raises(ValueError):
+        checkers.create_checker('oracle')
+
+
+def test_utils_delegates_to_checker(monkeypatch):
+    pytest.importorskip('fastapi')
+    pytest.importorskip('sqlalchemy')
+    import metrics
+    import utils
+
+    monkeypatch.setattr(checkers, 'checker', FakeChecker(latency='0', verdicts='always'))
+    before = metrics.gigachat_requests.get(backend='fake', kind='answer', result='ok')
+    assert asyncio.run(utils.gigachat_check_answer('41', 'условие', '42')) == 'Да'
+    assert metrics.gigachat_requests.get(backend='fake', kind='answer', result='ok') == before + 1
+
+    monkeypatch.setattr(checkers, 'checker', FakeChecker(latency='0', error_rate=1))
+    before = metrics.gigachat_requests.get(backend='fake', kind='training', result='error')
+    with pytest.raises(CheckerError):
+        asyncio.run(utils.gigachat_check_training_answer('41', '', 'условие', '42', 'решение'))
+    assert metrics.gigachat_requests.get(backend='fake', kind='training', result='error') == before + 1
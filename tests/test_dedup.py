@@ -0,0 +1,67 @@
+import random
+
+import pytest
+
+pytest.importorskip('sqlalchemy')
+
+import dedup
+
+WORDS = ['треугольник', 'окружность', 'радиус', 'угол', 'сторона', 'число', 'делится', 'простое', 'сумма',
+         'квадрат', 'площадь', 'точка', 'прямая', 'функция', 'уравнение', 'корень', 'многочлен', 'предел']
+
+
+def text(rng: random.Random, n: int = 60) -> str:
+    return ' '.join(rng.choices(WORDS, k=n))
+
+
+def test_normalize_ignores_markup_and_case():
+    assert dedup.normalize('<p>Найдите&nbsp;ЁЖИКА, x<sup>2</sup></p>') == ['найдите', 'ежика', 'x', '2']
+    assert dedup.signature('<p>Найдите ежика в квадрате</p>') == dedup.signature('найдите ЁЖИКА в   квадрате')
+
+
+def test_signature_shape():
+    assert dedup.signature('') is None
+    assert dedup.signature('<p></p>') is None
+    sig = dedup.signature('одно слово')
+    assert len(sig) == dedup.NUM_PERM and dedup.EMPTY not in sig
+    assert list(dedup.unpack(dedup.pack(sig))) == sig
+
+
+def test_similarity_tracks_jaccard():
+    rng = random.Random(1518)
+    a = text(rng, 200)
+    words = a.split()
+    # change every 20th word: most 3-gram shingles survive
+    b = ' '.join('изменено' if i % 20 == 0 else x for i, x in enumerate(words))
+    close = dedup.similarity(dedup.signature(a), dedup.signature(b))
+    far = dedup.similarity(dedup.signature(a), dedup.signature(text(rng, 200)))
+    assert dedup.similarity(dedup.signature(a), dedup.signature(a)) == 1
+    assert close > 0.6
+    assert far < 0.3
+
+
+def test_lsh_finds_near_duplicates_only():
+    rng = random.Random(1518)
+    index = dedup.LSHIndex(threshold=0.8)
+    texts = {i: text(rng) for i in range(1, 201)}
+    for i, x in texts.items():
+        index.add(i, dedup.signature(x))
+
+    copy = '<p>' + texts[42].upper() + '</p>'
+    assert index.query(dedup.signature(copy)) == (42, 1.0)
+    assert index.query(dedup.signature(texts[42]), exclude=42) is None
+    assert index.query(dedup.signature(text(rng))) is None
+
+    index.remove(42)
+    assert index.query(dedup.signature(copy)) is None
+    assert all(42 not in x for x in index.buckets.values())
+
+
+def test_lsh_prefers_the_lowest_id_on_ties():
+    index = dedup.LSHIndex(threshold=0.8)
+    sig = dedup.signature('найдите площадь треугольника со сторонами три четыре пять')
+    for i in (7, 3, 5):
+        index.add(i, sig)
+    assert index.query(sig) == (3, 1.0)
+    index.clear()
+    assert index.query(sig) is None and index.version is None
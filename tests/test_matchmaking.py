@@ -0,0 +1,71 @@
+from matchmaking import MatchQueue, Matchmaker, Ticket, match_key
+
+PARAMS = {'category': 1, 'subcategory': None, 'level_start': 0, 'level_end': 10, 'count': 5, 'time_limit': 10}
+
+
+def ticket(seq: int, rating: int) -> Ticket:
+    return Ticket(seq, rating, (), 0, seq, None)
+
+
+def test_queue_keeps_rating_order():
+    queue = MatchQueue()
+    tickets = [ticket(i, rating) for i, rating in enumerate([1200, 900, 1500, 900, 1000])]
+    for x in tickets:
+        queue.add(x)
+    assert queue.order == sorted(queue.order)
+    assert [x.user_id for x in queue.neighbours(1100, 99)] == [4, 0]
+    assert [x.user_id for x in queue.neighbours(100, 99)] == [1]
+    assert [x.user_id for x in queue.neighbours(2000, 99)] == [2]
+
+    queue.remove(tickets[0])
+    queue.remove(tickets[0])
+    assert len(queue) == 4 and 0 not in queue.tickets
+    assert [x.user_id for x in queue.neighbours(1100, 99)] == [4, 2]
+
+
+def test_enqueue_pairs_nearest_rating_within_window():
+    mm = Matchmaker(base_window=100, widen_rate=0)
+    assert mm.enqueue(1, 1000, PARAMS, now=0) is None
+    assert mm.enqueue(2, 1300, PARAMS, now=1) is None
+    host, other = mm.enqueue(3, 1050, PARAMS, now=2)
+    # the ticket that waited longer hosts
+    assert (host.user_id, other.user_id) == (1, 3)
+    assert not mm.is_queued(1) and mm.is_queued(2)
+    assert mm.stats(now=2)['matched'] == 1
+
+
+def test_only_same_game_settings_are_matched():
+    mm = Matchmaker(base_window=100, widen_rate=0)
+    assert mm.enqueue(1, 1000, PARAMS, now=0) is None
+    assert mm.enqueue(2, 1000, PARAMS | {'count': 6}, now=0) is None
+    assert mm.enqueue(3, 1000, PARAMS | {'subcategory': ['a', 'b']}, now=0) is None
+    assert mm.enqueue(4, 1000, PARAMS | {'subcategory': ['a', 'b']}, now=0) is not None
+    assert match_key(PARAMS | {'subcategory': ['a']}) == match_key(PARAMS | {'subcategory': ['a']})
+    assert len(mm.queues) == 2
+
+
+def test_sweep_pairs_after_windows_widen():
+    mm = Matchmaker(base_window=50, widen_rate=10, max_window=300)
+    for user_id, rating in ((1, 1000), (2, 1200), (3, 1900), (4, 2000)):
+        assert mm.enqueue(user_id, rating, PARAMS, now=0) is None
+    assert mm.sweep(now=1) == []
+
+    # after 10 s the window is 150: only 1900 and 2000 fit
+    pairs = mm.sweep(now=10)
+    assert [(a.user_id, b.user_id) for a, b in pairs] == [(3, 4)]
+
+    # the window stops at max_window, 200 apart fits after 15 s
+    pairs = mm.sweep(now=15)
+    assert [(a.user_id, b.user_id) for a, b in pairs] == [(1, 2)]
+    assert mm.queues == {} and mm.by_user == {}
+
+
+def test_cancel_and_requeue():
+    mm = Matchmaker(base_window=100, widen_rate=0)
+    mm.enqueue(1, 1000, PARAMS, now=0)
+    # queueing again replaces the old ticket
+    mm.enqueue(1, 1500, PARAMS, now=1)
+    assert mm.enqueue(2, 1000, PARAMS, now=2) is None
+    assert mm.cancel(1) and not mm.cancel(1)
+    assert mm.sweep(now=100) == []
+    assert mm.stats(now=100)['queued'] == 1
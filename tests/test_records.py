@@ -0,0 +1,90 @@
+import asyncio
+import json
+
+import pytest
+
+import records
+from records import RecordReader, iter_records
+
+RECORDS = [{'id': i, 'condition': f'<p>задача {i}, "кавычки" и [скобки], {{}}</p>'} for i in range(50)]
+
+
+def feed_in_chunks(text: str, size: int) -> list[tuple]:
+    reader = RecordReader()
+    res = []
+    for i in range(0, len(text), size):
+        res += reader.feed(text[i:i + size])
+    res += reader.feed('', eof=True)
+    assert reader.done
+    return res
+
+
+@pytest.mark.parametrize('size', [1, 7, 64, 1 << 20])
+@pytest.mark.parametrize('text', [
+    json.dumps(RECORDS, ensure_ascii=False, indent=2),
+    '\ufeff [' + ','.join(json.dumps(x) for x in RECORDS) + ']',
+    '\n'.join(json.dumps(x, ensure_ascii=False) for x in RECORDS) + '\n',
+    '\r\n\r\n'.join(json.dumps(x) for x in RECORDS),
+])
+def test_chunk_boundaries_do_not_matter(text, size):
+    assert feed_in_chunks(text, size) == [(x, None) for x in RECORDS]
+
+
+def test_empty_input():
+    assert feed_in_chunks('', 4) == []
+    assert feed_in_chunks(' \n', 4) == []
+    assert feed_in_chunks('[]', 4) == []
+
+
+def test_broken_lines_are_reported_and_skipped():
+    res = feed_in_chunks('{"id": 1}\n{"id": \n{"id": 3}\n', 5)
+    assert [x for x, _ in res] == [{'id': 1}, None, {'id': 3}]
+    assert res[1][1].startswith('некорректный JSON')
+
+
+def test_broken_array_stops_the_stream():
+    res = feed_in_chunks('[{"id": 1}, {"id": }, {"id": 3}]', 4)
+    assert res[0] == ({'id': 1}, None)
+    assert res[1][0] is None and res[1][1].startswith('некорректный JSON') and len(res) == 2
+
+    assert feed_in_chunks('[{"id": 1}, {"id": 2}', 4)[-1] == (None, 'массив JSON не закрыт')
+
+
+def test_oversized_record_is_not_buffered_forever():
+    reader = RecordReader(max_record_size=100)
+    res = list(reader.feed('[{"id": 1}, {"text": "' + 'x' * 200))
+    assert res[0] == ({'id': 1}, None) and res[1][0] is None and reader.done
+
+
+def test_iter_records_reads_files(tmp_path, monkeypatch):
+    monkeypatch.setattr(records, 'CHUNK_SIZE', 16)
+    array = tmp_path / 'tasks.json'
+    array.write_text(json.dumps(RECORDS, ensure_ascii=False), encoding='utf8')
+    lines = tmp_path / 'tasks.ndjson'
+    with open(lines, 'w', encoding='utf8') as f:
+        for x in RECORDS:
+            records.write_record(f, x)
+    assert list(iter_records(str(array))) == RECORDS
+    assert list(iter_records(str(lines))) == RECORDS
+
+    broken = tmp_path / 'broken.json'
+    broken.write_text('[{"id": 1}, {', encoding='utf8')
+    with pytest.raises(ValueError):
+        list(iter_records(str(broken)))
+
+
+def test_importer_wraps_the_same_reader():
+    pytest.importorskip('sqlalchemy')
+    import importer
+
+    async def body(data: bytes, size: int):
+        for i in range(0, len(data), size):
+            yield data[i:i + size]
+
+    async def collect(data: bytes, size: int):
+        return [x async for x in importer.iter_records(body(data, size))]
+
+    # multi-byte characters split between chunks are decoded correctly
+    data = json.dumps(RECORDS, ensure_ascii=False).encode()
+    assert asyncio.run(collect(data, 3)) == [(x, None) for x in RECORDS]
+    assert asyncio.run(collect(b'{"id": 1}\n{"id": 2}', 4)) == [({'id': 1}, None), ({'id': 2}, None)]
@@ -0,0 +1,117 @@
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+import pytest
+
+pytest.importorskip('aiohttp')
+pytest.importorskip('bs4')
+pytest.importorskip('lxml')
+pytest.importorskip('requests')
+
+from aiohttp import web
+
+# the scraper and the fixture server are scripts run from misc/
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'misc'))
+
+import fixture_server
+import scraper
+
+PROBLEMS = 120
+FIRST_ID = 100000
+
+
+def server_args(**kwargs) -> argparse.Namespace:
+    return argparse.Namespace(**{'problems': PROBLEMS, 'page_size': 50, 'latency': 0.005, 'error_rate': 0,
+                                 'seed': 1518} | kwargs)
+
+
+def scraper_args(base_url: str, out: str, **kwargs) -> argparse.Namespace:
+    return argparse.Namespace(**{'base_url': base_url, 'parent': ['214'], 'total': None, 'out': out,
+                                 'checkpoint': None, 'raw_dir': None, 'concurrency': 4, 'rate': 200, 'jitter': 0,
+                                 'retries': 0, 'timeout': 10, 'retry_failed': False,
+                                 'user_agent': 'test'} | kwargs)
+
+
+async def start_server(app: web.Application) -> tuple[web.AppRunner, str]:
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    host, port = runner.addresses[0][:2]
+    return runner, f'http://{host}:{port}'
+
+
+def counting_app(hits: list[str]) -> web.Application:
+    app = fixture_server.make_app(server_args())
+
+    @web.middleware
+    async def count(request, handler):
+        if request.path == '/view_problem_details_new.php':
+            hits.append(request.query['id'])
+        return await handler(request)
+
+    app.middlewares.append(count)
+    return app
+
+
+def written(path: str) -> int:
+    if not os.path.exists(path):
+        return 0
+    with open(path, 'rb') as f:
+        return f.read().count(b'\n')
+
+
+def read_ids(path: str) -> list[int]:
+    with open(path, encoding='utf8') as f:
+        return [json.loads(line)['id'] for line in f]
+
+
+def test_rate_limiter_spaces_requests():
+    async def run():
+        limiter = scraper.RateLimiter(rate=100)
+        start = time.monotonic()
+        await asyncio.gather(*(limiter.wait() for _ in range(21)))
+        return time.monotonic() - start
+
+    assert asyncio.run(run()) >= 0.19
+
+
+def test_scrape_respects_rate_and_resumes(tmp_path):
+    out = str(tmp_path / 'tasks.ndjson')
+    hits = []
+
+    async def run():
+        runner, url = await start_server(counting_app(hits))
+        try:
+            # interrupted run: cancelled once a part of the problems is written
+            first = asyncio.create_task(scraper.Scraper(scraper_args(url, out)).run())
+            while not first.done() and written(out) < 30:
+                await asyncio.sleep(0.01)
+            assert not first.done(), first.exception()
+            first.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await first
+            interrupted = len(hits)
+
+            start = time.monotonic()
+            await scraper.Scraper(scraper_args(url, out, rate=100)).run()
+            return interrupted, time.monotonic() - start
+        finally:
+            await runner.cleanup()
+
+    interrupted, elapsed = asyncio.run(run())
+    ids = read_ids(out)
+    assert sorted(ids) == list(range(FIRST_ID, FIRST_ID + PROBLEMS))
+    # the second run fetches only what the first one did not write, pages in flight at most once more
+    second = len(hits) - interrupted
+    assert second <= PROBLEMS - 30 + 4
+    # listing pages and problem pages together, at most 100 request starts per second
+    assert elapsed >= (second - 1) / 100
+
+    with open(out + '.state', encoding='utf8') as f:
+        state = json.load(f)
+    assert state['finished'] == ['214'] and state['pending'] == [] and state['failed'] == {}
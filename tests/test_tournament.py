@@ -0,0 +1,56 @@
+import pytest
+
+pytest.importorskip('fastapi')
+pytest.importorskip('sqlalchemy')
+
+from routes.tournament import Tournament
+
+
+def tournament(ratings: dict[int, int]) -> Tournament:
+    t = Tournament(0, 'test', list(ratings), 3, {}, 0)
+    t.ratings = dict(ratings)
+    return t
+
+
+def test_first_round_pairs_neighbours_by_rating():
+    t = tournament({1: 1500, 2: 1400, 3: 1300, 4: 1200})
+    assert t.pairings(t.players) == ([(1, 2), (3, 4)], None)
+
+
+def test_score_groups_come_before_rating():
+    t = tournament({1: 1500, 2: 1400, 3: 1300, 4: 1200})
+    t.scores.update({3: 1, 4: 1})
+    assert t.pairings(t.players) == ([(3, 4), (1, 2)], None)
+
+
+def test_no_rematches_when_avoidable():
+    t = tournament({1: 1500, 2: 1400, 3: 1300, 4: 1200})
+    for a, b in ((1, 2), (3, 4)):
+        t.opponents[a].add(b)
+        t.opponents[b].add(a)
+    pairs, _ = t.pairings(t.players)
+    assert pairs == [(1, 3), (2, 4)]
+    assert all(b not in t.opponents[a] for a, b in pairs)
+
+
+def test_rematch_only_when_nobody_else_is_left():
+    t = tournament({1: 1500, 2: 1400})
+    t.opponents[1].add(2)
+    t.opponents[2].add(1)
+    assert t.pairings(t.players) == ([(1, 2)], None)
+
+
+def test_bye_goes_to_the_lowest_player_without_one():
+    t = tournament({1: 1500, 2: 1400, 3: 1300})
+    assert t.pairings(t.players) == ([(1, 2)], 3)
+    t.byes.add(3)
+    assert t.pairings(t.players) == ([(1, 3)], 2)
+    t.byes |= {1, 2}
+    # everyone had a bye, the lowest gets another one
+    assert t.pairings(t.players)[1] == 3
+
+
+def test_pairings_of_a_subset():
+    # players busy in regular battles are left out of the round
+    t = tournament({1: 1500, 2: 1400, 3: 1300, 4: 1200, 5: 1100})
+    assert t.pairings([1, 3, 4, 5]) == ([(1, 3), (4, 5)], None)
@@ -0,0 +1,81 @@
+from __future__ import annotations
+
+from collections import deque
+from contextlib import contextmanager
+import logging
+import os
+import random
+import time
+
+# Sampling tracer for websocket events: a sampled event records its spans (auth, DB, verdict, broadcasts)
+# with offsets from the start, finished traces are kept in a ring buffer and shown on /traces.
+# TRACE_SAMPLE_RATE=0 (default) disables it, 1 traces every event of the traced kinds.
+
+log = logging.getLogger('olymp.tracing')
+
+SAMPLE_RATE = float(os.getenv('TRACE_SAMPLE_RATE', 0))
+BUFFER_SIZE = int(os.getenv('TRACE_BUFFER_SIZE', 200))
+TRACED_EVENTS = {'send_answer'}
+
+finished: deque[dict] = deque(maxlen=BUFFER_SIZE)
+
+
+class Trace:
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.start = time.perf_counter()
+        self.started = time.time()
+        self.spans: list[dict] = []
+        self.attributes: dict = {}
+
+    @contextmanager
+    def span(self, name: str):
+        start = time.perf_counter()
+        error = None
+        try:
+            yield
+        except BaseException as e:
+            error = type(e).__name__
+            raise
+        finally:
+            span = {'name': name, 'offset_ms': round((start - self.start) * 1000, 3),
+                    'duration_ms': round((time.perf_counter() - start) * 1000, 3)}
+            if error is not None:
+                span['error'] = error
+            self.spans.append(span)
+
+    def set(self, **attributes) -> None:
+        self.attributes.update(attributes)
+
+    def finish(self) -> None:
+        trace = {'name': self.name, 'started': self.started,
+                 'duration_ms': round((time.perf_counter() - self.start) * 1000, 3),
+                 'attributes': self.attributes, 'spans': self.spans}
+        finished.append(trace)
+        log.debug('trace %s', trace)
+
+
+class NullTrace:
+    # stands in for an unsampled event, so the handler code does not branch on sampling
+    @contextmanager
+    def span(self, name: str):
+        yield
+
+    def set(self, **attributes) -> None:
+        pass
+
+    def finish(self) -> None:
+        pass
+
+
+null_trace = NullTrace()
+
+
+def sample(event: str | None) -> Trace | NullTrace:
+    if SAMPLE_RATE > 0 and event in TRACED_EVENTS and random.random() < SAMPLE_RATE:
+        return Trace(event)
+    return null_trace
+
+
+def recent(limit: int = 50) -> list[dict]:
+    return list(finished)[-limit:][::-1]
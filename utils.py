@@ -1,21 +1,59 @@
 from __future__ import annotations
 
+from fastapi import Depends
 from fastapi.responses import JSONResponse
 from fastapi.encoders import jsonable_encoder
-from sqlalchemy import select, insert, update, and_, cast, Integer, func
+from sqlalchemy import select, insert, update, and_, cast, Integer, func, exists
 from sqlalchemy.dialects.postgresql import ARRAY
-from gigachat import GigaChat
 from sqlalchemy.ext import asyncio as s_aio
+from typing import Annotated
 import asyncio
 from dotenv import load_dotenv
 import json
 import os
 import database
+import checkers
+import metrics
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
-def json_response(data: dict) -> JSONResponse:
-    return JSONResponse(jsonable_encoder(data), headers={
-        'Access-Control-Allow-Origin': '*'})
+
+def encode(data) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode()
+
+
+def dumps(data) -> bytes:
+    # plain dicts and lists go straight to the encoder, jsonable_encoder is only a fallback
+    # for values the encoder does not know (pydantic models, sets, ...)
+    try:
+        return encode(data)
+    except TypeError:
+        return encode(jsonable_encoder(data))
+
+
+def dumps_text(data) -> str:
+    return dumps(data).decode()
+
+
+def loads(data: str | bytes):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+class FastJSONResponse(JSONResponse):
+    def render(self, content) -> bytes:
+        return dumps(content)
+
+
+def json_response(data: dict, headers: dict | None = None) -> JSONResponse:
+    return FastJSONResponse(data, headers={
+        'Access-Control-Allow-Origin': '*'} | (headers or {}))
 
 
 async def user_by_id(session, user_id: int) -> database.Users:
@@ -23,6 +61,11 @@ async def user_by_id(session, user_id: int) -> database.Users:
     return user.scalar_one_or_none()
 
 
+# request-scoped session for handlers: one connection and transaction shared with every helper the handler
+# passes it to, committed (or rolled back on an exception) before the response is sent
+Session = Annotated[s_aio.AsyncSession, Depends(database.get_session, scope='function')]
+
+
 async def token_to_user(session, token: str) -> None:
     item = (
         await session.execute(select(database.Users).where(database.Users.token == token.strip()))).scalar_one_or_none()
@@ -32,6 +75,24 @@ async def token_to_user(session, token: str) -> None:
         return item
 
 
+def task_to_dict(item: database.Tasks) -> dict:
+    return {
+        'id': item.id,
+        'level': item.level,
+        'category': item.category,
+        'subcategory': item.subcategory,
+        'condition': item.condition,
+        'solution': item.solution,
+        'source': item.source,
+        'answer_type': item.answer_type,
+        'answer': item.answer
+    }
+
+
+def short_name(user: database.Users) -> str:
+    return f'{user.name} {user.surname[0]}.'
+
+
 def level_to_points(level: int):
     return level * 10
 
@@ -44,48 +105,34 @@ def calculate_elo_rating(rating_a: int, rating_b: int, score_a: float, score_b:
     return int(rating_a_1), int(rating_b_1)
 
 
-def gigachat_check_answer_real(user_answer, task_condition, task_answer):
-    with GigaChat(credentials=os.getenv('GIGACHAT_AUTHORIZATION_KEY'), verify_ssl_certs=False,
-                  scope=os.getenv('GIGACHAT_API_PERS'), timeout=7) as giga:
-        answer = giga.chat(json.dumps({'условие задачи': task_condition,
-                                       'правильный ответ на задачу': task_answer,
-                                       'ответ пользователя': user_answer,
-                                       'формат ответа': 'Да или нет. Только одно слово без размышлений!!',
-                                       'что нужно сделать':
-                                           'проверить совпадает ли ответ пользователя с ответом автора на условие задачи, если ответ пользователя'
-                                           'является синонимом к правильному ответ или ответ юзера верный но без уточнений, если это уточнение не влияет на правильность ответа, нужно засчитывать за правильный без объяснения.'
-                                           'если в задаче несколько пунктов, совпадать должны все!'},
-                                      ensure_ascii=False))
-        return answer.choices[0].message.content
+def calculate_elo_ratings(ratings: list[int], results: list[int], k_factor: int = 32) -> list[int]:
+    # every player is scored against every other one, for two players this is calculate_elo_rating
+    n = len(ratings)
+    if n < 2:
+        return list(ratings)
+    new_ratings = []
+    for i in range(n):
+        change = 0
+        for j in range(n):
+            if i == j:
+                continue
+            expected = 1 / (1 + 10 ** ((ratings[j] - ratings[i]) / 400))
+            score = 1 if results[i] > results[j] else (0 if results[i] < results[j] else 0.5)
+            change += score - expected
+        new_ratings.append(int(ratings[i] + k_factor * change / (n - 1)))
+    return new_ratings
 
 
 async def gigachat_check_answer(user_answer, task_condition, task_answer):
-    return await asyncio.to_thread(
-        gigachat_check_answer_real,
-        user_answer, task_condition, task_answer
-    )
-
-
-def gigachat_check_training_answer_real(user_answer, user_solution, task_condition, task_answer, task_solution):
-    with GigaChat(credentials=os.getenv('GIGACHAT_AUTHORIZATION_KEY'), verify_ssl_certs=False,
-                  scope=os.getenv('GIGACHAT_API_PERS')) as giga:
-        answer = giga.chat(json.dumps({'условие задачи': task_condition,
-                                       'правильный ответ на задачу': task_answer,
-                                       'правильное решение задачи': task_solution,
-                                       'ответ пользователя': user_answer,
-                                       'решение пользователя': user_solution,
-                                       'что нужно сделать':
-                                           'проверить совпадает ли ответ пользователя с правильным ответом на задачу, если он совпадает,'
-                                           ' то вывести Да только одним словом ,'
-                                           ' если не совпадает, проверить решение пользователя, если оно предоставлено, и объяснить где пользователь совершил ошибку, сравнивая с правильным решением задачи, правильное решение и правильный ответ и условие задачи нельзя подвергать сомнению! Если ответ пользователя неверный, то решение пользователя никак НЕ может быть верным и ты не должен с ним соглашаться, необходимо четко указать на ошибку в решении пользователя. в своём объяснении не используй markdown формат ответа, отвечай в виде html!!! правильный ответ нельзя напрямую говорить пользователю ни в коем случае!!! только указывать на его ошибку'}, ensure_ascii=False))
-        return answer.choices[0].message.content
+    backend = checkers.checker
+    with metrics.track_gigachat('answer', backend.name):
+        return await backend.check_answer(user_answer, task_condition, task_answer)
 
 
 async def gigachat_check_training_answer(user_answer, user_solution, task_condition, task_answer, task_solution):
-    return await asyncio.to_thread(
-        gigachat_check_training_answer_real,
-        user_answer, user_solution, task_condition, task_answer, task_solution
-    )
+    backend = checkers.checker
+    with metrics.track_gigachat('training', backend.name):
+        return await backend.check_training_answer(user_answer, user_solution, task_condition, task_answer, task_solution)
 
 
 async def filter_tasks(session: s_aio.AsyncSession, level_start: int, level_end: int, subcategory: str |
@@ -105,6 +152,10 @@ async def filter_tasks(session: s_aio.AsyncSession, level_start: int, level_end:
     if category is not None:
         tasks = tasks.where(database.Tasks.category == category)
     if random_tasks:
+        # flagged near-duplicates would make the same problem come up twice as often
+        tasks = tasks.where(~exists().where(and_(
+            database.TaskSignatures.task_id == database.Tasks.id,
+            database.TaskSignatures.duplicate_of.is_not(None))))
         tasks = tasks.order_by(func.random())
     else:
         tasks = tasks.order_by(database.Tasks.id)
@@ -116,29 +167,9 @@ async def filter_tasks(session: s_aio.AsyncSession, level_start: int, level_end:
         tasks = tasks.where(database.Tasks.answer != '')
 
     tasks2 = (await session.execute(tasks)).scalars().all()
-    tasks_data = [{
-        'id': item.id,
-        'level': item.level,
-        'category': item.category,
-        'subcategory': item.subcategory,
-        'condition': item.condition,
-        'solution': item.solution,
-        'source': item.source,
-        'answer_type': item.answer_type,
-        'answer': item.answer
-    } for item in tasks2]
+    tasks_data = [task_to_dict(item) for item in tasks2]
     if condition and condition.isnumeric() and int(condition):
         item = (await session.execute(select(database.Tasks).where(database.Tasks.id == int(condition)))).scalar_one_or_none()
         if item is not None:
-            tasks_data.insert(0, {
-                'id': item.id,
-                'level': item.level,
-                'category': item.category,
-                'subcategory': item.subcategory,
-                'condition': item.condition,
-                'solution': item.solution,
-                'source': item.source,
-                'answer_type': item.answer_type,
-                'answer': item.answer
-            })
+            tasks_data.insert(0, task_to_dict(item))
     return tasks_data